@@ -23,6 +23,40 @@ module Velvet {
     */
     typedef string read_lib;
 
+    /* A range of hash lengths for a k-mer sweep, following velveth's m,M,s syntax.
+
+        int min_hash_length - the smallest hash length to try (inclusive).
+        int max_hash_length - the largest hash length to try (exclusive).
+        int step - the step between hash lengths, an even integer. Default value is 2.
+
+        @optional step
+    */
+    typedef structure {
+        int min_hash_length;
+        int max_hash_length;
+        int step;
+    } hash_length_range;
+
+    /* Lists of velvetg parameter values to sweep over. Every combination of the given values
+        is assembled from the same velveth output of each hash length.
+
+        list<float> cov_cutoff - coverage cutoff values to try.
+        list<float> exp_cov - expected coverage values to try.
+        list<int> ins_length - insert length values to try.
+
+        min_contig_length is not swept, as the shorter contigs that a larger value drops would
+        decide the N50 selection; the single min_contig_length filters the selected assembly.
+
+        @optional cov_cutoff
+        @optional exp_cov
+        @optional ins_length
+    */
+    typedef structure {
+        list<float> cov_cutoff;
+        list<float> exp_cov;
+        list<int> ins_length;
+    } velvetg_grid;
+
     /* 
         Arguments for run_velvet
 
@@ -32,7 +66,43 @@ module Velvet {
         list<paired_end_lib> read_libraries - Illumina PairedEndLibrary files to assemble
         min_contig_length - integer to filter out contigs with length < min_contig_length
                      from the Velvet output. Default value is 500 (where 0 implies no filter).
+        float min_contig_coverage - filter out contigs with a k-mer coverage (the cov_ value
+                     of the Velvet contig name) < min_contig_coverage before the upload.
+        string report_type - quast for the QUAST report, local for a faster HTML report of the
+                     assembly metrics and plots rendered by the app, or auto (the default) for
+                     the local report for assemblies above the local-report-min-length setting.
+        list<int> hash_lengths - a list of hash lengths to sweep over instead of hash_length; the
+                     assembly with the best contig N50 is kept.
+        hash_length_range hash_length_range - a range of hash lengths to sweep over instead of
+                     hash_length.
+        int max_parallel_jobs - the maximum number of assemblies of a sweep to run at the same
+                     time. Defaults to the number of available CPUs.
+        int num_threads - the number of threads velveth and velvetg may use in total. Defaults to
+                     the number of CPUs available to the container (affinity mask and cgroup quota).
+        int max_threads_per_job - the maximum number of threads of each velveth or velvetg
+                     process, for when several assemblies share a node.
+        velvetg_grid velvetg_grid - velvetg parameter values to sweep over; the values given
+                     here replace the corresponding single valued parameters.
+        bool estimate_coverage - estimate exp_cov and cov_cutoff from the node coverage peak of a
+                     first velvetg pass, then assemble with them. Numbers given for exp_cov or
+                     cov_cutoff are kept.
+        bool binary_sequences - store the reads in velveth's binary CnyUnifiedSeq format instead
+                     of the Sequences text file; in a sweep only the first velveth parses the reads.
+        int expected_genome_size - the expected genome size in bp, for the NG50 and NG90 of the
+                     assembly metrics.
 
+        @optional hash_length
+        @optional hash_lengths
+        @optional hash_length_range
+        @optional max_parallel_jobs
+        @optional num_threads
+        @optional max_threads_per_job
+        @optional velvetg_grid
+        @optional estimate_coverage
+        @optional binary_sequences
+        @optional expected_genome_size
+        @optional min_contig_coverage
+        @optional report_type
         @optional min_contig_length
         @optional cov_cutoff
         @optional ins_length
@@ -55,17 +125,136 @@ module Velvet {
         bool amos_file;
         float exp_cov;
         float long_cov_cutoff;
+
+        list<int> hash_lengths;
+        hash_length_range hash_length_range;
+        int max_parallel_jobs;
+        int num_threads;
+        int max_threads_per_job;
+        velvetg_grid velvetg_grid;
+        bool estimate_coverage;
+        bool binary_sequences;
+        int expected_genome_size;
+        float min_contig_coverage;
+        string report_type;
     } VelvetParams;
     
+    /* Result and resource usage of one stage of the pipeline.
+
+    string stage - staging, velveth, velvetg, velvetg-coverage for the coverage estimation
+        pass, filter, upload, quast or report.
+    int hash_length - the hash length of the assembly.
+    string status - ok, failed, timeout, stalled, cancelled or oom (killed by the out of
+        memory killer).
+    string error - why the stage did not succeed, null if it did.
+    float wall_time - the elapsed time in seconds.
+    float user_cpu_time - the user CPU time in seconds.
+    float system_cpu_time - the system CPU time in seconds.
+    int max_rss - the peak resident set size in kilobytes.
+    int read_bytes - the bytes read from storage.
+    int write_bytes - the bytes written to storage.
+    int return_code - the return code of the process.
+
+    */
+    typedef structure {
+        string stage;
+        int hash_length;
+        string status;
+        string error;
+        float wall_time;
+        float user_cpu_time;
+        float system_cpu_time;
+        int max_rss;
+        int read_bytes;
+        int write_bytes;
+        int return_code;
+    } StageMetrics;
+
+    /* One attempt of the assembly. An assembly that runs out of memory is attempted again
+    with the next applicable step of the oom-retry-ladder setting.
+
+    int attempt - the number of the attempt, starting at 1.
+    string retry_step - the retry step applied before this attempt, null for the first one.
+    string status - the status of the assembly, as in StageMetrics.
+    string error - why the assembly did not succeed, null if it did.
+
+    */
+    typedef structure {
+        int attempt;
+        string retry_step;
+        string status;
+        string error;
+    } AssemblyAttempt;
+
+    /* A contig length histogram with logarithmic bins.
+
+    list<int> edges - the bin edges in bp, one more than there are bins.
+    list<int> counts - the number of contigs in each bin.
+
+    */
+    typedef structure {
+        list<int> edges;
+        list<int> counts;
+    } LengthHistogram;
+
+    /* Contiguity and composition metrics of the assembled contigs.
+
+    int contigs - the number of contigs.
+    int total_length - the total length of the contigs in bp.
+    int largest_contig - the length of the largest contig.
+    float mean_length - the mean contig length.
+    int n50, n90 - the length of the contig at which the contigs, from long to short, cover
+        50% and 90% of the total length.
+    int l50, l90 - the number of contigs up to n50 and n90.
+    int ng50, ng90, lg50, lg90 - n50, n90, l50 and l90 of the expected genome size, null
+        without it or when the contigs don't cover enough of it.
+    int expected_genome_size - the expected_genome_size parameter.
+    float aun - the area under the Nx curve, the length weighted mean contig length.
+    float gc_content - the GC content of the called (non N) bases in percent.
+    int gaps - the number of runs of Ns (scaffold gaps).
+    int gap_length - the number of Ns.
+    LengthHistogram length_histogram - the contig length distribution.
+
+    */
+    typedef structure {
+        int contigs;
+        int total_length;
+        int largest_contig;
+        float mean_length;
+        int n50;
+        int n90;
+        int l50;
+        int l90;
+        int ng50;
+        int ng90;
+        int lg50;
+        int lg90;
+        int expected_genome_size;
+        float aun;
+        float gc_content;
+        int gaps;
+        int gap_length;
+        LengthHistogram length_histogram;
+    } AssemblyMetrics;
+
     /* Output parameter items for run_velvet
 
     report_name - the name of the KBaseReport.Report workspace object.
     report_ref - the workspace reference of the report.
+    string assembly_ref - the workspace reference of the assembly, null if none was saved.
+    list<StageMetrics> stage_metrics - the result and resource usage of every stage that ran.
+    list<AssemblyAttempt> attempts - the attempts of the assembly.
+    AssemblyMetrics assembly_metrics - the metrics of the assembled contigs, null if there are
+        none.
 
     */
     typedef structure {
         string report_name;
         string report_ref;
+        string assembly_ref;
+        list<StageMetrics> stage_metrics;
+        list<AssemblyAttempt> attempts;
+        AssemblyMetrics assembly_metrics;
     } VelvetResults;
     
     /* 
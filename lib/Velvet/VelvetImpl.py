@@ -1,21 +1,38 @@
 # -*- coding: utf-8 -*-
 #BEGIN_HEADER
 # The header block is where all import statments should live
+import json
+import math
 import os
 import re
-import subprocess
+import shutil
+import tempfile
 import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pprint import pprint, pformat
 
-import numpy as np
-
 from installed_clients.AssemblyUtilClient import AssemblyUtil
 from installed_clients.KBaseReportClient import KBaseReport
 from installed_clients.ReadsUtilsClient import ReadsUtils
 from installed_clients.WorkspaceClient import Workspace as workspaceService
-from installed_clients.baseclient import ServerError
+from installed_clients.baseclient import ServerError, set_session_pool
 from installed_clients.kb_quastClient import kb_quast
+from Velvet.assembly_metrics import NX_FRACTIONS, assembly_metrics
+from Velvet.contig_filter import contig_coverage, filter_contigs
+from Velvet.coverage import COVERAGE_ESTIMATOR_SETTINGS, estimate_coverage
+from Velvet.diskcache import DiskCache, cache_key, file_digest, link_or_copy
+from Velvet.executor import (STATUS_CANCELLED, STATUS_FAILED, STATUS_OK, STATUS_OOM,
+                             StageFailed, install_signal_handlers, new_result, reset_cancel,
+                             run_call, run_process)
+from Velvet.fasta_stats import scan_fasta
+from Velvet.html_report import render_report
+from Velvet.resource_planner import (estimate_assembly_resources, format_bytes,
+                                     get_free_disk, get_memory_limit, scan_reads_file)
+from Velvet.staging import compress_files
+from Velvet.subsample import PAIRED_UNIT, subsample_file
+from Velvet.velvet_builds import build_cost, find_builds, probe_build, select_build
+from Velvet.workdirs import JobWorkDir, prune_work_dirs
 #END_HEADER
 
 
@@ -41,7 +58,7 @@ class Velvet:
     # state. A method could easily clobber the state set by another while
     # the latter method is running.
     ######################################### noqa
-    VERSION = "1.0.4"
+    VERSION = "1.1.0"
     GIT_URL = "https://github.com/kbaseapps/kb_Velvet"
     GIT_COMMIT_HASH = "8acfabe13452a4b837bd18f47604681f179e6682"
 
@@ -49,12 +66,57 @@ class Velvet:
     # Class variables and functions can be defined in this block
     VELVETH = '/kb/module/velvet/velveth'
     VELVETG = '/kb/module/velvet/velvetg'
+    # the Velvet builds with smaller limits that are installed by the Dockerfile
+    VELVET_BUILDS = '/kb/module/velvet-builds'
     VELVET_DATA = '/kb/module/work/tmp'
+    # the compilation settings in the Dockerfile, used if velveth can't be probed
+    DEFAULT_CATEGORIES = 57
+    DEFAULT_MAX_KMER_LENGTH = 127
+    # velveth reads formats by file extension
+    READS_FORMATS = {'fq': 'fastq', 'fastq': 'fastq', 'fa': 'fasta', 'fasta': 'fasta',
+                     'fna': 'fasta', 'fas': 'fasta'}
+    # the velveth output that velvetg reads, and that is kept in the velveth cache
+    VELVETH_OUTPUT_FILES = ['Sequences', 'Roadmaps']
+    # the reads in velveth's binary format, which replace Sequences with -create_binary
+    BINARY_SEQUENCE_FILES = ['CnyUnifiedSeq', 'CnyUnifiedSeq.names']
+    # velveth/velvetg files that are not needed once contigs.fa has been written
+    VELVET_INTERMEDIATE_FILES = ['Sequences', 'CnyUnifiedSeq', 'CnyUnifiedSeq.names', 'Roadmaps',
+                                 'PreGraph', 'Graph', 'Graph2', 'LastGraph']
+    # velvetg parameters left out of the coverage estimation pass
+    COVERAGE_PASS_SKIPPED_PARAMS = ['exp_cov', 'cov_cutoff', 'long_cov_cutoff', 'read_trkg',
+                                    'amos_file', 'min_contig_length']
+    # the steps of the oom-retry-ladder setting, see apply_retry_step
+    OOM_RETRY_STEPS = ['serial', 'drop-read-tracking', 'smaller-build', 'subsample']
     #VELVET_DATA = '/kb/module/test/data'
     PARAM_IN_WS = 'workspace_name'
     PARAM_IN_CS_NAME = 'output_contigset_name'
     PARAM_IN_MIN_CONTIG_LENGTH = 'min_contig_length'
     PARAM_IN_HASH_LENGTH = 'hash_length'
+    PARAM_IN_HASH_LENGTHS = 'hash_lengths'
+    PARAM_IN_HASH_LENGTH_RANGE = 'hash_length_range'
+    PARAM_IN_MAX_PARALLEL_JOBS = 'max_parallel_jobs'
+    PARAM_IN_NUM_THREADS = 'num_threads'
+    PARAM_IN_MAX_THREADS_PER_JOB = 'max_threads_per_job'
+    PARAM_IN_VELVETG_GRID = 'velvetg_grid'
+    PARAM_IN_ESTIMATE_COVERAGE = 'estimate_coverage'
+    PARAM_IN_BINARY_SEQUENCES = 'binary_sequences'
+    PARAM_IN_EXPECTED_GENOME_SIZE = 'expected_genome_size'
+    PARAM_IN_MIN_CONTIG_COVERAGE = 'min_contig_coverage'
+    PARAM_IN_REPORT_TYPE = 'report_type'
+    # the files of a QUAST cache entry: the run_QUAST result and the QUAST summary table
+    QUAST_RESULT_FILE = 'result.json'
+    QUAST_SUMMARY_FILE = 'report.tsv'
+    # the file of a run index entry with the output of the run
+    RUN_RESULT_FILE = 'result.json'
+    # the file of a reads cache entry with the download_reads output of the library
+    READS_INFO_FILE = 'reads.json'
+    READS_FILE_KEYS = ['fwd', 'rev']
+    # auto chooses the local report for assemblies of at least local-report-min-length bp
+    REPORT_TYPES = ['auto', 'quast', 'local']
+    # the velvetg parameters that can be swept over, with their types
+    # min_contig_length is no grid parameter: a stricter length filter always raises the N50,
+    # so it would decide the selection of the sweep; it filters the selected assembly instead
+    VELVETG_GRID_PARAMS = [('cov_cutoff', float), ('exp_cov', float), ('ins_length', int)]
 
     INVALID_WS_OBJ_NAME_RE = re.compile('[^\\w\\|._-]')
     INVALID_WS_NAME_RE = re.compile('[^\\w:._-]')
@@ -77,11 +139,57 @@ class Velvet:
             raise ValueError(self.PARAM_IN_LIB + ' must be a list')
         if not params[self.PARAM_IN_LIB]:
             raise ValueError('At least one reads library must be provided')
-        if self.PARAM_IN_HASH_LENGTH not in params or params[self.PARAM_IN_HASH_LENGTH] is None:
+        if (params.get(self.PARAM_IN_HASH_LENGTH) is None and
+                not params.get(self.PARAM_IN_HASH_LENGTHS) and
+                not params.get(self.PARAM_IN_HASH_LENGTH_RANGE)):
             raise ValueError(self.PARAM_IN_HASH_LENGTH + ' parameter is required')
-        if self.PARAM_IN_HASH_LENGTH in params:
+        if params.get(self.PARAM_IN_HASH_LENGTH) is not None:
             if not isinstance(params[self.PARAM_IN_HASH_LENGTH], int):
                 raise ValueError(self.PARAM_IN_HASH_LENGTH + ' must be of type int')
+        if params.get(self.PARAM_IN_HASH_LENGTHS):
+            if type(params[self.PARAM_IN_HASH_LENGTHS]) != list:
+                raise ValueError(self.PARAM_IN_HASH_LENGTHS + ' must be a list')
+            for k in params[self.PARAM_IN_HASH_LENGTHS]:
+                if not isinstance(k, int) or k < 1:
+                    raise ValueError(self.PARAM_IN_HASH_LENGTHS + ' must contain positive integers')
+        if params.get(self.PARAM_IN_HASH_LENGTH_RANGE):
+            krange = params[self.PARAM_IN_HASH_LENGTH_RANGE]
+            for key in ['min_hash_length', 'max_hash_length']:
+                if not isinstance(krange.get(key), int) or krange[key] < 1:
+                    raise ValueError(self.PARAM_IN_HASH_LENGTH_RANGE + '.' + key +
+                                     ' must be a positive integer')
+            if krange['min_hash_length'] >= krange['max_hash_length']:
+                raise ValueError(self.PARAM_IN_HASH_LENGTH_RANGE + '.min_hash_length must be ' +
+                                 'smaller than max_hash_length')
+            step = krange.get('step')
+            if step is not None and (not isinstance(step, int) or step < 2 or step % 2):
+                raise ValueError(self.PARAM_IN_HASH_LENGTH_RANGE + '.step must be an even integer')
+        if params.get(self.PARAM_IN_MAX_PARALLEL_JOBS) is not None:
+            if (not isinstance(params[self.PARAM_IN_MAX_PARALLEL_JOBS], int) or
+                    params[self.PARAM_IN_MAX_PARALLEL_JOBS] < 1):
+                raise ValueError(self.PARAM_IN_MAX_PARALLEL_JOBS + ' must be a positive integer')
+        if params.get(self.PARAM_IN_VELVETG_GRID):
+            unknown = set(params[self.PARAM_IN_VELVETG_GRID]) - set(
+                name for name, _ in self.VELVETG_GRID_PARAMS)
+            if unknown:
+                raise ValueError(self.PARAM_IN_VELVETG_GRID + ' can only sweep ' + ', '.join(
+                    name for name, _ in self.VELVETG_GRID_PARAMS) + ', not ' +
+                    ', '.join(sorted(unknown)))
+            for name, cast in self.VELVETG_GRID_PARAMS:
+                values = params[self.PARAM_IN_VELVETG_GRID].get(name)
+                if values is None:
+                    continue
+                if type(values) != list:
+                    raise ValueError(self.PARAM_IN_VELVETG_GRID + '.' + name + ' must be a list')
+                for v in values:
+                    if isinstance(v, bool) or not isinstance(v, (int, float)) or v < 0:
+                        raise ValueError(self.PARAM_IN_VELVETG_GRID + '.' + name +
+                                         ' must contain non-negative numbers')
+        for param in [self.PARAM_IN_NUM_THREADS, self.PARAM_IN_MAX_THREADS_PER_JOB,
+                      self.PARAM_IN_EXPECTED_GENOME_SIZE]:
+            if params.get(param) is not None:
+                if not isinstance(params[param], int) or params[param] < 1:
+                    raise ValueError(param + ' must be a positive integer')
         if (self.PARAM_IN_CS_NAME not in params or
                 not params[self.PARAM_IN_CS_NAME]):
             raise ValueError(self.PARAM_IN_CS_NAME + ' parameter is required')
@@ -91,6 +199,27 @@ class Velvet:
         if self.PARAM_IN_MIN_CONTIG_LENGTH in params:
             if not isinstance(params[self.PARAM_IN_MIN_CONTIG_LENGTH], int):
                 raise ValueError(self.PARAM_IN_MIN_CONTIG_LENGTH + ' must be of type int')
+        if params.get(self.PARAM_IN_MIN_CONTIG_COVERAGE) is not None:
+            coverage = params[self.PARAM_IN_MIN_CONTIG_COVERAGE]
+            if isinstance(coverage, bool) or not isinstance(coverage, (int, float)) or coverage < 0:
+                raise ValueError(self.PARAM_IN_MIN_CONTIG_COVERAGE +
+                                 ' must be a non-negative number')
+        if params.get(self.PARAM_IN_REPORT_TYPE):
+            if params[self.PARAM_IN_REPORT_TYPE] not in self.REPORT_TYPES:
+                raise ValueError(self.PARAM_IN_REPORT_TYPE + ' must be one of ' +
+                                 ', '.join(self.REPORT_TYPES))
+
+    def get_reads_format(self, path):
+        """
+        Returns the velveth format of a reads file from its extension, e.g. fastq for .fq and
+        fastq.gz for .fq.gz files.
+        """
+        suffix = ''
+        if path.endswith('.gz'):
+            path = path[:-3]
+            suffix = '.gz'
+        fext = os.path.splitext(path)[1].replace('.', '').lower()
+        return self.READS_FORMATS.get(fext, fext) + suffix
 
     def construct_velveth_cmd(self, params):
         if params.get('reads_channels', None) is not None:
@@ -104,7 +233,7 @@ class Velvet:
                 ftype = reads['type']
                 fwd = reads['fwd_file']
                 pprint('forward: ' + fwd + ' of file type ' + ftype)
-                fext = (os.path.splitext(fwd)[1]).replace(".", "")
+                fext = self.get_reads_format(fwd)
                 if ftype == 'single':
                     file_info = {'read_file_name': fwd}
                     reads_channels.append({
@@ -141,7 +270,7 @@ class Velvet:
         if 'sequence_files' in params:
                 sq_files = ' '.join(params['sequence_files'])
                 if( sq_files != ''):
-                        fext = (os.path.splitext(params['sequence_files'][0])[1]).replace(".", "")
+                        fext = self.get_reads_format(params['sequence_files'][0])
                         file_info = {
                                 'read_file_name': sq_files
                         }
@@ -152,25 +281,28 @@ class Velvet:
                         })
 
         # STEP 3: construct the command for running velveth
+        data_dir = params.get('work_dir') or self.VELVET_DATA
         out_folder = params['out_folder']
         hash_length = params[self.PARAM_IN_HASH_LENGTH]
         wsname = params[self.PARAM_IN_WS]
-        vh_cmd = [self.VELVETH]
+        vh_cmd = [(params.get('velvet_build') or {}).get('velveth') or self.VELVETH]
         vh_cmd.append(out_folder)
         vh_cmd.append(str(hash_length))
+        if params.get(self.PARAM_IN_BINARY_SEQUENCES):
+            vh_cmd.append('-create_binary')
 
         for rc in reads_channels:
             vh_cmd.append('-' + rc['file_format'])
             vh_cmd.append('-' + rc['read_type'])
             if 'read_reference' in rc and rc['read_reference'] == 1:
-                vh_cmd.append(os.path.join(self.VELVET_DATA, rc['read_file_info']['reference_file']))
+                vh_cmd.append(os.path.join(data_dir, rc['read_file_info']['reference_file']))
 
             if 'file_layout' in rc and rc['file_layout'] == 'separate':
                 vh_cmd.append('-' + rc['file_layout'])
-                vh_cmd.append(os.path.join(self.VELVET_DATA, rc['read_file_info']['left_file']))
-                vh_cmd.append(os.path.join(self.VELVET_DATA, rc['read_file_info']['right_file']))
+                vh_cmd.append(os.path.join(data_dir, rc['read_file_info']['left_file']))
+                vh_cmd.append(os.path.join(data_dir, rc['read_file_info']['right_file']))
             else:
-                vh_cmd.append(os.path.join(self.VELVET_DATA, rc['read_file_info']['read_file_name']))
+                vh_cmd.append(os.path.join(data_dir, rc['read_file_info']['read_file_name']))
 
         # STEP 3 return vh_cmd
         print('Velveth CMD:')
@@ -183,7 +315,7 @@ class Velvet:
         wsname = params[self.PARAM_IN_WS]
 
         # STEP 2: construct the command for running velvetg
-        vg_cmd = [self.VELVETG]
+        vg_cmd = [(params.get('velvet_build') or {}).get('velvetg') or self.VELVETG]
         vg_cmd.append(out_folder)
         #appending the standard optional inputs
         if (params.get(self.PARAM_IN_MIN_CONTIG_LENGTH, None) is not None and
@@ -222,49 +354,416 @@ class Velvet:
         print(' '.join(vg_cmd))
         return vg_cmd
 
-    def exec_velveth(self, params):
+    def get_stage_timeout(self, stage):
+        """
+        Returns the wall clock limit in seconds of a pipeline stage from deploy.cfg, or None.
+        The coverage estimation pass of velvetg shares the velvetg limit.
+        """
+        return float(self.cfg.get(stage.split('-')[0] + '-timeout') or 0) or None
+
+    def record_stage(self, result, stage, hash_length, stage_metrics=None):
+        """
+        Logs the result of a pipeline stage and appends it to stage_metrics when it is given.
+        Raises StageFailed if the stage did not succeed.
+        """
+        result['stage'] = stage
+        result['hash_length'] = hash_length
+        self.log('{stage} {status}: wall {wall_time:.1f}s, user {user_cpu_time:.1f}s, '
+                 'sys {system_cpu_time:.1f}s, peak RSS {max_rss} KB, '
+                 'read {read_bytes} B, written {write_bytes} B'.format(**result))
+        if stage_metrics is not None:
+            stage_metrics.append(result)
+        if result['status'] != STATUS_OK:
+            result['error'] = 'Error running ' + stage.upper() + ', ' + result['error']
+            raise StageFailed(result)
+        return result
+
+    def run_stage(self, stage, cmd, params, stage_metrics=None):
+        """
+        Runs one Velvet binary in its own process group under the stage's time limit and the
+        stall watchdog, which watches the growth of params['out_folder'].
+        Returns the stage result; raises StageFailed if the stage did not succeed.
+        """
+        result = run_process(cmd, cwd=params.get('work_dir') or self.scratch,
+                             env=self.velvet_env(params),
+                             timeout=self.get_stage_timeout(stage),
+                             stall_timeout=self.stall_timeout, watch=[params['out_folder']])
+        return self.record_stage(result, stage, params.get(self.PARAM_IN_HASH_LENGTH),
+                                 stage_metrics)
+
+    def run_call_stage(self, stage, hash_length, stage_metrics, func, *args):
+        """
+        Runs a Python stage of the pipeline (e.g. upload or report) under the stage's time limit.
+        Returns the return value of func; raises the exception of func if it failed and
+        StageFailed if it timed out or the job was cancelled.
+        """
+        result = run_call(func, args, timeout=self.get_stage_timeout(stage))
+        value = result.pop('value', None)
+        exception = result.pop('exception', None)
+        try:
+            self.record_stage(result, stage, hash_length, stage_metrics)
+        except StageFailed:
+            if exception is not None:
+                raise exception
+            raise
+        return value
+
+    def get_velvet_build_id(self, binary):
+        """
+        Returns a digest identifying a Velvet binary, so that cached velveth output is never
+        reused across Velvet builds.
+        """
+        if binary not in self._build_ids:
+            self._build_ids[binary] = file_digest(binary)
+        return self._build_ids[binary]
+
+    def velveth_cache_key(self, params, velveth_cmd):
+        """
+        Returns the velveth cache key for velveth_cmd: a digest of the Velvet build, the hash
+        length and the channel layout, with every reads file replaced by the versioned
+        workspace reference it was downloaded from (or by its contents' digest).
+        Returns None if the inputs can't be identified.
+        """
+        identities = {}
+        for rd in params.get('reads_files') or []:
+            for key in ['fwd_file', 'rev_file']:
+                if rd.get(key) and rd.get('ref'):
+                    identities[os.path.join(params.get('work_dir') or self.VELVET_DATA,
+                                            rd[key])] = rd['ref'] + ':' + key
+        try:
+            parts = [self.get_velvet_build_id(velveth_cmd[0]), velveth_cmd[2]]
+            for arg in velveth_cmd[3:]:
+                if arg.startswith('-'):
+                    # compressed staging doesn't change the reads
+                    parts.append(arg[:-3] if arg.endswith('.gz') else arg)
+                else:
+                    parts.append(identities.get(arg) or file_digest(arg))
+        except (IOError, OSError) as e:
+            self.log('Not caching velveth output: ' + str(e))
+            return None
+        return cache_key(*parts)
+
+    def velveth_output_files(self, params):
+        """
+        Returns the names of the velveth output files that velvetg reads.
+        """
+        if params.get(self.PARAM_IN_BINARY_SEQUENCES):
+            return self.BINARY_SEQUENCE_FILES + ['Roadmaps']
+        return self.VELVETH_OUTPUT_FILES
+
+    def exec_velveth(self, params, stage_metrics=None):
+        """
+        Runs velveth, or restores its output from the velveth cache.
+        With params['reuse_binary'], the binary sequences of the same reads must already be
+        in params['out_folder'] and velveth only hashes them instead of parsing the reads.
+        """
         self.log('Running run_velveth with params:\n' + pformat(params))
         velveth_cmd = self.construct_velveth_cmd(params)
+        out_folder = params['out_folder']
+        output_files = self.velveth_output_files(params)
+        reuse_binary = (params.get(self.PARAM_IN_BINARY_SEQUENCES) and
+                        params.get('reuse_binary'))
 
-        p = subprocess.Popen(velveth_cmd, cwd=self.scratch, shell=False)
-        retcode = p.wait()
+        key = None
+        if self.velveth_cache is not None:
+            # the key of the full command, as the reused binary sequences are the same reads
+            key = self.velveth_cache_key(params, velveth_cmd)
+            if key and self.velveth_cache.restore(key, out_folder, output_files):
+                self.log('Reusing cached velveth output ' + key)
+                return dict(new_result('velveth'),
+                            hash_length=params.get(self.PARAM_IN_HASH_LENGTH))
+        # velveth truncates its output files in place, which would also truncate any cache
+        # entry still hard linked to them
+        for name in output_files:
+            if reuse_binary and name in self.BINARY_SEQUENCE_FILES:
+                continue
+            if os.path.lexists(os.path.join(out_folder, name)):
+                os.remove(os.path.join(out_folder, name))
+        if reuse_binary:
+            velveth_cmd = velveth_cmd[:3] + ['-reuse_binary']
+            self.log('Reusing the binary sequences: ' + ' '.join(velveth_cmd))
 
-        self.log('Return code: ' + str(retcode))
-        if p.returncode != 0:
-            raise ValueError('Error running VELVETH, return code: ' + str(retcode) + '\n')
+        result = self.run_stage('velveth', velveth_cmd, params, stage_metrics)
 
-        return p.returncode
+        if key:
+            self.velveth_cache.put(key, {name: os.path.join(out_folder, name)
+                                         for name in output_files})
+        return result
 
-    def exec_velvetg(self, params):
+    def exec_velvetg(self, params, stage_metrics=None):
         self.log('Running run_velvetg with params:\n' + pformat(params))
         velvetg_cmd = self.construct_velvetg_cmd(params)
-        p = subprocess.Popen(velvetg_cmd, cwd=self.scratch, shell=False)
-        retcode = p.wait()
-        self.log('Return code: ' + str(p.returncode))
-        if p.returncode != 0:
-            raise ValueError('Error running VELVETG, return code: ' + str(p.returncode) + '\n')
-
-        return p.returncode
-
-    def exec_velvet(self, params, reads_data):
-        outdir = os.path.join(self.scratch, 'velvet_output_dir')
-        if not os.path.exists(outdir):
-            os.makedirs(outdir)
-        tmpdir = os.path.join(self.scratch, 'velvet_tmp_dir')
-        if not os.path.exists(tmpdir):
-            os.makedirs(tmpdir)
+        return self.run_stage('velvetg', velvetg_cmd, params, stage_metrics)
+
+    def estimate_velvetg_coverage(self, params, stage_metrics=None):
+        """
+        Runs a quick first velvetg pass, without coverage cutoffs or repeat resolution, on the
+        velveth output in params['out_folder'] and estimates exp_cov and cov_cutoff from the
+        length weighted node coverage peak in its stats.txt.
+        Returns a dict with exp_cov and cov_cutoff, or an empty dict if there is no peak.
+        """
+        self.log('Running the coverage estimation pass of velvetg')
+        first_pass = {key: value for key, value in params.items()
+                      if key not in self.COVERAGE_PASS_SKIPPED_PARAMS}
+        velvetg_cmd = self.construct_velvetg_cmd(first_pass)
+        self.run_stage('velvetg-coverage', velvetg_cmd, params, stage_metrics)
+
+        estimate = estimate_coverage(os.path.join(params['out_folder'], 'stats.txt'))
+        if estimate is None:
+            self.log('No coverage peak found, keeping the given exp_cov and cov_cutoff')
+            return {}
+        self.log('Estimated exp_cov {exp_cov} and cov_cutoff {cov_cutoff} for k={}'.format(
+            params.get(self.PARAM_IN_HASH_LENGTH), **estimate))
+        return estimate
+
+    def coverage_overrides(self, params, estimate):
+        """
+        Returns the values of estimate for the coverage parameters that were not set to a
+        number in params.
+        """
+        return {name: value for name, value in (estimate or {}).items()
+                if not isinstance(params.get(name), float)}
+
+    def get_available_cpus(self):
+        """
+        Returns the number of CPUs this container may use: the size of the CPU affinity mask,
+        further limited by the cgroup (v2 or v1) CPU quota when one is set.
+        """
+        try:
+            cpus = len(os.sched_getaffinity(0))
+        except AttributeError:
+            cpus = os.cpu_count() or 1
+        quota = None
+        try:
+            with open('/sys/fs/cgroup/cpu.max') as cpu_max:
+                max_us, period_us = cpu_max.read().split()
+            if max_us != 'max':
+                quota = float(max_us) / float(period_us)
+        except (IOError, OSError, ValueError):
+            for cgroup_dir in ['/sys/fs/cgroup/cpu', '/sys/fs/cgroup/cpu,cpuacct']:
+                try:
+                    with open(os.path.join(cgroup_dir, 'cpu.cfs_quota_us')) as quota_file:
+                        quota_us = int(quota_file.read())
+                    with open(os.path.join(cgroup_dir, 'cpu.cfs_period_us')) as period_file:
+                        period_us = int(period_file.read())
+                except (IOError, OSError, ValueError):
+                    continue
+                if quota_us > 0 and period_us > 0:
+                    quota = float(quota_us) / period_us
+                break
+        if quota is not None:
+            cpus = min(cpus, max(1, int(math.ceil(quota))))
+        return cpus
 
+    def get_threads_per_job(self, params, parallel_jobs=1):
+        """
+        Returns the number of OpenMP threads each velveth/velvetg process may use when
+        parallel_jobs assemblies run at the same time. The thread budget is num_threads
+        (default: all available CPUs), split evenly between the parallel assemblies and capped
+        by max_threads_per_job (or the max-threads-per-job deployment setting) so that several
+        assemblies can share a node without oversubscribing it.
+        """
+        budget = params.get(self.PARAM_IN_NUM_THREADS) or self.get_available_cpus()
+        threads = max(1, budget // max(1, parallel_jobs))
+        max_threads = params.get(self.PARAM_IN_MAX_THREADS_PER_JOB)
+        if max_threads is None and self.cfg.get('max-threads-per-job'):
+            max_threads = int(self.cfg['max-threads-per-job'])
+        if max_threads:
+            threads = min(threads, max_threads)
+        return threads
+
+    def velvet_env(self, params):
+        """
+        Returns the environment for a velveth/velvetg subprocess, with the OpenMP thread count
+        pinned to params['num_threads'] rather than whatever the container inherited.
+        """
+        env = os.environ.copy()
+        if params.get('num_threads'):
+            env['OMP_NUM_THREADS'] = str(params['num_threads'])
+            env['OMP_THREAD_LIMIT'] = str(params['num_threads'])
+        return env
+
+    def probe_velvet_build(self, velveth):
+        """
+        Returns the compilation settings (categories and max_kmer_length) of a velveth binary,
+        as printed by velveth when it is run without arguments.
+        """
+        if velveth in self._velvet_builds:
+            return self._velvet_builds[velveth]
+        build = {'categories': self.DEFAULT_CATEGORIES,
+                 'max_kmer_length': self.DEFAULT_MAX_KMER_LENGTH}
+        try:
+            build.update(probe_build(velveth))
+        except OSError as e:
+            self.log('Could not probe ' + velveth + ': ' + str(e))
+        self._velvet_builds[velveth] = build
+        return build
+
+    def get_velvet_builds(self):
+        """
+        Returns the installed Velvet builds with their compilation settings, or the default
+        build at VELVETH and VELVETG if there are none.
+        """
+        if self.velvet_builds:
+            return self.velvet_builds
+        return [dict(self.probe_velvet_build(self.VELVETH), name='default',
+                     velveth=self.VELVETH, velvetg=self.VELVETG)]
+
+    def get_read_categories(self, reads_data):
+        """
+        Returns the number of short read categories velveth fills with reads_data. Every
+        library goes to the first category (-short or -shortPaired).
+        """
+        return 1 if reads_data else 0
+
+    def select_velvet_build(self, hash_lengths, categories):
+        """
+        Returns the Velvet build with the smallest memory footprint that supports the largest
+        of hash_lengths and the given number of read categories. Falls back to the build with
+        the largest limits, which reduces larger hash lengths to its MAXKMERLENGTH.
+        """
+        builds = self.get_velvet_builds()
+        build = select_build(builds, max(hash_lengths), categories)
+        if build is None:
+            build = max(builds, key=build_cost)
+            self.log('WARNING: no Velvet build supports hash length {} with {} read '
+                     'categories, using {}'.format(max(hash_lengths), categories,
+                                                   build['name']))
+        self.log('Using Velvet build {} (MAXKMERLENGTH={}, CATEGORIES={})'.format(
+            build['name'], build['max_kmer_length'], build['categories']))
+        return build
+
+    def compress_reads(self, params, reads_data):
+        """
+        Replaces the staged reads files of reads_data by level 1 gzipped copies, which velveth
+        reads natively.
+        """
+        paths = [rd[key] for rd in reads_data for key in ['fwd_file', 'rev_file'] if rd.get(key)]
+        before = sum(os.path.getsize(p) for p in paths)
+        compressed = compress_files(paths, self.get_threads_per_job(params))
+        for rd in reads_data:
+            for key in ['fwd_file', 'rev_file']:
+                if rd.get(key) in compressed:
+                    rd[key] = compressed[rd[key]]
+        after = sum(os.path.getsize(p) for p in compressed.values())
+        self.log('Compressed {} staged reads files from {} to {}'.format(
+            len(compressed), format_bytes(before), format_bytes(after)))
+
+    def get_reads_size(self, reads_data):
+        """
+        Returns the total number of reads and bases of the reads libraries, from the
+        ReadsUtils statistics when available or else by sampling the files.
+        """
+        reads = 0
+        bases = 0
+        for rd in reads_data:
+            if rd.get('read_count') and rd.get('total_bases'):
+                reads += rd['read_count']
+                bases += rd['total_bases']
+                continue
+            for key in ['fwd_file', 'rev_file']:
+                if rd.get(key):
+                    size = scan_reads_file(os.path.join(self.VELVET_DATA, rd[key]))
+                    reads += size['reads']
+                    bases += size['bases']
+        return reads, bases
+
+    def plan_resources(self, params, reads_data, hash_lengths, parallel_jobs, build=None):
+        """
+        Predicts the peak memory and scratch disk usage of the assemblies with the given
+        Velvet build (the default build if None) before velveth runs, and returns the plan
+        with the number of assemblies that can run in parallel within the
+        container's memory limit and the free scratch space. Raises a ValueError when not even
+        one assembly fits, unless the preflight-check setting is 'warn' or 'off'.
+        """
+        mode = self.cfg.get('preflight-check') or 'enforce'
+        plan = {'parallel_jobs': parallel_jobs}
+        if mode == 'off':
+            return plan
+        build = build or self.probe_velvet_build(self.VELVETH)
+        reads, bases = self.get_reads_size(reads_data)
+        read_tracking = params.get('read_trkg') in [1, 'yes', 'Yes', 'YES']
+        binary = bool(params.get(self.PARAM_IN_BINARY_SEQUENCES))
+        estimates = [estimate_assembly_resources(reads, bases, k, build['categories'],
+                                                 build['max_kmer_length'], read_tracking,
+                                                 binary)
+                     for k in hash_lengths]
+        memory = max(e['memory'] for e in estimates)
+        disk = max(e['disk'] for e in estimates)
+        memory_limit = get_memory_limit()
+        # the cache entries are hard links to the files the job holds, which the disk
+        # estimate already covers
+        free_disk = get_free_disk(self.scratch)
+        plan.update({'reads': reads, 'bases': bases, 'memory': memory, 'disk': disk,
+                     'memory_limit': memory_limit, 'free_disk': free_disk,
+                     'categories': build['categories'],
+                     'max_kmer_length': build['max_kmer_length']})
+
+        fitting_jobs = parallel_jobs
+        if memory_limit is not None and memory > 0:
+            fitting_jobs = min(fitting_jobs, memory_limit // memory)
+        if disk > 0:
+            fitting_jobs = min(fitting_jobs, free_disk // disk)
+        self.log('Preflight: {} reads, {} bases, predicted {} memory (limit {}) and {} scratch '
+                 '(free {}) per assembly'.format(
+                     reads, bases, format_bytes(memory),
+                     'none' if memory_limit is None else format_bytes(memory_limit),
+                     format_bytes(disk), format_bytes(free_disk)))
+        if fitting_jobs < 1:
+            msg = ('The assembly is predicted to need {} of memory and {} of scratch space, but '
+                   'only {} of memory and {} of scratch space are available. Try a larger hash '
+                   'length or fewer reads.').format(
+                       format_bytes(memory), format_bytes(disk),
+                       'unlimited' if memory_limit is None else format_bytes(memory_limit),
+                       format_bytes(free_disk))
+            if mode == 'enforce':
+                raise ValueError(msg)
+            self.log('WARNING: ' + msg)
+            fitting_jobs = 1
+        if fitting_jobs < parallel_jobs:
+            self.log('Preflight: reducing parallel assemblies from {} to {}'.format(
+                parallel_jobs, fitting_jobs))
+        plan['parallel_jobs'] = int(fitting_jobs)
+        return plan
+
+    def get_hash_lengths(self, params):
+        """
+        Returns the sorted list of distinct odd hash lengths to assemble with, taken from
+        hash_lengths, hash_length_range or hash_length (in that order of precedence).
+        Even hash lengths are decremented, as velveth would do.
+        """
+        if params.get(self.PARAM_IN_HASH_LENGTHS):
+            hash_lengths = params[self.PARAM_IN_HASH_LENGTHS]
+        elif params.get(self.PARAM_IN_HASH_LENGTH_RANGE):
+            krange = params[self.PARAM_IN_HASH_LENGTH_RANGE]
+            hash_lengths = range(krange['min_hash_length'], krange['max_hash_length'],
+                                 krange.get('step') or 2)
+        else:
+            hash_lengths = [params[self.PARAM_IN_HASH_LENGTH]]
+        return sorted(set(k if k % 2 else k - 1 for k in hash_lengths))
+
+    def build_velvet_params(self, params, reads_data, outdir, hash_length, num_threads,
+                            work_dir=None, build=None):
         # build the parameters
         params_h = {
                 'workspace_name': params[self.PARAM_IN_WS],
-                'hash_length': params[self.PARAM_IN_HASH_LENGTH],
+                'hash_length': hash_length,
                 'reads_files': reads_data,
-                'out_folder': outdir
+                'out_folder': outdir,
+                'num_threads': num_threads,
+                'work_dir': work_dir,
+                'velvet_build': build
         }
+        if params.get(self.PARAM_IN_BINARY_SEQUENCES):
+            params_h[self.PARAM_IN_BINARY_SEQUENCES] = 1
         params_g = {
                 'workspace_name': params[self.PARAM_IN_WS],
+                'hash_length': hash_length,
                 'output_contigset_name': params[self.PARAM_IN_CS_NAME],
-                'out_folder': outdir
+                'out_folder': outdir,
+                'num_threads': num_threads,
+                'work_dir': work_dir,
+                'velvet_build': build
         }
         if self.PARAM_IN_MIN_CONTIG_LENGTH in params and not (params[self.PARAM_IN_MIN_CONTIG_LENGTH] is None):
             params_g[self.PARAM_IN_MIN_CONTIG_LENGTH] = params.get(self.PARAM_IN_MIN_CONTIG_LENGTH, 1)
@@ -280,108 +779,976 @@ class Velvet:
             params_g['exp_cov'] = params['exp_cov']
         if 'long_cov_cutoff' in params and not (params['long_cov_cutoff'] is None):
             params_g['long_cov_cutoff'] = params['long_cov_cutoff']
+        if params.get(self.PARAM_IN_ESTIMATE_COVERAGE):
+            params_g[self.PARAM_IN_ESTIMATE_COVERAGE] = 1
+        return params_h, params_g
 
-        ret = 1
+    def assembly_result(self, hash_length, out_folder=None, error=None):
+        """
+        Returns the result of one assembly: a dict with the hash_length, the status (that of
+        the failed stage if error is a StageFailed), the out_folder of a successful assembly
+        and the error message of a failed one.
+        """
+        if error is None:
+            return {'hash_length': hash_length, 'status': STATUS_OK, 'out_folder': out_folder,
+                    'error': None}
+        status = error.result['status'] if isinstance(error, StageFailed) else STATUS_FAILED
+        return {'hash_length': hash_length, 'status': status, 'out_folder': None,
+                'error': str(error)}
+
+    def assemble(self, params_h, params_g, stage_metrics=None):
+        """
+        Runs velveth and then velvetg in params_h['out_folder'], with a coverage estimation
+        pass of velvetg first if params_g asks for it (the estimates are set in params_g).
+        Returns the assembly result.
+        """
+        hash_length = params_h[self.PARAM_IN_HASH_LENGTH]
         try:
-            ret = self.exec_velveth(params_h)
-            while ret != 0:
-                time.sleep(1)
+            self.exec_velveth(params_h, stage_metrics)
         except ValueError as eh:
             self.log('Velveth raised error:\n')
             print(eh)
-        else:#no exception raised by Velveth and Velveth returns 0, then run Velvetg
-            ret = 1
+            return self.assembly_result(hash_length, error=eh)
+        try:
+            if params_g.get(self.PARAM_IN_ESTIMATE_COVERAGE):
+                estimate = self.estimate_velvetg_coverage(params_g, stage_metrics)
+                params_g.update(self.coverage_overrides(params_g, estimate))
+            self.exec_velvetg(params_g, stage_metrics)
+        except ValueError as eg:
+            self.log('Velvetg raised error:\n')
+            print(eg)
+            return self.assembly_result(hash_length, error=eg)
+        return self.assembly_result(hash_length, params_h['out_folder'])
+
+    def get_velvetg_grid(self, params):
+        """
+        Returns the list of velvetg parameter combinations of the velvetg_grid parameter, as
+        dicts of parameter name to value, or [{}] when no grid is requested.
+        """
+        grid = [{}]
+        for name, cast in self.VELVETG_GRID_PARAMS:
+            values = (params.get(self.PARAM_IN_VELVETG_GRID) or {}).get(name)
+            if values:
+                grid = [dict(combo, **{name: cast(v)}) for combo in grid for v in values]
+        return grid
+
+    def summarize_assembly(self, assembly, velvetg_params=None):
+        """
+        Computes the contiguity summary of one assembly result of a sweep.
+        """
+        summary = dict(assembly, contigs=0, total_length=0, n50=0)
+        summary.update(velvetg_params or {})
+        if summary['status'] != STATUS_OK:
+            return summary
+        contigs = os.path.join(summary['out_folder'], 'contigs.fa')
+        if os.path.isfile(contigs) and os.path.getsize(contigs) > 0:
+            metrics = assembly_metrics(self.scan_contigs(contigs))
+            for name in ['contigs', 'total_length', 'n50']:
+                summary[name] = metrics[name]
+        return summary
+
+    def remove_intermediate_files(self, folder):
+        for name in self.VELVET_INTERMEDIATE_FILES:
+            intermediate = os.path.join(folder, name)
+            if os.path.exists(intermediate):
+                os.remove(intermediate)
+
+    def exec_velvet(self, params, reads_data, run_info=None, work_dir=None, build=None):
+        """
+        Runs velveth and velvetg for every requested hash length and velvetg parameter
+        combination, and returns the result of the assembly with the best contig N50. If no
+        assembly succeeded, the returned result has no out_folder and the status of the
+        failed assemblies.
+        When several assemblies are requested, velveth runs once per hash length and the
+        velvetg runs of each hash length share its output through hard links. All of them run
+        on a bounded pool of workers and the per assembly summaries are stored in
+        run_info['sweep'].
+        With estimate_coverage, exp_cov and cov_cutoff are estimated by one extra velvetg pass
+        per hash length. The estimates of a single assembly are stored in run_info['coverage'].
+        The resource usage of every velveth and velvetg run is stored in
+        run_info['stage_metrics'].
+        All files are written to work_dir, which defaults to the scratch folder.
+        The Velvet binaries are those of build, by default the smallest that fits the job.
+        """
+        if run_info is None:
+            run_info = {}
+        stage_metrics = run_info.setdefault('stage_metrics', [])
+        work_dir = work_dir or self.scratch
+        outdir = os.path.join(work_dir, 'velvet_output_dir')
+        tmpdir = os.path.join(work_dir, 'velvet_tmp_dir')
+        if not os.path.exists(tmpdir):
+            os.makedirs(tmpdir)
+
+        hash_lengths = self.get_hash_lengths(params)
+        grid = self.get_velvetg_grid(params)
+        assemblies = len(hash_lengths) * len(grid)
+        max_jobs = 1
+        if assemblies > 1:
+            max_jobs = params.get(self.PARAM_IN_MAX_PARALLEL_JOBS) or self.get_available_cpus()
+            max_jobs = min(max_jobs, assemblies)
+        build = build or self.select_velvet_build(hash_lengths,
+                                                  self.get_read_categories(reads_data))
+        run_info['velvet_build'] = build
+        plan = self.plan_resources(params, reads_data, hash_lengths, max_jobs, build)
+        run_info['resource_plan'] = plan
+        max_jobs = plan['parallel_jobs']
+
+        if assemblies == 1:
+            if not os.path.exists(outdir):
+                os.makedirs(outdir)
+            params_h, params_g = self.build_velvet_params(dict(params, **grid[0]), reads_data,
+                                                          outdir, hash_lengths[0],
+                                                          self.get_threads_per_job(params),
+                                                          work_dir, build)
+            ret = self.assemble(params_h, params_g, stage_metrics)
+            if params.get(self.PARAM_IN_ESTIMATE_COVERAGE):
+                run_info['coverage'] = {'exp_cov': params_g.get('exp_cov'),
+                                        'cov_cutoff': params_g.get('cov_cutoff')}
+            return ret
+
+        num_threads = self.get_threads_per_job(params, max_jobs)
+        self.log('Sweeping hash lengths {} and {} velvetg parameter sets with {} parallel '
+                 'assemblies of {} threads'.format(hash_lengths, len(grid), max_jobs,
+                                                   num_threads))
+
+        def velveth_folder(hash_length):
+            return outdir + '_k' + str(hash_length)
+
+        def velvetg_folder(hash_length, index):
+            if len(grid) == 1:
+                return velveth_folder(hash_length)
+            return velveth_folder(hash_length) + '_' + str(index + 1)
+
+        def new_folder(folder, source=None, names=()):
+            if os.path.exists(folder):
+                shutil.rmtree(folder)
+            os.makedirs(folder)
+            # velveth/velvetg only read these files, so every run can share one copy
+            for name in names:
+                link_or_copy(os.path.join(source, name), os.path.join(folder, name))
+
+        def run_velveth(hash_length, reuse_binary=False):
+            k_outdir = velveth_folder(hash_length)
+            if not reuse_binary:
+                new_folder(k_outdir)
+            params_h, params_g = self.build_velvet_params(params, reads_data, k_outdir,
+                                                          hash_length, num_threads, work_dir,
+                                                          build)
+            params_h['reuse_binary'] = reuse_binary
             try:
-                ret = self.exec_velvetg(params_g)
-                while ret != 0:
-                    time.sleep(1)
+                self.exec_velveth(params_h, stage_metrics)
+            except ValueError as eh:
+                self.log('Velveth raised error:\n')
+                print(eh)
+                return None, eh
+            if not params.get(self.PARAM_IN_ESTIMATE_COVERAGE):
+                return {}, None
+            # one estimation pass serves all velvetg runs of this hash length
+            try:
+                return self.estimate_velvetg_coverage(params_g, stage_metrics), None
             except ValueError as eg:
                 self.log('Velvetg raised error:\n')
                 print(eg)
-            else:#no exception raised by Velvetg and Velvetg returns 0, then move to saving and reporting  
-                ret = outdir
-        return ret
+                return None, eg
+
+        def run_velvetg(hash_length, index, velvetg_params, estimate):
+            g_outdir = velvetg_folder(hash_length, index)
+            if g_outdir != velveth_folder(hash_length):
+                new_folder(g_outdir, velveth_folder(hash_length), self.velveth_output_files(params))
+            velvetg_params = dict(velvetg_params, **self.coverage_overrides(
+                dict(params, **velvetg_params), estimate))
+            _, params_g = self.build_velvet_params(dict(params, **velvetg_params), reads_data,
+                                                   g_outdir, hash_length, num_threads, work_dir,
+                                                   build)
+            try:
+                self.exec_velvetg(params_g, stage_metrics)
+            except ValueError as eg:
+                self.log('Velvetg raised error:\n')
+                print(eg)
+                assembly = self.assembly_result(hash_length, error=eg)
+            else:
+                assembly = self.assembly_result(hash_length, g_outdir)
+            summary = self.summarize_assembly(assembly, velvetg_params)
+            summary['index'] = index
+            # keep the scratch usage of the sweep within what the preflight planned for
+            self.remove_intermediate_files(g_outdir)
+            return summary
 
-    # adapted from
-    # https://github.com/kbaseapps/kb_SPAdes/blob/master/lib/kb_SPAdes/kb_SPAdesImpl.py
-    # which was adapted from
-    # https://github.com/kbase/transform/blob/master/plugins/scripts/convert/trns_transform_KBaseFile_AssemblyFile_to_KBaseGenomes_ContigSet.py
-    def load_stats(self, input_file_name):
-        self.log('Starting conversion of FASTA to KBaseGenomeAnnotations.Assembly')
-        self.log('Building Object.')
-        if not os.path.isfile(input_file_name):
-            raise Exception('The input file name {0} is not a file!'.format(input_file_name))
-        with open(input_file_name, 'r') as input_file_handle:
-            contig_id = None
-            sequence_len = 0
-            fasta_dict = dict()
-            first_header_found = False
-            # Pattern for replacing white space
-            pattern = re.compile(r'\s+')
-            for current_line in input_file_handle:
-                if current_line[0] == '>':
-                    # found a header line
-                    # Wrap up previous fasta sequence
-                    if not first_header_found:
-                        first_header_found = True
+        # in binary mode only the first velveth parses the reads, the others hash its binary
+        # sequences
+        reuse_binary = bool(params.get(self.PARAM_IN_BINARY_SEQUENCES)) and len(hash_lengths) > 1
+        sweep = []
+        with ThreadPoolExecutor(max_workers=max_jobs) as executor:
+            velveth_futures = {executor.submit(run_velveth, k): k
+                               for k in (hash_lengths[:1] if reuse_binary else hash_lengths)}
+            velvetg_futures = []
+            # start the velvetg runs of each hash length as soon as its velveth finishes
+            while velveth_futures:
+                future = next(as_completed(velveth_futures))
+                hash_length = velveth_futures.pop(future)
+                estimate, error = future.result()
+                if reuse_binary and hash_length == hash_lengths[0]:
+                    # link the binary sequences before the velvetg runs of the first hash
+                    # length can remove them
+                    for k in hash_lengths[1:]:
+                        if error is None:
+                            new_folder(velveth_folder(k), velveth_folder(hash_length),
+                                       self.BINARY_SEQUENCE_FILES)
+                        velveth_futures[executor.submit(run_velveth, k, error is None)] = k
+                for index, velvetg_params in enumerate(grid):
+                    if error is None:
+                        velvetg_futures.append(executor.submit(
+                            run_velvetg, hash_length, index, velvetg_params, estimate))
                     else:
-                        fasta_dict[contig_id] = sequence_len
-                        sequence_len = 0
-                    fasta_header = current_line.replace('>', '').strip()
-                    try:
-                        contig_id = fasta_header.strip().split(' ', 1)[0]
-                    except:
-                        contig_id = fasta_header.strip()
-                else:
-                    sequence_len += len(re.sub(pattern, '', current_line))
-        # wrap up last fasta sequence
-        if not first_header_found:
-            raise Exception("There are no contigs in this file")
+                        summary = self.summarize_assembly(
+                            self.assembly_result(hash_length, error=error), velvetg_params)
+                        summary['index'] = index
+                        sweep.append(summary)
+            sweep.extend(future.result() for future in velvetg_futures)
+        sweep.sort(key=lambda s: (s['hash_length'], s['index']))
+        if len(grid) > 1:
+            for hash_length in hash_lengths:
+                shutil.rmtree(velveth_folder(hash_length), ignore_errors=True)
+
+        for summary in sweep:
+            self.log('{}: {contigs} contigs, {total_length} bp, N50 {n50}'.format(
+                self.describe_assembly(summary), **summary))
+        assembled = [s for s in sweep if s['status'] == STATUS_OK]
+        if not assembled:
+            error = 'None of the {} assemblies succeeded'.format(len(sweep))
+            self.log(error)
+            status = STATUS_FAILED
+            for worst in [STATUS_OOM, STATUS_CANCELLED]:
+                if any(s['status'] == worst for s in sweep):
+                    status = worst
+            ret = {'hash_length': None, 'out_folder': None, 'error': error, 'status': status}
         else:
-            fasta_dict[contig_id] = sequence_len
-        return fasta_dict
+            best = max(assembled, key=lambda s: (s['n50'], s['total_length'], -s['hash_length']))
+            for summary in sweep:
+                summary['selected'] = 1 if summary is best else 0
+            self.log('Selected {} with N50 {}'.format(self.describe_assembly(best), best['n50']))
+            # only the selected assembly is saved and reported, reclaim the scratch space
+            for summary in assembled:
+                if summary is not best:
+                    shutil.rmtree(summary['out_folder'], ignore_errors=True)
+            ret = best
+        run_info['sweep'] = sweep
+        return ret
 
-    def generate_report(self, input_file_name, params, out_folder, wsname):
-        self.log('Generating and saving report')
+    def parse_retry_ladder(self, ladder):
+        """
+        Returns the steps of a comma separated oom-retry-ladder setting, checking that they
+        are OOM_RETRY_STEPS and that subsample has a fraction, as in subsample:0.5.
+        """
+        steps = [step.strip() for step in ladder.split(',') if step.strip()]
+        for step in steps:
+            name, _, value = step.partition(':')
+            if name not in self.OOM_RETRY_STEPS:
+                raise ValueError('Unknown oom-retry-ladder step ' + step + ', expected one of ' +
+                                 ', '.join(self.OOM_RETRY_STEPS))
+            if name == 'subsample':
+                try:
+                    fraction = float(value)
+                except ValueError:
+                    fraction = 0
+                if not 0 < fraction < 1:
+                    raise ValueError('The oom-retry-ladder step ' + step + ' needs a fraction '
+                                     'between 0 and 1, e.g. subsample:0.5')
+        return steps
 
-        fasta_stats = self.load_stats(input_file_name)
-        lengths = [fasta_stats[contig_id] for contig_id in fasta_stats]
+    def subsample_reads(self, reads_data, fraction, work_dir):
+        """
+        Returns a copy of reads_data with fraction of the reads of every library, written to
+        a new folder in work_dir.
+        """
+        folder = tempfile.mkdtemp(prefix='subsample_', dir=work_dir)
+        subsampled = []
+        for rd in reads_data:
+            rd = dict(rd, read_count=0, total_bases=0)
+            for key in ['fwd_file', 'rev_file']:
+                if not rd.get(key):
+                    continue
+                target = os.path.join(folder, key + '_' + os.path.basename(rd[key]))
+                records, bases = subsample_file(
+                    rd[key], target, fraction, self.get_reads_format(rd[key]).startswith('fasta'),
+                    PAIRED_UNIT if rd['type'] == 'interleaved' else 1)
+                rd[key] = target
+                rd['read_count'] += records
+                rd['total_bases'] += bases
+            if rd.get('ref'):
+                # keeps the velveth cache from mixing up the subsample with the full reads
+                rd['ref'] += ';subsample=' + str(fraction)
+            subsampled.append(rd)
+        return subsampled
 
-        assembly_ref = params[self.PARAM_IN_WS] + '/' + params[self.PARAM_IN_CS_NAME]
+    def apply_retry_step(self, step, params, reads_data, build, work_dir):
+        """
+        Degrades an assembly that ran out of memory with one retry step:
+        serial runs the assemblies of a sweep one at a time, drop-read-tracking turns off
+        read_trkg and amos_file, smaller-build switches to the next smaller Velvet build
+        (reducing the hash lengths to what it supports) and subsample:F keeps fraction F of
+        the reads.
+        Returns the new params, reads_data and build, or None if the step does not apply.
+        """
+        name, _, value = step.partition(':')
+        if name == 'serial':
+            assemblies = len(self.get_hash_lengths(params)) * len(self.get_velvetg_grid(params))
+            if assemblies == 1 or params.get(self.PARAM_IN_MAX_PARALLEL_JOBS) == 1:
+                return None
+            return dict(params, **{self.PARAM_IN_MAX_PARALLEL_JOBS: 1}), reads_data, build
+        if name == 'drop-read-tracking':
+            if not any(params.get(p) in [1, 'yes', 'Yes', 'YES']
+                       for p in ['read_trkg', 'amos_file']):
+                return None
+            return dict(params, read_trkg=0, amos_file=0), reads_data, build
+        if name == 'smaller-build':
+            categories = self.get_read_categories(reads_data)
+            smaller = [b for b in self.get_velvet_builds()
+                       if build_cost(b) < build_cost(build) and b['categories'] >= categories]
+            if not smaller:
+                return None
+            build = max(smaller, key=build_cost)
+            limit = build['max_kmer_length'] - (1 - build['max_kmer_length'] % 2)
+            hash_lengths = sorted(set(min(k, limit) for k in self.get_hash_lengths(params)))
+            return dict(params, **{self.PARAM_IN_HASH_LENGTHS: hash_lengths}), reads_data, build
+        if name == 'subsample':
+            return params, self.subsample_reads(reads_data, float(value), work_dir), build
+        return None
 
-        report = ''
-        report += 'Velvet results saved to: ' + wsname + '/' + out_folder + '\n'
-        report += 'Assembly saved to: ' + assembly_ref + '\n'
-        report += 'Assembled into ' + str(len(lengths)) + ' contigs.\n'
-        report += 'Avg Length: ' + str(sum(lengths) / float(len(lengths))) + ' bp.\n'
-
-        # compute a simple contig length distribution
-        bins = 10
-        counts, edges = np.histogram(lengths, bins)  # @UndefinedVariable
-        report += 'Contig Length Distribution (# of contigs -- min to max ' + 'basepairs):\n'
-        for c in range(bins):
-            report += '   ' + str(counts[c]) + '\t--\t' + str(edges[c]) + ' to ' + str(edges[c + 1]) + ' bp\n'
+    def exec_velvet_with_retries(self, params, reads_data, run_info, work_dir=None):
+        """
+        Runs exec_velvet, and runs it again with the next applicable step of the OOM retry
+        ladder for as long as it runs out of memory and steps are left. The steps add up.
+        Every attempt is recorded in run_info['attempts'].
+        Returns the assembly result of the last attempt.
+        """
+        attempts = run_info.setdefault('attempts', [])
+        ladder = list(self.oom_retry_ladder)
+        build = None
+        step = None
+        while True:
+            assembly = self.exec_velvet(params, reads_data, run_info, work_dir, build)
+            attempts.append({'attempt': len(attempts) + 1, 'retry_step': step,
+                             'status': assembly['status'], 'error': assembly['error']})
+            if assembly['status'] != STATUS_OOM:
+                return assembly
+            build = run_info['velvet_build']
+            retry = None
+            while retry is None and ladder:
+                step = ladder.pop(0)
+                retry = self.apply_retry_step(step, params, reads_data, build,
+                                              work_dir or self.scratch)
+            if retry is None:
+                self.log('Velvet ran out of memory and no retry steps are left')
+                return assembly
+            self.log('Velvet ran out of memory, retrying with ' + step)
+            params, reads_data, build = retry
+
+    def describe_assembly(self, summary):
+        description = 'k=' + str(summary['hash_length'])
+        for name, _ in self.VELVETG_GRID_PARAMS:
+            if summary.get(name) is not None:
+                description += ' ' + name + '=' + str(summary[name])
+        return description
+
+    def scan_contigs(self, contigs_file):
+        """
+        Returns the lengths, GC counts and N counts of the contigs of a FASTA file, as numpy
+        arrays, scanning large files with all available CPUs.
+        """
+        return scan_fasta(contigs_file, self.get_available_cpus())
+
+    def filter_contigs(self, contigs_file, min_length, min_coverage, hash_length):
+        """
+        Writes the contigs of contigs_file that are at least min_length bp long and have a
+        k-mer coverage of at least min_coverage to contigs.filtered.fa next to it.
+        Returns the path of the filtered file.
+        """
+        filtered = os.path.join(os.path.dirname(contigs_file), 'contigs.filtered.fa')
+        counts = filter_contigs(contigs_file, filtered, min_length, min_coverage, hash_length)
+        self.log('Kept {kept} contigs of {kept_bases} bp, dropped {dropped} contigs of '
+                 '{dropped_bases} bp'.format(**counts))
+        return filtered
+
+    def contig_metrics(self, contigs_file, params):
+        """
+        Returns the assembly metrics of a FASTA file, with NG50 and NG90 for the
+        expected_genome_size parameter.
+        """
+        return assembly_metrics(self.scan_contigs(contigs_file),
+                                params.get(self.PARAM_IN_EXPECTED_GENOME_SIZE))
+
+    def stage_contigs(self, contigs_file, consumer):
+        """
+        Returns a copy of contigs_file of its own for consumer, hard linked into a subfolder
+        named after it, as save_assembly_from_fasta moves the file it is given.
+        """
+        folder = os.path.join(os.path.dirname(contigs_file), consumer)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        staged = os.path.join(folder, os.path.basename(contigs_file))
+        link_or_copy(contigs_file, staged)
+        return staged
+
+    def download_reads(self, readcli, refs, abs_refs, on_download=None, folder=None,
+                       compress_threads=None):
+        """
+        Downloads the reads libraries refs with ReadsUtils, up to parallel-downloads of them
+        at the same time, and returns the files of the download_reads output by ref.
+        on_download(ref, files) is called in the calling thread as soon as each library is
+        there, so that its later stages overlap with the other downloads.
+        With the reads cache, the files are linked from the cache into folder, and with
+        compress_threads they are gzipped before they go into the cache.
+        """
+        reads = {}
+        if self.reads_cache is None and (self.parallel_downloads <= 1 or len(refs) == 1):
+            reads = readcli.download_reads({'read_libraries': refs})['files']
+            for ref in refs:
+                if on_download:
+                    on_download(ref, reads[ref])
+            return reads
+        with ThreadPoolExecutor(max_workers=max(1, self.parallel_downloads)) as executor:
+            futures = {executor.submit(self.download_library, readcli, ref, abs_refs[ref],
+                                       folder, compress_threads): ref
+                       for ref in refs}
+            for future in as_completed(futures):
+                ref = futures[future]
+                reads[ref] = future.result()
+                if on_download:
+                    on_download(ref, reads[ref])
+        return reads
+
+    def download_library(self, readcli, ref, abs_ref, folder=None, compress_threads=None):
+        """
+        Downloads the reads library ref and returns its files of the download_reads output.
+        With the reads cache, the library is downloaded once per absolute versioned reference
+        abs_ref, under a lock shared by the jobs of the container, and linked from the cache
+        into folder (scratch if None). With compress_threads, a download is gzipped with that
+        many threads before it goes into the cache, so that hits link the compressed files.
+        A download is removed once it is in the cache, so that evicting the entry frees its
+        space.
+        """
+        if self.reads_cache is None:
+            return readcli.download_reads({'read_libraries': [ref]})['files'][ref]
+        key = cache_key('reads', abs_ref)
+        with self.reads_cache.lock(key):
+            files = self.restore_cached_reads(key, folder)
+            if files is not None:
+                self.log('Reusing the cached reads of ' + abs_ref)
+                return files
+            download = readcli.download_reads({'read_libraries': [ref]})['files'][ref]
+            if compress_threads:
+                self.compress_download(download, compress_threads)
+            self.cache_reads(key, download)
+            files = self.restore_cached_reads(key, folder)
+            if files is None:
+                return download
+            for name in self.READS_FILE_KEYS:
+                path = download['files'].get(name)
+                if path and os.path.exists(path):
+                    os.remove(path)
+            return files
+
+    def compress_download(self, reads_info, threads):
+        """
+        Replaces the files of the download_reads output reads_info by level 1 gzipped copies.
+        """
+        files = reads_info['files']
+        paths = [files[name] for name in self.READS_FILE_KEYS if files.get(name)]
+        compressed = compress_files(paths, threads)
+        for name in self.READS_FILE_KEYS:
+            if files.get(name) in compressed:
+                files[name] = compressed[files[name]]
+        if compressed:
+            self.log('Compressed {} downloaded reads files to {}'.format(
+                len(compressed), format_bytes(sum(os.path.getsize(p)
+                                                  for p in compressed.values()))))
+
+    def get_reads_data(self, reads_info, reads_name):
+        """
+        Returns the reads_data entry of a reads library from its files of the download_reads
+        output.
+        """
+        f = reads_info['files']
+        seq_tech = reads_info["sequencing_tech"]
+        if f['type'] == 'interleaved':
+            rd = {'fwd_file': f['fwd'], 'type':'interleaved', 'seq_tech': seq_tech}
+        elif f['type'] == 'paired':
+            rd = {'fwd_file': f['fwd'], 'rev_file': f['rev'], 'type':'paired',
+                  'seq_tech': seq_tech}
+        elif f['type'] == 'single':
+            rd = {'fwd_file': f['fwd'], 'type':'single', 'seq_tech': seq_tech}
+        else:
+            raise ValueError('Something is very wrong with read lib' + reads_name)
+        rd['read_count'] = reads_info.get('read_count')
+        rd['total_bases'] = reads_info.get('total_bases')
+        return rd
+
+    def restore_cached_reads(self, key, folder=None):
+        """
+        Links the files of the reads cache entry for key into a new folder in folder (scratch
+        if None), which goes with the job's work directory.
+        Returns the download_reads output of the library with the linked paths, or None if
+        there is no intact entry.
+        """
+        folder = os.path.join(folder or self.scratch, 'cached_reads_' + str(uuid.uuid4()))
+        os.makedirs(folder)
+        try:
+            if not self.reads_cache.restore(key, folder):
+                shutil.rmtree(folder, ignore_errors=True)
+                return None
+            with open(os.path.join(folder, self.READS_INFO_FILE)) as f:
+                info = json.load(f)
+        except (IOError, OSError, ValueError):
+            shutil.rmtree(folder, ignore_errors=True)
+            return None
+        for name in self.READS_FILE_KEYS:
+            if info['files'].get(name):
+                info['files'][name] = os.path.join(folder, info['files'][name])
+        return info
+
+    def cache_reads(self, key, info):
+        """
+        Stores the files of a downloaded reads library and its download_reads output info as
+        the reads cache entry for key.
+        """
+        cached = dict(info, files=dict(info['files']))
+        files = {}
+        for name in self.READS_FILE_KEYS:
+            path = info['files'].get(name)
+            if path:
+                cached['files'][name] = name + '_' + os.path.basename(path)
+                files[cached['files'][name]] = path
+        if not files:
+            return
+        try:
+            self.reads_cache.put_json(key, self.READS_INFO_FILE, cached, files)
+        except (IOError, OSError) as e:
+            self.log('Could not cache the reads: ' + str(e))
+
+    def run_quast(self, input_file_name, params, user=None, use_cache=True):
+        """
+        Runs QUAST on the contigs and returns its result, with the shock id of the HTML report.
+        The results are cached by the user, the digest of the contigs and their label, so that
+        QUAST runs once for identical contigs of a user, whose token can read the report. A
+        cached result has the cache key in quast_cache_key.
+        """
+        label = params[self.PARAM_IN_CS_NAME]
+        key = None
+        if self.quast_cache is not None:
+            key = cache_key('quast', user, file_digest(input_file_name), label)
+            quastret = self.get_cached_quast_result(key) if use_cache else None
+            if quastret is not None:
+                self.log('Reusing the cached QUAST report ' + quastret['shock_id'])
+                quastret['quast_cache_key'] = key
+                return quastret
         print('Running QUAST')
         kbq = kb_quast(self.callbackURL)
-        quastret = kbq.run_QUAST({'files': [{'path': input_file_name,
-                                             'label': params[self.PARAM_IN_CS_NAME]}]})
+        quastret = kbq.run_QUAST({'files': [{'path': input_file_name, 'label': label}]})
+        if key is not None:
+            self.cache_quast_result(key, quastret)
+        return quastret
+
+    def get_cached_quast_result(self, key):
+        """
+        Returns the cached run_QUAST result for key, with quast_path pointing to the cache entry
+        holding the QUAST summary table, or None if there is none.
+        """
+        entry = self.quast_cache.get(key)
+        if entry is None:
+            return None
+        try:
+            with open(os.path.join(entry, self.QUAST_RESULT_FILE)) as f:
+                quastret = json.load(f)
+        except (IOError, OSError, ValueError):
+            # evicted or corrupted while reading
+            return None
+        quastret['quast_path'] = entry
+        return quastret
+
+    def cache_quast_result(self, key, quastret):
+        """
+        Stores a run_QUAST result and its summary table as the QUAST cache entry for key.
+        """
+        files = {}
+        summary = os.path.join(quastret.get('quast_path') or '', self.QUAST_SUMMARY_FILE)
+        if quastret.get('quast_path') and os.path.isfile(summary):
+            files[self.QUAST_SUMMARY_FILE] = summary
+        try:
+            self.quast_cache.put_json(key, self.QUAST_RESULT_FILE,
+                                      {'shock_id': quastret['shock_id'],
+                                       'quast_path': quastret.get('quast_path')}, files)
+        except (IOError, OSError) as e:
+            self.log('Could not cache the QUAST result: ' + str(e))
+
+    def use_local_report(self, params, metrics):
+        """
+        Tells whether the assembly gets the local HTML report instead of the QUAST report: if
+        report_type asks for it, or for report_type auto if the contigs add up to at least
+        local-report-min-length bp (0 for never).
+        """
+        report_type = params.get(self.PARAM_IN_REPORT_TYPE) or 'auto'
+        if report_type != 'auto':
+            return report_type == 'local'
+        return bool(self.local_report_min_length and
+                    metrics['total_length'] >= self.local_report_min_length)
+
+    def write_local_report(self, input_file_name, params, metrics, report):
+        """
+        Writes the local HTML report of the contigs of input_file_name to a report folder next
+        to it. Returns the folder.
+        """
+        folder = os.path.join(os.path.dirname(input_file_name), 'report')
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        stats = self.scan_contigs(input_file_name)
+        page = render_report('Velvet assembly ' + params[self.PARAM_IN_CS_NAME], metrics,
+                             report, stats['lengths'], contig_coverage(input_file_name))
+        with open(os.path.join(folder, 'report.html'), 'w') as f:
+            f.write(page)
+        return folder
+
+    def generate_report(self, input_file_name, params, out_folder, wsname, run_info=None,
+                        quast_result=None, user=None):
+        """
+        Saves the report of the assembly, with the QUAST report of quast_result, the local
+        HTML report if use_local_report chooses it, or else the report of a QUAST run on
+        input_file_name for user. If the report can't be saved with a cached QUAST report,
+        e.g. because its shock node is gone, QUAST runs again.
+        Returns the name and reference of the report.
+        """
+        self.log('Generating and saving report')
+        run_info = run_info or {}
+        metrics = run_info.get('assembly_metrics') or self.contig_metrics(input_file_name,
+                                                                          params)
+
+        assembly_ref = params[self.PARAM_IN_WS] + '/' + params[self.PARAM_IN_CS_NAME]
+
+        lines = ['Velvet results saved to: ' + wsname + '/' + out_folder,
+                 'Assembly saved to: ' + assembly_ref,
+                 'Assembled into {contigs} contigs, {total_length} bp in total.'.format(**metrics),
+                 'Largest contig: {largest_contig} bp, mean length: {mean_length:.1f} bp, '
+                 'auN: {aun:.1f} bp.'.format(**metrics)]
+        for x in NX_FRACTIONS:
+            line = 'N{0}: {1} bp (L{0}: {2})'.format(x, metrics['n' + str(x)],
+                                                     metrics['l' + str(x)])
+            if metrics['ng' + str(x)] is not None:
+                line += ', NG{0}: {1} bp (LG{0}: {2})'.format(x, metrics['ng' + str(x)],
+                                                              metrics['lg' + str(x)])
+            lines.append(line + '.')
+        if metrics['gc_content'] is not None:
+            lines.append('GC content: {:.2f}%.'.format(metrics['gc_content']))
+        lines.append('Gaps: {gaps} runs of Ns, {gap_length} bp.'.format(**metrics))
+
+        histogram = metrics['length_histogram']
+        lines.append('Contig Length Distribution (# of contigs -- min to max basepairs):')
+        for count, low, high in zip(histogram['counts'], histogram['edges'],
+                                    histogram['edges'][1:]):
+            lines.append('   {}\t--\t{} to {} bp'.format(count, low, high))
+        sweep = run_info.get('sweep')
+        plan = run_info.get('resource_plan')
+        if run_info.get('velvet_build'):
+            lines.append('Assembled with the Velvet build ' + run_info['velvet_build']['name'] +
+                         '.')
+        attempts = run_info.get('attempts') or []
+        if len(attempts) > 1:
+            lines.append('Velvet ran out of memory, the assembly took {} attempts:'.format(
+                len(attempts)))
+            for attempt in attempts:
+                lines.append('   {}\t{}\t{}'.format(attempt['attempt'],
+                                                   attempt['retry_step'] or 'first attempt',
+                                                   attempt['status']))
+        if plan and 'memory' in plan:
+            lines.append('Predicted peak memory ' + format_bytes(plan['memory']) +
+                         ' and scratch usage ' + format_bytes(plan['disk']) + ' per assembly.')
+        if run_info.get('coverage'):
+            lines.append('Estimated k-mer coverage (exp_cov) {exp_cov} and cov_cutoff '
+                         '{cov_cutoff}.'.format(**run_info['coverage']))
+        if sweep:
+            columns = ['hash_length'] + [name for name, _ in self.VELVETG_GRID_PARAMS
+                                         if any(s.get(name) is not None for s in sweep)]
+            lines.append('Assembly sweep (the selected assembly is marked with *):')
+            lines.append('   ' + '\t'.join(columns) + '\tcontigs\ttotal bp\tN50')
+            for summary in sweep:
+                lines.append('   ' + '\t'.join(str(summary.get(c, '')) for c in columns) +
+                             ('*' if summary.get('selected') else '') + '\t' +
+                             (str(summary['contigs']) + '\t' + str(summary['total_length']) +
+                              '\t' + str(summary['n50'])
+                              if summary['status'] == STATUS_OK else summary['status']))
+        if run_info.get('stage_metrics'):
+            lines.append('Resource usage per stage:')
+            lines.append('   stage\tk\twall s\tuser s\tsys s\tpeak RSS MB\tread MB\twritten MB')
+            for m in run_info['stage_metrics']:
+                lines.append('   {}\t{}\t{:.1f}\t{:.1f}\t{:.1f}\t{:.1f}\t{:.1f}\t{:.1f}'.format(
+                    m['stage'], m['hash_length'], m['wall_time'], m['user_cpu_time'],
+                    m['system_cpu_time'], m['max_rss'] / 1024.0, m['read_bytes'] / 1048576.0,
+                    m['write_bytes'] / 1048576.0))
+        report = '\n'.join(lines) + '\n'
+        quastret = None
+        if quast_result is None and self.use_local_report(params, metrics):
+            html_link = {'path': self.write_local_report(input_file_name, params, metrics,
+                                                         report),
+                         'name': 'report.html',
+                         'label': 'Assembly report'}
+        else:
+            quastret = quast_result or self.run_quast(input_file_name, params, user)
+            html_link = {'shock_id': quastret['shock_id'],
+                         'name': 'report.html',
+                         'label': 'QUAST report'}
         print('Saving report')
         kbr = KBaseReport(self.callbackURL)
-        report_info = kbr.create_extended_report(
-            {'message': report,
-             'objects_created': [{'ref': assembly_ref, 'description': 'Assembled contigs'}],
-             'direct_html_link_index': 0,
-             'html_links': [{'shock_id': quastret['shock_id'],
-                             'name': 'report.html',
-                             'label': 'QUAST report'}
-                            ],
-             'report_object_name': 'kb_velvet_report_' + str(uuid.uuid4()),
-             'workspace_name': params[self.PARAM_IN_WS]
-            })
+        report_params = {
+            'message': report,
+            'objects_created': [{'ref': assembly_ref, 'description': 'Assembled contigs'}],
+            'direct_html_link_index': 0,
+            'html_links': [html_link],
+            'report_object_name': 'kb_velvet_report_' + str(uuid.uuid4()),
+            'workspace_name': params[self.PARAM_IN_WS]
+        }
+        try:
+            report_info = kbr.create_extended_report(report_params)
+        except ServerError as e:
+            if not quastret or not quastret.get('quast_cache_key'):
+                raise
+            self.log('Could not use the cached QUAST report, running QUAST: ' + str(e))
+            self.quast_cache.remove(quastret['quast_cache_key'])
+            quastret = self.run_quast(input_file_name, params, user, use_cache=False)
+            html_link['shock_id'] = quastret['shock_id']
+            report_info = kbr.create_extended_report(report_params)
         reportName = report_info['name']
         reportRef = report_info['ref']
         return reportName, reportRef
 
+    def normalise_param(self, value):
+        """
+        Returns a parameter value in a canonical form for the run fingerprint: numbers and
+        booleans as floats, and containers without their empty values.
+        """
+        if isinstance(value, (bool, int, float)):
+            return float(value)
+        if isinstance(value, dict):
+            return {k: self.normalise_param(v) for k, v in value.items()
+                    if v not in (None, '', [], {})}
+        if isinstance(value, list):
+            return [self.normalise_param(v) for v in value]
+        return value
+
+    def run_fingerprint(self, params, abs_refs):
+        """
+        Returns the fingerprint of a run: a digest of the normalised parameters, with the reads
+        libraries replaced by their absolute versioned references abs_refs, of the settings
+        that change the result (the OOM retry ladder, the Velvet builds the job picks from,
+        the coverage estimator and the size limit of the automatic report type) and of the
+        Velvet builds the run can use. Returns None if the builds can't be read.
+        """
+        normalised = self.normalise_param(dict(params, **{self.PARAM_IN_LIB: abs_refs}))
+        settings = {'oom_retry_ladder': self.oom_retry_ladder,
+                    'velvet_builds': [[b['name'], b['max_kmer_length'], b['categories']]
+                                      for b in self.velvet_builds],
+                    'coverage_estimator': COVERAGE_ESTIMATOR_SETTINGS,
+                    'local_report_min_length': self.local_report_min_length}
+        try:
+            builds = [self.get_velvet_build_id(binary) for binary in
+                      [self.VELVETH] + [b['velveth'] for b in self.velvet_builds]]
+        except (IOError, OSError):
+            return None
+        return cache_key('run', json.dumps(normalised, sort_keys=True),
+                         json.dumps(settings, sort_keys=True), *builds)
+
+    def memoized_run(self, ws, params, abs_refs, run):
+        """
+        Returns the output of an earlier identical run from the run index, or else runs run()
+        and indexes its output if it succeeded at the first attempt; the result of an OOM
+        retry depends on the memory of the container and is not reused. Identical runs in the
+        container wait for the one that is running and then return its output.
+        """
+        key = self.run_fingerprint(params, abs_refs)
+        if key is None:
+            return run()
+        with self.run_index.lock(key):
+            output = self.get_memoized_output(ws, key)
+            if output is not None:
+                self.log('Returning the output of the identical run with the report ' +
+                         output['report_ref'])
+                return output
+            output = run()
+            attempts = output.get('attempts') or []
+            retried = len(attempts) > 1 or any(a.get('retry_step') for a in attempts)
+            if output.get('report_ref') and output.get('assembly_ref') and not retried:
+                self.memoize_output(key, output)
+            return output
+
+    def get_memoized_output(self, ws, key):
+        """
+        Returns the output of the run index entry for key, or None if there is none or its
+        assembly or report no longer exist.
+        """
+        entry = self.run_index.get(key)
+        if entry is None:
+            return None
+        try:
+            with open(os.path.join(entry, self.RUN_RESULT_FILE)) as f:
+                output = json.load(f)
+        except (IOError, OSError, ValueError):
+            # evicted or corrupted while reading
+            return None
+        infos = ws.get_object_info_new({'objects': [{'ref': output['assembly_ref']},
+                                                    {'ref': output['report_ref']}],
+                                        'ignoreErrors': 1})
+        if not all(infos):
+            self.log('The assembly or report of the identical run is gone, running again')
+            return None
+        return output
+
+    def memoize_output(self, key, output):
+        """
+        Stores the output of a run as the run index entry for key.
+        """
+        try:
+            self.run_index.put_json(key, self.RUN_RESULT_FILE, output)
+        except (IOError, OSError) as e:
+            self.log('Could not index the run: ' + str(e))
+
+    def assemble_reads(self, ctx, params, reads_params, reftoname, reftoabs):
+        """
+        Downloads the reads libraries reads_params, assembles them, and uploads and reports the
+        assembly. Returns the output of run_velvet.
+        """
+        token = ctx['token']
+        wsname = params[self.PARAM_IN_WS]
+        # a signal that cancelled an earlier job without ending the process must not cancel
+        # this one
+        reset_cancel()
+
+        readcli = ReadsUtils(self.callbackURL, token=token)
+
+        run_info = {}
+        stage_metrics = run_info.setdefault('stage_metrics', [])
+        compress = str(self.cfg.get('compress-staged-reads')).lower() == 'true'
+        reads_data_by_ref = {}
+
+        def on_download(ref, reads_info):
+            # the staging of each library starts as soon as it is downloaded
+            self.log('Got reads data from converter:\n' + pformat(reads_info))
+            rd = self.get_reads_data(reads_info, reftoname[ref])
+            rd['ref'] = reftoabs[ref]
+            if not (rd['read_count'] and rd['total_bases']):
+                # sample the size for the preflight check
+                rd['read_count'], rd['total_bases'] = self.get_reads_size([rd])
+            # reads from the reads cache are already compressed
+            if compress and any(rd.get(key) and not rd[key].endswith('.gz')
+                                for key in ['fwd_file', 'rev_file']):
+                self.run_call_stage('staging', None, stage_metrics, self.compress_reads,
+                                    params, [rd])
+            reads_data_by_ref[ref] = rd
+
+        typeerr = ('Supported types: KBaseFile.SingleEndLibrary ' +
+                   'KBaseFile.PairedEndLibrary ' +
+                   'KBaseAssembly.SingleEndLibrary ' +
+                   'KBaseAssembly.PairedEndLibrary')
+        # every job runs in a locked work directory of its own, which also holds the reads
+        # linked from the reads cache
+        jobs_root = os.path.join(self.scratch, 'jobs')
+        prune_work_dirs(jobs_root, self.work_dir_max_age)
+        work_dir = JobWorkDir(jobs_root, ctx.get('call_id'))
+        output = None
+        assembly_ref = None
+        try:
+            try:
+                # with compress-staged-reads, the reads cache keeps the libraries gzipped
+                self.download_reads(readcli, reads_params, reftoabs, on_download,
+                                    work_dir.path,
+                                    self.get_threads_per_job(params) if compress else None)
+            except ServerError as se:
+                self.log('logging stacktrace from dynamic client error')
+                self.log(se.data)
+                if typeerr in se.message:
+                    prefix = se.message.split('.')[0]
+                    raise ValueError(
+                        prefix + '. Only the types ' +
+                        'KBaseAssembly.SingleEndLibrary ' +
+                        'KBaseAssembly.PairedEndLibrary ' +
+                        'KBaseFile.SingleEndLibrary ' +
+                        'and KBaseFile.PairedEndLibrary are supported')
+                else:
+                    raise
+
+            # the libraries are assembled in the order they were given in
+            reads_data = [reads_data_by_ref[ref] for ref in reads_params]
+
+            # STEP 1: run velveth and velvetg sequentially
+            assembly = self.exec_velvet_with_retries(params, reads_data, run_info,
+                                                     work_dir.path)
+
+            # STEP 2: parse the output and save back to KBase, create report in the same time
+            if assembly['status'] == STATUS_OK:
+                velvet_out = assembly['out_folder']
+                output_contigs = os.path.join(velvet_out, 'contigs.fa')
+                min_contig_len = params.get(self.PARAM_IN_MIN_CONTIG_LENGTH) or 0
+                min_contig_cov = params.get(self.PARAM_IN_MIN_CONTIG_COVERAGE) or 0
+                if os.path.isfile(output_contigs) and (min_contig_len > 0 or min_contig_cov > 0):
+                    # only the contigs that are kept are uploaded and assessed
+                    output_contigs = self.run_call_stage(
+                        'filter', assembly['hash_length'], stage_metrics, self.filter_contigs,
+                        output_contigs, min_contig_len, min_contig_cov, assembly['hash_length'])
+                if (os.path.isfile(output_contigs) and os.path.getsize(output_contigs) == 0):
+                    self.log('Given the minimal contig length of {} bp and coverage of {}, Velvet '
+                             'could not find any contig of the input reads libary.'.format(
+                                 str(min_contig_len), str(min_contig_cov)))
+                    output = {'report_name': 'empty_contigs_' + str(uuid.uuid4()), 'report_ref': None}
+                elif (os.path.isfile(output_contigs) and os.path.getsize(output_contigs) > 0):
+                    run_info['assembly_metrics'] = self.contig_metrics(output_contigs, params)
+                    self.log('Uploading FASTA file to Assembly')
+
+                    assemblyUtil = AssemblyUtil(self.callbackURL, token=ctx['token'], service_ver='release')
+
+                    # the upload and QUAST are independent remote calls, which overlap; each
+                    # gets its own link of the contigs, as the upload moves its file away
+                    upload_contigs = self.stage_contigs(output_contigs, 'upload')
+                    local_report = self.use_local_report(params, run_info['assembly_metrics'])
+                    with ThreadPoolExecutor(max_workers=2) as executor:
+                        # the contigs are already filtered by min_contig_length
+                        upload = executor.submit(
+                            self.run_call_stage, 'upload', assembly['hash_length'],
+                            stage_metrics, assemblyUtil.save_assembly_from_fasta,
+                            {'file': {'path': upload_contigs},
+                             'workspace_name': wsname,
+                             'assembly_name': params[self.PARAM_IN_CS_NAME]
+                             })
+                        quast = None
+                        if not local_report:
+                            quast = executor.submit(
+                                self.run_call_stage, 'quast', assembly['hash_length'],
+                                stage_metrics, self.run_quast,
+                                self.stage_contigs(output_contigs, 'quast'), params,
+                                ctx.get('user_id'))
+                        assembly_ref = upload.result()
+                        quast_result = quast.result() if quast else None
+                    # generate report from contigs.fa once both are done
+                    report_name, report_ref = self.run_call_stage(
+                        'report', assembly['hash_length'], stage_metrics, self.generate_report,
+                        output_contigs, params, velvet_out, wsname, run_info, quast_result,
+                        ctx.get('user_id'))
+
+                    # STEP 3: contruct the output to send back
+                    output = {'report_name': report_name, 'report_ref': report_ref}
+                else:
+                    output = {'report_name': 'velvet_found_empty_contig_file_' + str(uuid.uuid4()), 'report_ref': None}
+            else:
+                self.log('Velvet {}: {}'.format(assembly['status'], assembly['error']))
+                output = {'report_name': 'velvet_aborted_' + str(uuid.uuid4()), 'report_ref': None}
+        finally:
+            failed = output is None or output.get('report_ref') is None
+            keep = self.keep_work_dirs == 'all' or (failed and self.keep_work_dirs == 'failed')
+            if keep:
+                self.log('Keeping work directory ' + work_dir.path)
+            work_dir.release(keep=keep)
+        output['assembly_ref'] = assembly_ref
+        output['stage_metrics'] = stage_metrics
+        output['attempts'] = run_info.get('attempts', [])
+        output['assembly_metrics'] = run_info.get('assembly_metrics')
+        return output
+
     #END_CLASS_HEADER
 
     # config contains contents of config file in a hash or None if it couldn't
@@ -393,11 +1760,58 @@ class Velvet:
         # saved in the constructor.
         self.cfg = config
         self.callbackURL = os.environ['SDK_CALLBACK_URL']
+        # all KBase clients share keep-alive connections
+        set_session_pool(int(config.get('http-pool-hosts') or 10),
+                         int(config.get('http-pool-connections-per-host') or 10),
+                         str(config.get('http-pool-block')).lower() == 'true')
         self.log('Callback URL: ' + self.callbackURL)
         self.workspaceURL = config['workspace-url']
         self.scratch = os.path.abspath(config['scratch'])
         if not os.path.exists(self.scratch):
             os.makedirs(self.scratch)
+        self.stall_timeout = float(config.get('stall-timeout') or 0) or None
+        self.keep_work_dirs = (config.get('keep-work-dirs') or 'failed').lower()
+        if self.keep_work_dirs not in ('none', 'failed', 'all'):
+            raise ValueError('keep-work-dirs must be none, failed or all, not ' +
+                             self.keep_work_dirs)
+        self.work_dir_max_age = float(config.get('work-dir-max-age-hours') or 24) * 3600
+        self.oom_retry_ladder = self.parse_retry_ladder(config.get('oom-retry-ladder') or '')
+        self.parallel_downloads = int(config.get('parallel-downloads') or 1)
+        self.local_report_min_length = int(config.get('local-report-min-length') or 0)
+        # stop the running Velvet process groups when the job is stopped
+        install_signal_handlers()
+        self._velvet_builds = {}
+        self._build_ids = {}
+        # probe the installed Velvet builds once, so that every job can pick the smallest
+        self.velvet_builds = find_builds(config.get('velvet-builds-dir') or self.VELVET_BUILDS)
+        for build in self.velvet_builds:
+            build.update(self.probe_velvet_build(build['velveth']))
+            self.log('Found Velvet build {name} (MAXKMERLENGTH={max_kmer_length}, '
+                     'CATEGORIES={categories})'.format(**build))
+        self.velveth_cache = None
+        cache_size_gb = float(config.get('velveth-cache-size-gb') or 0)
+        if cache_size_gb > 0:
+            self.velveth_cache = DiskCache(
+                config.get('velveth-cache-dir') or os.path.join(self.scratch, 'cache', 'velveth'),
+                int(cache_size_gb * 1024 ** 3))
+        self.reads_cache = None
+        cache_size_gb = float(config.get('reads-cache-size-gb') or 0)
+        if cache_size_gb > 0:
+            self.reads_cache = DiskCache(
+                config.get('reads-cache-dir') or os.path.join(self.scratch, 'cache', 'reads'),
+                int(cache_size_gb * 1024 ** 3), verify=True)
+        self.run_index = None
+        index_size_mb = float(config.get('run-index-size-mb') or 0)
+        if index_size_mb > 0:
+            self.run_index = DiskCache(
+                config.get('run-index-dir') or os.path.join(self.scratch, 'cache', 'runs'),
+                int(index_size_mb * 1024 ** 2))
+        self.quast_cache = None
+        cache_size_mb = float(config.get('quast-cache-size-mb') or 0)
+        if cache_size_mb > 0:
+            self.quast_cache = DiskCache(
+                config.get('quast-cache-dir') or os.path.join(self.scratch, 'cache', 'quast'),
+                int(cache_size_mb * 1024 ** 2))
 
         #END_CONSTRUCTOR
         pass
@@ -414,12 +1828,44 @@ class Velvet:
            list<paired_end_lib> read_libraries - Illumina PairedEndLibrary
            files to assemble min_contig_length - integer to filter out
            contigs with length < min_contig_length from the Velvet output.
-           Default value is 500 (where 0 implies no filter). @optional
-           min_contig_length @optional cov_cutoff @optional ins_length
-           @optional read_trkg @optional amos_file @optional exp_cov
-           @optional long_cov_cutoff) -> structure: parameter
-           "workspace_name" of String, parameter "hash_length" of Long,
-           parameter "read_libraries" of list of type "read_lib" (The
+           Default value is 500 (where 0 implies no filter). float
+           min_contig_coverage - filter out contigs with a k-mer coverage
+           (the cov_ value of the Velvet contig name) < min_contig_coverage
+           before the upload. string report_type - quast for the QUAST
+           report, local for a faster HTML report of the assembly metrics and
+           plots rendered by the app, or auto (the default) for the local
+           report for assemblies above the local-report-min-length setting.
+           list<int> hash_lengths - a list of hash lengths to sweep over
+           instead of hash_length; the assembly with the best contig N50 is
+           kept. hash_length_range hash_length_range - a range of hash
+           lengths to sweep over instead of hash_length. int
+           max_parallel_jobs - the maximum number of assemblies of a sweep to
+           run at the same time. Defaults to the number of available CPUs.
+           int num_threads - the number of threads velveth and velvetg may
+           use in total. Defaults to the number of CPUs available to the
+           container (affinity mask and cgroup quota). int
+           max_threads_per_job - the maximum number of threads of each
+           velveth or velvetg process, for when several assemblies share a
+           node. velvetg_grid velvetg_grid - velvetg parameter values to
+           sweep over; the values given here replace the corresponding single
+           valued parameters. bool estimate_coverage - estimate exp_cov and
+           cov_cutoff from the node coverage peak of a first velvetg pass,
+           then assemble with them. Numbers given for exp_cov or cov_cutoff
+           are kept. bool binary_sequences - store the reads in velveth's
+           binary CnyUnifiedSeq format instead of the Sequences text file; in
+           a sweep only the first velveth parses the reads. int
+           expected_genome_size - the expected genome size in bp, for the
+           NG50 and NG90 of the assembly metrics. @optional hash_length
+           @optional hash_lengths @optional hash_length_range @optional
+           max_parallel_jobs @optional num_threads @optional
+           max_threads_per_job @optional velvetg_grid @optional
+           estimate_coverage @optional binary_sequences @optional
+           expected_genome_size @optional min_contig_coverage @optional
+           report_type @optional min_contig_length @optional cov_cutoff
+           @optional ins_length @optional read_trkg @optional amos_file
+           @optional exp_cov @optional long_cov_cutoff) -> structure:
+           parameter "workspace_name" of String, parameter "hash_length" of
+           Long, parameter "read_libraries" of list of type "read_lib" (The
            workspace object name of a SingleEndLibrary or PairedEndLibrary
            file, whether of the KBaseAssembly or KBaseFile type.), parameter
            "output_contigset_name" of String, parameter "min_contig_length"
@@ -428,12 +1874,101 @@ class Velvet:
            false, 1 for true. @range (0, 1)), parameter "amos_file" of type
            "bool" (A boolean - 0 for false, 1 for true. @range (0, 1)),
            parameter "exp_cov" of Double, parameter "long_cov_cutoff" of
-           Double
+           Double, parameter "hash_lengths" of list of Long, parameter
+           "hash_length_range" of type "hash_length_range" (A range of hash
+           lengths for a k-mer sweep, following velveth's m,M,s syntax. int
+           min_hash_length - the smallest hash length to try (inclusive). int
+           max_hash_length - the largest hash length to try (exclusive). int
+           step - the step between hash lengths, an even integer. Default
+           value is 2. @optional step) -> structure: parameter
+           "min_hash_length" of Long, parameter "max_hash_length" of Long,
+           parameter "step" of Long, parameter "max_parallel_jobs" of Long,
+           parameter "num_threads" of Long, parameter "max_threads_per_job"
+           of Long, parameter "velvetg_grid" of type "velvetg_grid" (Lists of
+           velvetg parameter values to sweep over. Every combination of the
+           given values is assembled from the same velveth output of each
+           hash length. list<float> cov_cutoff - coverage cutoff values to
+           try. list<float> exp_cov - expected coverage values to try.
+           list<int> ins_length - insert length values to try.
+           min_contig_length is not swept, as the shorter contigs that a
+           larger value drops would decide the N50 selection; the single
+           min_contig_length filters the selected assembly. @optional
+           cov_cutoff @optional exp_cov @optional ins_length) -> structure:
+           parameter "cov_cutoff" of list of Double, parameter "exp_cov" of
+           list of Double, parameter "ins_length" of list of Long, parameter
+           "estimate_coverage" of type "bool" (A boolean - 0 for false, 1 for
+           true. @range (0, 1)), parameter "binary_sequences" of type "bool"
+           (A boolean - 0 for false, 1 for true. @range (0, 1)), parameter
+           "expected_genome_size" of Long, parameter "min_contig_coverage" of
+           Double, parameter "report_type" of String
         :returns: instance of type "VelvetResults" (Output parameter items
            for run_velvet report_name - the name of the KBaseReport.Report
            workspace object. report_ref - the workspace reference of the
-           report.) -> structure: parameter "report_name" of String,
-           parameter "report_ref" of String
+           report. string assembly_ref - the workspace reference of the
+           assembly, null if none was saved. list<StageMetrics> stage_metrics
+           - the result and resource usage of every stage that ran.
+           list<AssemblyAttempt> attempts - the attempts of the assembly.
+           AssemblyMetrics assembly_metrics - the metrics of the assembled
+           contigs, null if there are none.) -> structure: parameter
+           "report_name" of String, parameter "report_ref" of String,
+           parameter "assembly_ref" of String, parameter "stage_metrics" of
+           list of type "StageMetrics" (Result and resource usage of one
+           stage of the pipeline. string stage - staging, velveth, velvetg,
+           velvetg-coverage for the coverage estimation pass, filter, upload,
+           quast or report. int hash_length - the hash length of the
+           assembly. string status - ok, failed, timeout, stalled, cancelled
+           or oom (killed by the out of memory killer). string error - why
+           the stage did not succeed, null if it did. float wall_time - the
+           elapsed time in seconds. float user_cpu_time - the user CPU time
+           in seconds. float system_cpu_time - the system CPU time in
+           seconds. int max_rss - the peak resident set size in kilobytes.
+           int read_bytes - the bytes read from storage. int write_bytes -
+           the bytes written to storage. int return_code - the return code of
+           the process.) -> structure: parameter "stage" of String, parameter
+           "hash_length" of Long, parameter "status" of String, parameter
+           "error" of String, parameter "wall_time" of Double, parameter
+           "user_cpu_time" of Double, parameter "system_cpu_time" of Double,
+           parameter "max_rss" of Long, parameter "read_bytes" of Long,
+           parameter "write_bytes" of Long, parameter "return_code" of Long,
+           parameter "attempts" of list of type "AssemblyAttempt" (One
+           attempt of the assembly. An assembly that runs out of memory is
+           attempted again with the next applicable step of the
+           oom-retry-ladder setting. int attempt - the number of the attempt,
+           starting at 1. string retry_step - the retry step applied before
+           this attempt, null for the first one. string status - the status
+           of the assembly, as in StageMetrics. string error - why the
+           assembly did not succeed, null if it did.) -> structure: parameter
+           "attempt" of Long, parameter "retry_step" of String, parameter
+           "status" of String, parameter "error" of String, parameter
+           "assembly_metrics" of type "AssemblyMetrics" (Contiguity and
+           composition metrics of the assembled contigs. int contigs - the
+           number of contigs. int total_length - the total length of the
+           contigs in bp. int largest_contig - the length of the largest
+           contig. float mean_length - the mean contig length. int n50, n90 -
+           the length of the contig at which the contigs, from long to short,
+           cover 50% and 90% of the total length. int l50, l90 - the number
+           of contigs up to n50 and n90. int ng50, ng90, lg50, lg90 - n50,
+           n90, l50 and l90 of the expected genome size, null without it or
+           when the contigs don't cover enough of it. int
+           expected_genome_size - the expected_genome_size parameter. float
+           aun - the area under the Nx curve, the length weighted mean contig
+           length. float gc_content - the GC content of the called (non N)
+           bases in percent. int gaps - the number of runs of Ns (scaffold
+           gaps). int gap_length - the number of Ns. LengthHistogram
+           length_histogram - the contig length distribution.) -> structure:
+           parameter "contigs" of Long, parameter "total_length" of Long,
+           parameter "largest_contig" of Long, parameter "mean_length" of
+           Double, parameter "n50" of Long, parameter "n90" of Long,
+           parameter "l50" of Long, parameter "l90" of Long, parameter "ng50"
+           of Long, parameter "ng90" of Long, parameter "lg50" of Long,
+           parameter "lg90" of Long, parameter "expected_genome_size" of
+           Long, parameter "aun" of Double, parameter "gc_content" of Double,
+           parameter "gaps" of Long, parameter "gap_length" of Long,
+           parameter "length_histogram" of type "LengthHistogram" (A contig
+           length histogram with logarithmic bins. list<int> edges - the bin
+           edges in bp, one more than there are bins. list<int> counts - the
+           number of contigs in each bin.) -> structure: parameter "edges" of
+           list of Long, parameter "counts" of list of Long
         """
         # ctx is the context object
         # return variables are: output
@@ -454,93 +1989,20 @@ class Velvet:
         reads_params = []
 
         reftoname = {}
+        reftoabs = {}
         for wsi, oid in zip(ws_info, obj_ids):
             ref = oid['ref']
             reads_params.append(ref)
             obj_name = wsi[1]
             reftoname[ref] = wsi[7] + '/' + obj_name
+            reftoabs[ref] = str(wsi[6]) + '/' + str(wsi[0]) + '/' + str(wsi[4])
 
-        readcli = ReadsUtils(self.callbackURL, token=token)
-
-        typeerr = ('Supported types: KBaseFile.SingleEndLibrary ' +
-                   'KBaseFile.PairedEndLibrary ' +
-                   'KBaseAssembly.SingleEndLibrary ' +
-                   'KBaseAssembly.PairedEndLibrary')
-        try:
-            reads = readcli.download_reads({'read_libraries': reads_params})['files']
-        except ServerError as se:
-            self.log('logging stacktrace from dynamic client error')
-            self.log(se.data)
-            if typeerr in se.message:
-                prefix = se.message.split('.')[0]
-                raise ValueError(
-                    prefix + '. Only the types ' +
-                    'KBaseAssembly.SingleEndLibrary ' +
-                    'KBaseAssembly.PairedEndLibrary ' +
-                    'KBaseFile.SingleEndLibrary ' +
-                    'and KBaseFile.PairedEndLibrary are supported')
-            else:
-                raise
-
-        self.log('Got reads data from converter:\n' + pformat(reads))
-
-        reads_data = []
-        reads_name = ''
-        for ref in input_reads_refs:
-            reads_name = reftoname[ref]
-            f = reads[ref]['files']
-            seq_tech = reads[ref]["sequencing_tech"]
-            if f['type'] == 'interleaved':
-                reads_data.append({'fwd_file': f['fwd'], 'type':'interleaved',
-                                   'seq_tech': seq_tech})
-            elif f['type'] == 'paired':
-                reads_data.append({'fwd_file': f['fwd'], 'rev_file': f['rev'],
-                                   'type':'paired', 'seq_tech': seq_tech})
-            elif f['type'] == 'single':
-                reads_data.append({'fwd_file': f['fwd'], 'type':'single',
-                                   'seq_tech': seq_tech})
-            else:
-                raise ValueError('Something is very wrong with read lib' + reads_name)
-
-        # STEP 1: run velveth and velvetg sequentially
-        velvet_out = self.exec_velvet(params, reads_data)
-        #self.log('Velvet final return: ' + str(velvet_out))
-
-        # STEP 2: parse the output and save back to KBase, create report in the same time
-        if isinstance(velvet_out, str) and velvet_out != '':
-            output_contigs = os.path.join(velvet_out, 'contigs.fa')
-            min_contig_len = params.get(self.PARAM_IN_MIN_CONTIG_LENGTH, 0)
-            if (os.path.isfile(output_contigs) and os.path.getsize(output_contigs) == 0):
-                self.log('Given the minimal contig length of {} bp, Velvet could not find any '
-                         'contig of the input reads libary.'.format(str(min_contig_len)))
-                output = {'report_name': 'empty_contigs_' + str(uuid.uuid4()), 'report_ref': None}
-            elif (os.path.isfile(output_contigs) and os.path.getsize(output_contigs) > 0):
-                self.log('Uploading FASTA file to Assembly')
-
-                assemblyUtil = AssemblyUtil(self.callbackURL, token=ctx['token'], service_ver='release')
-
-                if min_contig_len > 0:
-                        assemblyUtil.save_assembly_from_fasta(
-                                {'file': {'path': output_contigs},
-                                'workspace_name': wsname,
-                                'assembly_name': params[self.PARAM_IN_CS_NAME],
-                                'min_contig_length': min_contig_len
-                                })
-                else:
-                        assemblyUtil.save_assembly_from_fasta(
-                        {'file': {'path': output_contigs},
-                        'workspace_name': wsname,
-                        'assembly_name': params[self.PARAM_IN_CS_NAME]
-                        })
-                # generate report from contigs.fa
-                report_name, report_ref = self.generate_report(output_contigs, params, velvet_out, wsname)
-
-                # STEP 3: contruct the output to send back
-                output = {'report_name': report_name, 'report_ref': report_ref}
-            else:
-                output = {'report_name': 'velvet_found_empty_contig_file_' + str(uuid.uuid4()), 'report_ref': None}
+        if self.run_index is None:
+            output = self.assemble_reads(ctx, params, reads_params, reftoname, reftoabs)
         else:
-            output = {'report_name': 'velvet_aborted_' + str(uuid.uuid4()), 'report_ref': None}
+            output = self.memoized_run(
+                ws, params, [reftoabs[ref] for ref in reads_params],
+                lambda: self.assemble_reads(ctx, params, reads_params, reftoname, reftoabs))
 
         #END run_velvet
 
@@ -1,7 +1,6 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import datetime
-import json
 import os
 import random as _random
 import sys
@@ -11,13 +10,14 @@ from multiprocessing import Process
 from os import environ
 from wsgiref.simple_server import make_server
 
-import requests as _requests
 from jsonrpcbase import JSONRPCService, InvalidParamsError, KeywordError, \
     JSONRPCError, InvalidRequestError
 from jsonrpcbase import ServerError as JSONServerError
 
 from biokbase import log
 from Velvet.authclient import KBaseAuth as _KBaseAuth
+from installed_clients.baseclient import get_session as _get_session
+from installed_clients.baseclient import json_dumps, json_loads
 
 try:
     from ConfigParser import ConfigParser
@@ -55,31 +55,19 @@ from Velvet.VelvetImpl import Velvet  # noqa @IgnorePep8
 impl_Velvet = Velvet(config)
 
 
-class JSONObjectEncoder(json.JSONEncoder):
-
-    def default(self, obj):
-        if isinstance(obj, set):
-            return list(obj)
-        if isinstance(obj, frozenset):
-            return list(obj)
-        if hasattr(obj, 'toJSONable'):
-            return obj.toJSONable()
-        return json.JSONEncoder.default(self, obj)
-
-
 class JSONRPCServiceCustom(JSONRPCService):
 
     def call(self, ctx, jsondata):
         """
-        Calls jsonrpc service's method and returns its return value in a JSON
-        string or None if there is none.
+        Calls jsonrpc service's method and returns its return value as UTF-8
+        encoded JSON or None if there is none.
 
         Arguments:
         jsondata -- remote method call in jsonrpc format
         """
         result = self.call_py(ctx, jsondata)
         if result is not None:
-            return json.dumps(result, cls=JSONObjectEncoder)
+            return json_dumps(result)
 
         return None
 
@@ -251,15 +239,15 @@ class MethodContext(dict):
                         'version': '1.1',
                         'id': str(_random.random())[2:]
                         }
-            body = json.dumps(arg_hash)
-            response = _requests.post(callbackURL, data=body,
-                                      timeout=60)
+            body = json_dumps(arg_hash)
+            response = _get_session().post(callbackURL, data=body,
+                                           timeout=60)
             response.encoding = 'utf-8'
             if response.status_code == 500:
                 if ('content-type' in response.headers and
                         response.headers['content-type'] ==
                         'application/json'):
-                    err = response.json()
+                    err = json_loads(response.content)
                     if 'error' in err:
                         raise ServerError(**err['error'])
                     else:
@@ -268,7 +256,7 @@ class MethodContext(dict):
                     raise ServerError('Unknown', 0, response.text)
             if not response.ok:
                 response.raise_for_status()
-            resp = response.json()
+            resp = json_loads(response.content)
             if 'result' not in resp:
                 raise ServerError('Unknown', 0,
                                   'An unknown server error occurred')
@@ -361,11 +349,11 @@ class Application(object):
         if environ['REQUEST_METHOD'] == 'OPTIONS':
             # we basically do nothing and just return headers
             status = '200 OK'
-            rpc_result = ""
+            rpc_result = b''
         else:
             request_body = environ['wsgi.input'].read(body_size)
             try:
-                req = json.loads(request_body)
+                req = json_loads(request_body)
             except ValueError as ve:
                 err = {'error': {'code': -32700,
                                  'name': "Parse error",
@@ -449,7 +437,7 @@ class Application(object):
         if rpc_result:
             response_body = rpc_result
         else:
-            response_body = ''
+            response_body = b''
 
         response_headers = [
             ('Access-Control-Allow-Origin', '*'),
@@ -458,7 +446,7 @@ class Application(object):
             ('content-type', 'application/json'),
             ('content-length', str(len(response_body)))]
         start_response(status, response_headers)
-        return [response_body.encode('utf8')]
+        return [response_body]
 
     def process_error(self, error, context, request, trace=None):
         if trace:
@@ -476,7 +464,7 @@ class Application(object):
         else:
             error['version'] = '1.0'
             error['error']['error'] = trace
-        return json.dumps(error)
+        return json_dumps(error)
 
     def now_in_utc(self):
         # noqa Taken from http://stackoverflow.com/questions/3401428/how-to-get-an-isoformat-datetime-string-including-the-default-timezone @IgnorePep8
@@ -553,7 +541,7 @@ def stop_server():
 def process_async_cli(input_file_path, output_file_path, token):
     exit_code = 0
     with open(input_file_path) as data_file:
-        req = json.load(data_file)
+        req = json_loads(data_file.read())
     if 'version' not in req:
         req['version'] = '1.1'
     if 'id' not in req:
@@ -594,8 +582,8 @@ def process_async_cli(input_file_path, output_file_path, token):
                 }
     if 'error' in resp:
         exit_code = 500
-    with open(output_file_path, "w") as f:
-        f.write(json.dumps(resp, cls=JSONObjectEncoder))
+    with open(output_file_path, "wb") as f:
+        f.write(json_dumps(resp))
     return exit_code
 
 if __name__ == "__main__":
@@ -0,0 +1,75 @@
+'''
+Contiguity and composition metrics of an assembly, computed with NumPy from the per contig
+arrays of fasta_stats.scan_fasta.
+'''
+import numpy as np
+
+# the fractions of the assembly (or of the expected genome) for the Nx/Lx and NGx/LGx metrics
+NX_FRACTIONS = [50, 90]
+# the number of logarithmic contig length histogram bins per factor of ten
+BINS_PER_DECADE = 4
+
+
+def nx_lx(sorted_lengths, cumulative, total, fraction):
+    '''
+    Returns the length of the contig at which the lengths, sorted from long to short, add up
+    to fraction of total, and the number of contigs up to it; (None, None) if they never do.
+    '''
+    index = int(np.searchsorted(cumulative, fraction * total))
+    if index >= len(sorted_lengths):
+        return None, None
+    return int(sorted_lengths[index]), index + 1
+
+
+def length_histogram(lengths):
+    '''
+    Returns the contig length histogram with BINS_PER_DECADE logarithmic bins per factor of
+    ten, as a dict of the bin edges and counts.
+    '''
+    lengths = lengths[lengths > 0]
+    if len(lengths) == 0:
+        return {'edges': [], 'counts': []}
+    low = np.floor(np.log10(lengths.min()) * BINS_PER_DECADE)
+    high = np.floor(np.log10(lengths.max()) * BINS_PER_DECADE) + 1
+    edges = np.unique(np.round(10 ** (np.arange(low, high + 1) / BINS_PER_DECADE)))
+    counts, _ = np.histogram(lengths, edges)
+    return {'edges': edges.astype(np.int64).tolist(), 'counts': counts.tolist()}
+
+
+def assembly_metrics(stats, expected_genome_size=None):
+    '''
+    Computes the metrics of an assembly from its scan_fasta arrays: the number of contigs,
+    total and mean length, largest contig, N50/N90 and L50/L90, NG50/NG90 and LG50/LG90
+    against expected_genome_size (None without it), auN (the length weighted mean contig
+    length), GC content in percent of the called bases, the number of gaps (runs of Ns) and
+    their total length, and the logarithmic length histogram.
+    '''
+    lengths = np.asarray(stats['lengths'], dtype=np.int64)
+    sorted_lengths = np.sort(lengths)[::-1]
+    cumulative = np.cumsum(sorted_lengths)
+    total = int(cumulative[-1]) if len(cumulative) else 0
+    gap_length = int(np.sum(stats['n']))
+    called = total - gap_length
+    metrics = {
+        'contigs': len(lengths),
+        'total_length': total,
+        'largest_contig': int(sorted_lengths[0]) if len(lengths) else 0,
+        'mean_length': float(total) / len(lengths) if len(lengths) else 0.0,
+        'aun': float(np.sum(sorted_lengths.astype(np.float64) ** 2)) / total if total else 0.0,
+        'gc_content': 100.0 * float(np.sum(stats['gc'])) / called if called > 0 else None,
+        'gaps': int(np.sum(stats['n_runs'])),
+        'gap_length': gap_length,
+        'length_histogram': length_histogram(lengths),
+        'expected_genome_size': expected_genome_size,
+    }
+    for percent in NX_FRACTIONS:
+        fraction = percent / 100.0
+        nx, lx = nx_lx(sorted_lengths, cumulative, total, fraction) if total else (0, 0)
+        metrics['n' + str(percent)] = nx
+        metrics['l' + str(percent)] = lx
+        ngx, lgx = None, None
+        if expected_genome_size:
+            ngx, lgx = nx_lx(sorted_lengths, cumulative, expected_genome_size, fraction)
+        metrics['ng' + str(percent)] = ngx
+        metrics['lg' + str(percent)] = lgx
+    return metrics
@@ -6,10 +6,11 @@ A very basic KBase auth client for the Python server.
 @author: gaprice@lbl.gov
 '''
 import time as _time
-import requests as _requests
 import threading as _threading
 import hashlib
 
+from installed_clients.baseclient import get_session as _get_session
+
 
 class TokenCache(object):
     ''' A basic cache for tokens. '''
@@ -76,7 +77,7 @@ class KBaseAuth(object):
             return user
 
         d = {'token': token, 'fields': 'user_id'}
-        ret = _requests.post(self._authurl, data=d)
+        ret = _get_session().post(self._authurl, data=d)
         if not ret.ok:
             try:
                 err = ret.json()
@@ -0,0 +1,85 @@
+'''
+Streaming filter of the contigs.fa file of velvetg by contig length and coverage.
+
+velvetg names its contigs NODE_<id>_length_<L>_cov_<C>, where L is the length of the node in
+k-mers (the contig is L + k - 1 bp long) and C its k-mer coverage. The filter decides on each
+contig from its header alone, and copies the contigs it keeps to the filtered file record by
+record from a memory map, so it never holds more than one record in Python objects. Contigs
+with other headers are measured instead.
+'''
+import mmap
+import os
+import re
+
+import numpy as np
+
+HEADER_RE = re.compile(br'>NODE_\d+_length_(\d+)_cov_(\d+(?:\.\d*)?(?:[eE][+-]?\d+)?)')
+# matches every header line, capturing the coverage of the velvetg ones
+COVERAGE_RE = re.compile(br'^>(?:NODE_\d+_length_\d+_cov_(\d+(?:\.\d*)?(?:[eE][+-]?\d+)?))?',
+                         re.MULTILINE)
+
+
+def _records(mapped):
+    ''' Yields the start and end offsets of the records of a memory mapped FASTA file. '''
+    start = 0 if mapped[:1] == b'>' else mapped.find(b'\n>') + 1
+    if start == 0 and mapped[:1] != b'>':
+        return
+    while start < len(mapped):
+        end = mapped.find(b'\n>', start)
+        end = len(mapped) if end < 0 else end + 1
+        yield start, end
+        start = end
+
+
+def sequence_length(sequence):
+    ''' Returns the number of bases of the sequence lines of a record. '''
+    return (len(sequence) - sequence.count(b'\n') - sequence.count(b'\r') -
+            sequence.count(b' ') - sequence.count(b'\t'))
+
+
+def contig_coverage(path):
+    '''
+    Returns the k-mer coverages of the contigs of a FASTA file, from their velvetg headers, as
+    a numpy float array in file order, with NaN for contigs with other headers.
+    '''
+    if os.path.getsize(path) == 0:
+        return np.zeros(0)
+    with open(path, 'rb') as contigs:
+        mapped = mmap.mmap(contigs.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        coverages = COVERAGE_RE.findall(mapped)
+    finally:
+        mapped.close()
+    return np.array([float(c) if c else np.nan for c in coverages])
+
+
+def filter_contigs(source, target, min_length=0, min_coverage=0, hash_length=None):
+    '''
+    Writes the contigs of source that are at least min_length bp long and have a k-mer
+    coverage of at least min_coverage to target. The coverage of contigs without a velvetg
+    header is unknown, and they are kept.
+    Returns a dict with the number of kept and dropped contigs and of their bases.
+    '''
+    counts = {'kept': 0, 'dropped': 0, 'kept_bases': 0, 'dropped_bases': 0}
+    with open(target, 'wb') as filtered:
+        if os.path.getsize(source) == 0:
+            return counts
+        with open(source, 'rb') as contigs:
+            mapped = mmap.mmap(contigs.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for start, end in _records(mapped):
+                header_end = mapped.find(b'\n', start, end) + 1 or end
+                match = HEADER_RE.match(mapped[start:header_end])
+                if match and hash_length:
+                    length = int(match.group(1)) + hash_length - 1
+                else:
+                    length = sequence_length(mapped[header_end:end])
+                keep = length >= min_length and (
+                    not min_coverage or not match or float(match.group(2)) >= min_coverage)
+                if keep:
+                    filtered.write(mapped[start:end])
+                counts['kept' if keep else 'dropped'] += 1
+                counts['kept_bases' if keep else 'dropped_bases'] += length
+        finally:
+            mapped.close()
+    return counts
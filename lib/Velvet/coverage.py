@@ -0,0 +1,107 @@
+'''
+Estimation of Velvet's exp_cov and cov_cutoff from the node statistics of a first velvetg
+pass.
+
+velvetg writes one line per graph node to stats.txt, with the node length and the k-mer
+coverage of each read category. Weighting the coverage histogram by node length makes the
+unique genomic sequence stand out as a peak at the expected k-mer coverage, while the short
+nodes produced by sequencing errors pile up at the low end. Leaving the short nodes out of the
+histogram removes most of that error peak, which for low coverage libraries is not separated
+from the genomic one by a clear valley. This is the estimate that VelvetOptimiser and
+velvet-estimate-exp_cov.pl derive by hand.
+'''
+import numpy as np
+
+# the coverage histogram has bins of one k-mer per base
+BIN_WIDTH = 1.0
+# nodes shorter than this, in k-mers, are mostly sequencing errors and are left out of the
+# histogram, unless no node is this long
+MIN_NODE_LENGTH = 2000
+# the number of bins of the moving average that smooths the histogram before peak finding
+SMOOTHING_BINS = 3
+# nodes with a higher coverage are repeats, which would only widen the histogram
+MAX_COVERAGE_QUANTILE = 0.99
+# cov_cutoff is this fraction of the estimated expected coverage
+COV_CUTOFF_FRACTION = 0.5
+# the settings that decide the estimates, for fingerprints of runs that estimate the coverage
+COVERAGE_ESTIMATOR_SETTINGS = [BIN_WIDTH, MIN_NODE_LENGTH, SMOOTHING_BINS,
+                               MAX_COVERAGE_QUANTILE, COV_CUTOFF_FRACTION]
+
+
+def read_node_stats(path):
+    '''
+    Reads a velvetg stats.txt file.
+    Returns a tuple of numpy arrays of the node lengths and of the node k-mer coverages,
+    summed over all short read categories.
+    '''
+    with open(path) as stats:
+        header = stats.readline().split()
+    length_column = header.index('lgth')
+    coverage_columns = [i for i, name in enumerate(header)
+                        if name.startswith('short') and name.endswith('_cov')]
+    table = np.loadtxt(path, skiprows=1, ndmin=2,
+                       usecols=[length_column] + coverage_columns)
+    if table.size == 0:
+        return np.zeros(0), np.zeros(0)
+    return table[:, 0], table[:, 1:].sum(axis=1)
+
+
+def _weighted_quantile(values, weights, quantile):
+    order = np.argsort(values)
+    cumulative = np.cumsum(weights[order])
+    return values[order][np.searchsorted(cumulative, quantile * cumulative[-1])]
+
+
+def coverage_peak(lengths, coverages):
+    '''
+    Returns the k-mer coverage at the peak of the length weighted node coverage histogram of
+    the nodes of at least MIN_NODE_LENGTH, ignoring the low coverage error peak, or None if
+    there are no covered nodes.
+    '''
+    lengths = np.asarray(lengths, dtype=np.float64)
+    coverages = np.asarray(coverages, dtype=np.float64)
+    covered = np.isfinite(coverages) & (coverages > 0) & (lengths > 0)
+    lengths = lengths[covered]
+    coverages = coverages[covered]
+    if lengths.size == 0:
+        return None
+    long_nodes = lengths >= MIN_NODE_LENGTH
+    if long_nodes.any():
+        lengths = lengths[long_nodes]
+        coverages = coverages[long_nodes]
+
+    max_coverage = _weighted_quantile(coverages, lengths, MAX_COVERAGE_QUANTILE)
+    kept = coverages <= max_coverage
+    bins = np.floor(coverages[kept] / BIN_WIDTH).astype(np.int64)
+    histogram = np.bincount(bins, weights=lengths[kept])
+    if histogram.size >= SMOOTHING_BINS:
+        histogram = np.convolve(histogram, np.ones(SMOOTHING_BINS) / SMOOTHING_BINS, 'same')
+
+    # skip what is left of the error peak, as when all nodes are short: from the first
+    # non-empty bin, everything up to the first local minimum after the histogram starts to
+    # fall. A first peak that falls off above the cov_cutoff of the next one is the genomic
+    # peak followed by a repeat, and is kept.
+    start = int(np.flatnonzero(histogram > 0)[0])
+    slope = np.diff(histogram[start:])
+    falling = np.flatnonzero(slope < 0)
+    if falling.size:
+        rising = np.flatnonzero(slope[falling[0]:] > 0)
+        if rising.size:
+            valley = start + falling[0] + np.flatnonzero(slope[falling[0]:] >= 0)[0]
+            minimum = start + int(falling[0] + rising[0])
+            next_peak = minimum + int(np.argmax(histogram[minimum:]))
+            if valley < next_peak * COV_CUTOFF_FRACTION:
+                start = minimum
+    peak = start + int(np.argmax(histogram[start:]))
+    return (peak + 0.5) * BIN_WIDTH
+
+
+def estimate_coverage(stats_file):
+    '''
+    Estimates exp_cov and cov_cutoff from a velvetg stats.txt file.
+    Returns a dict with exp_cov and cov_cutoff, or None if the file has no covered nodes.
+    '''
+    peak = coverage_peak(*read_node_stats(stats_file))
+    if peak is None:
+        return None
+    return {'exp_cov': round(peak, 1), 'cov_cutoff': round(peak * COV_CUTOFF_FRACTION, 1)}
@@ -0,0 +1,218 @@
+'''
+A size bounded, least recently used cache of files on disk.
+
+Each cache entry is a directory named after its key. Entries are published with an atomic
+rename, so concurrent writers of the same key never expose a partial entry, and files are
+hard linked in and out of the cache where possible so that storing and restoring an entry
+costs no copying.
+
+Caches of files that can't be reproduced cheaply can verify their entries: a manifest of the
+sizes and digests of the files is stored with each entry and checked whenever it is used, and
+entries that fail the check are dropped. A cross process lock per key lets concurrent jobs
+fill an entry only once.
+'''
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import threading as _threading
+import uuid
+
+# the file of a verified entry with the sizes and digests of its other files
+MANIFEST_FILE = '.manifest.json'
+# the folder of the lock files of the keys
+LOCKS_DIR = '.locks'
+
+
+def cache_key(*parts):
+    ''' Returns a stable hex digest of the given string parts. '''
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def file_digest(path, block_size=1 << 20):
+    ''' Returns the sha256 hex digest of a file's contents, read in blocks. '''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def link_or_copy(source, target):
+    ''' Hard links source to target, falling back to a copy across file systems. '''
+    if os.path.lexists(target):
+        os.remove(target)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+class DiskCache(object):
+    ''' A size bounded, least recently used cache of files on disk. '''
+
+    _lock = _threading.RLock()
+
+    def __init__(self, root, max_bytes, verify=False):
+        self._root = root
+        self._max_bytes = max_bytes
+        self._verify = verify
+        if not os.path.exists(root):
+            os.makedirs(root)
+
+    @contextlib.contextmanager
+    def lock(self, key):
+        '''
+        Holds an exclusive lock on key, across threads and processes, for as long as the
+        context lasts, so that concurrent writers of an entry can fill it once.
+        '''
+        locks = os.path.join(self._root, LOCKS_DIR)
+        os.makedirs(locks, exist_ok=True)
+        with open(os.path.join(locks, key), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def get(self, key):
+        '''
+        Returns the directory of the entry for key, or None if there is none.
+        A hit marks the entry as the most recently used one.
+        '''
+        entry = os.path.join(self._root, key)
+        if not os.path.isdir(entry):
+            return None
+        if self._verify and not self._intact(entry):
+            self.remove(key)
+            return None
+        try:
+            os.utime(entry, None)
+        except OSError:
+            # evicted in the meantime
+            return None
+        return entry
+
+    def put(self, key, files):
+        '''
+        Stores files (a dict of entry file name to source path) as the entry for key and
+        returns the entry directory. An existing entry for key is kept as is.
+        '''
+        entry = os.path.join(self._root, key)
+        if os.path.isdir(entry):
+            return self.get(key) or entry
+        staging = os.path.join(self._root, '.tmp-' + str(uuid.uuid4()))
+        os.makedirs(staging)
+        try:
+            for name, source in files.items():
+                link_or_copy(source, os.path.join(staging, name))
+            if self._verify:
+                manifest = {}
+                for name in files:
+                    path = os.path.join(staging, name)
+                    manifest[name] = [os.path.getsize(path), file_digest(path)]
+                with open(os.path.join(staging, MANIFEST_FILE), 'w') as f:
+                    json.dump(manifest, f)
+            try:
+                os.rename(staging, entry)
+            except OSError:
+                # another writer published the same entry first
+                if not os.path.isdir(entry):
+                    raise
+        finally:
+            if os.path.exists(staging):
+                shutil.rmtree(staging, ignore_errors=True)
+        self.evict(keep=key)
+        return entry
+
+    def put_json(self, key, name, document, files=None):
+        '''
+        Stores document as the JSON file name of the entry for key, together with files (a
+        dict of entry file name to source path), and returns the entry directory. Raises an
+        IOError or OSError if the entry can't be stored, which for a cache of results that
+        can be made again only costs their reuse.
+        '''
+        staged = os.path.join(self._root, '.tmp-' + str(uuid.uuid4()) + '.json')
+        try:
+            with open(staged, 'w') as f:
+                json.dump(document, f)
+            return self.put(key, dict(files or {}, **{name: staged}))
+        finally:
+            if os.path.exists(staged):
+                os.remove(staged)
+
+    def restore(self, key, target_dir, names=None):
+        '''
+        Links the files of the entry for key (or only the given names) into target_dir.
+        Returns False if there is no such entry.
+        '''
+        entry = self.get(key)
+        if entry is None:
+            return False
+        try:
+            for name in names or [n for n in os.listdir(entry) if n != MANIFEST_FILE]:
+                link_or_copy(os.path.join(entry, name), os.path.join(target_dir, name))
+        except (IOError, OSError):
+            # evicted or corrupted while restoring
+            return False
+        return True
+
+    def remove(self, key):
+        ''' Removes the entry for key, if there is one. '''
+        entry = os.path.join(self._root, key)
+        trash = os.path.join(self._root, '.tmp-' + str(uuid.uuid4()))
+        try:
+            # readers see the entry either whole or gone
+            os.rename(entry, trash)
+        except OSError:
+            return
+        shutil.rmtree(trash, ignore_errors=True)
+
+    def _intact(self, entry):
+        ''' Tells whether the files of an entry have the sizes and digests of its manifest. '''
+        try:
+            with open(os.path.join(entry, MANIFEST_FILE)) as f:
+                manifest = json.load(f)
+            paths = [(os.path.join(entry, name), size, digest)
+                     for name, (size, digest) in manifest.items()]
+            # compare all sizes before reading any file
+            return (all(os.path.getsize(path) == size for path, size, _ in paths) and
+                    all(file_digest(path) == digest for path, _, digest in paths))
+        except (IOError, OSError, ValueError):
+            return False
+
+    def _entries(self):
+        ''' Returns the last use time, key and size in bytes of every entry. '''
+        entries = []
+        for key in os.listdir(self._root):
+            entry = os.path.join(self._root, key)
+            if key.startswith('.') or not os.path.isdir(entry):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(entry, name))
+                           for name in os.listdir(entry))
+                used = os.path.getmtime(entry)
+            except OSError:
+                continue
+            entries.append((used, key, size))
+        return entries
+
+    def evict(self, keep=None):
+        ''' Removes the least recently used entries until the cache fits in max_bytes. '''
+        with self._lock:
+            entries = self._entries()
+            total = sum(size for _, _, size in entries)
+            for used, key, size in sorted(entries):
+                if total <= self._max_bytes:
+                    break
+                if key == keep:
+                    continue
+                self.remove(key)
+                total -= size
+
@@ -0,0 +1,270 @@
+'''
+Supervised execution of the stages of a Velvet job (velveth, velvetg, upload and report).
+
+Every stage produces a structured result: a dict with the stage's status (one of the STATUS_*
+values), return code, error message and the resource metrics of telemetry. External programs
+run in a process group of their own, so that a timeout, a stall or a cancellation of the job
+terminates the program together with everything it started, and no orphaned process keeps
+holding memory after the job has gone.
+'''
+import os
+import signal
+import subprocess
+import threading
+import time
+
+from Velvet.telemetry import exit_code, read_oom_kills, read_proc_cpu_time, read_proc_io
+
+STATUS_OK = 'ok'
+STATUS_FAILED = 'failed'
+STATUS_TIMEOUT = 'timeout'
+STATUS_STALLED = 'stalled'
+STATUS_CANCELLED = 'cancelled'
+STATUS_OOM = 'oom'
+
+# seconds between SIGTERM and SIGKILL when a process group is stopped
+GRACE_PERIOD = 10
+
+_groups = set()
+_groups_lock = threading.Lock()
+_cancelled = threading.Event()
+_handlers_installed = False
+
+
+class StageFailed(ValueError):
+    ''' Raised when a stage does not finish with STATUS_OK; result is the stage result. '''
+
+    def __init__(self, result):
+        super(StageFailed, self).__init__(result['error'])
+        self.result = result
+
+
+def new_result(stage=None):
+    ''' Returns a stage result for a stage that has not run yet. '''
+    return {'stage': stage, 'status': STATUS_OK, 'return_code': 0, 'error': None,
+            'wall_time': 0.0, 'user_cpu_time': 0.0, 'system_cpu_time': 0.0,
+            'max_rss': 0, 'read_bytes': 0, 'write_bytes': 0}
+
+
+def _signal_group(pgid, signum):
+    try:
+        os.killpg(pgid, signum)
+    except OSError:
+        # the group has no processes left
+        pass
+
+
+def cancel(signum=signal.SIGTERM):
+    '''
+    Cancels the job: sends signum to the process groups of all running stages, and makes
+    running and future stages finish with STATUS_CANCELLED.
+    '''
+    _cancelled.set()
+    with _groups_lock:
+        for pgid in list(_groups):
+            _signal_group(pgid, signum)
+
+
+def is_cancelled():
+    return _cancelled.is_set()
+
+
+def reset_cancel():
+    '''
+    Starts a new job: clears the cancellation of an earlier job, whose signal a previous
+    handler such as the KeyboardInterrupt of SIGINT handled without ending the process.
+    '''
+    _cancelled.clear()
+
+
+def install_signal_handlers(signums=(signal.SIGTERM, signal.SIGINT)):
+    '''
+    Cancels the job on SIGTERM and SIGINT before handing the signal to the previous handler.
+    The cancellation lasts until the next job calls reset_cancel.
+    Signal handlers can only be installed from the main thread; returns False elsewhere.
+    '''
+    global _handlers_installed
+    if threading.current_thread() is not threading.main_thread():
+        return False
+    if _handlers_installed:
+        return True
+
+    def install(signum):
+        previous = signal.getsignal(signum)
+
+        def handler(received, frame):
+            cancel()
+            if callable(previous):
+                previous(received, frame)
+            else:
+                # restore the previous disposition and let it act on the signal
+                signal.signal(received, previous if previous is not None else signal.SIG_DFL)
+                os.kill(os.getpid(), received)
+        signal.signal(signum, handler)
+
+    for signum in signums:
+        install(signum)
+    _handlers_installed = True
+    return True
+
+
+def _output_size(paths):
+    ''' Returns the total size of the given files and of the files in the given folders. '''
+    total = 0
+    for path in paths or []:
+        names = [path]
+        if os.path.isdir(path):
+            try:
+                names = [os.path.join(path, name) for name in os.listdir(path)]
+            except OSError:
+                names = []
+        for name in names:
+            try:
+                total += os.path.getsize(name)
+            except OSError:
+                pass
+    return total
+
+
+def _oom_killed(return_code, oom_kills):
+    '''
+    Tells whether a process that we did not stop was killed by the out of memory killer:
+    it died of SIGKILL, and the container's OOM kill count went up since oom_kills (or the
+    kernel does not count OOM kills).
+    '''
+    if return_code != -signal.SIGKILL:
+        return False
+    current = read_oom_kills()
+    return oom_kills is None or current is None or current > oom_kills
+
+
+def _exited(p):
+    if hasattr(os, 'waitid'):
+        # WNOWAIT leaves the exited child unreaped, so /proc/<pid>/io can still be read and
+        # its process group id can't be reused before the group has been cleaned up
+        return os.waitid(os.P_PID, p.pid, os.WEXITED | os.WNOHANG | os.WNOWAIT) is not None
+    return p.poll() is not None
+
+
+def run_process(cmd, cwd=None, env=None, timeout=None, stall_timeout=None, watch=None,
+                poll_interval=0.5):
+    '''
+    Runs cmd in a new process group and waits for it to finish, stopping it when it runs for
+    longer than timeout seconds, when neither its CPU time nor the size of the watched files
+    and folders has changed for stall_timeout seconds, or when the job is cancelled.
+    Stopping sends SIGTERM to the process group, and SIGKILL after GRACE_PERIOD seconds.
+    A process killed by the out of memory killer finishes with STATUS_OOM.
+    Returns the stage result, with the metrics of the process.
+    '''
+    result = new_result()
+    if _cancelled.is_set():
+        result.update(status=STATUS_CANCELLED, return_code=None, error='cancelled')
+        return result
+    oom_kills = read_oom_kills()
+    start = time.time()
+    p = subprocess.Popen(cmd, cwd=cwd, env=env, shell=False, start_new_session=True)
+    with _groups_lock:
+        _groups.add(p.pid)
+
+    io = None
+    interval = 0.01
+    stop = None
+    stopped_at = None
+    progress = None
+    progress_at = start
+    try:
+        while not _exited(p):
+            io = read_proc_io(p.pid) or io
+            now = time.time()
+            if stop is None:
+                if _cancelled.is_set():
+                    stop = (STATUS_CANCELLED, 'cancelled')
+                elif timeout and now - start > timeout:
+                    stop = (STATUS_TIMEOUT, 'exceeded the time limit of {} s'.format(timeout))
+                elif stall_timeout:
+                    current = (_output_size(watch), read_proc_cpu_time(p.pid))
+                    if current != progress:
+                        progress = current
+                        progress_at = now
+                    elif now - progress_at > stall_timeout:
+                        stop = (STATUS_STALLED,
+                                'made no progress for {} s'.format(stall_timeout))
+                if stop is not None:
+                    _signal_group(p.pid, signal.SIGTERM)
+                    stopped_at = now
+            elif stopped_at is not None and now - stopped_at > GRACE_PERIOD:
+                _signal_group(p.pid, signal.SIGKILL)
+                stopped_at = None
+            time.sleep(interval)
+            interval = min(interval * 2, poll_interval)
+        io = read_proc_io(p.pid) or io
+    finally:
+        # whatever the program started must not outlive it
+        _signal_group(p.pid, signal.SIGKILL)
+        if p.returncode is None:
+            _, status, rusage = os.wait4(p.pid, 0)
+            p.returncode = exit_code(status)
+            result['user_cpu_time'] = rusage.ru_utime
+            result['system_cpu_time'] = rusage.ru_stime
+            result['max_rss'] = rusage.ru_maxrss
+        with _groups_lock:
+            _groups.discard(p.pid)
+
+    result['wall_time'] = time.time() - start
+    result['return_code'] = p.returncode
+    if io:
+        result.update(io)
+    if stop is not None:
+        result['status'], result['error'] = stop
+    elif _oom_killed(p.returncode, oom_kills):
+        result['status'] = STATUS_OOM
+        result['error'] = 'killed by the out of memory killer'
+    elif p.returncode != 0:
+        result['status'] = STATUS_FAILED
+        result['error'] = 'return code: ' + str(p.returncode)
+    return result
+
+
+def run_call(func, args=(), timeout=None, poll_interval=0.5):
+    '''
+    Runs func(*args) in a worker thread and waits for it for at most timeout seconds, or
+    until the job is cancelled.
+    Returns the stage result, with the return value of func in value, or the exception it
+    raised in exception. A call that is still running when the stage stops can't be
+    interrupted and is left to finish in the background.
+    '''
+    result = new_result()
+    if _cancelled.is_set():
+        result.update(status=STATUS_CANCELLED, return_code=None, error='cancelled')
+        return result
+    outcome = {}
+
+    def target():
+        try:
+            outcome['value'] = func(*args)
+        except Exception as e:
+            outcome['exception'] = e
+
+    start = time.time()
+    worker = threading.Thread(target=target, name='stage-' + getattr(func, '__name__', 'call'))
+    worker.daemon = True
+    worker.start()
+    while worker.is_alive():
+        if _cancelled.is_set():
+            result.update(status=STATUS_CANCELLED, error='cancelled')
+            break
+        if timeout and time.time() - start > timeout:
+            result.update(status=STATUS_TIMEOUT,
+                          error='exceeded the time limit of {} s'.format(timeout))
+            break
+        worker.join(poll_interval if not timeout else
+                    max(0.0, min(poll_interval, start + timeout - time.time())))
+    result['wall_time'] = time.time() - start
+    if result['status'] != STATUS_OK:
+        result['return_code'] = None
+    elif 'exception' in outcome:
+        result.update(status=STATUS_FAILED, return_code=1, error=str(outcome['exception']),
+                      exception=outcome['exception'])
+    else:
+        result['value'] = outcome.get('value')
+    return result
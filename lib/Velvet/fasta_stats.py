@@ -0,0 +1,113 @@
+'''
+Single pass statistics of FASTA files.
+
+The file is memory mapped and scanned with NumPy: every record contributes its sequence
+length, its GC and N counts and its number of N runs (scaffold gaps) to compact arrays,
+without a Python level loop over lines or contigs. Large files are cut into chunks at record
+boundaries, which are scanned in parallel by a pool of threads (NumPy releases the GIL on
+large arrays).
+'''
+import functools
+import mmap
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# the size of the chunks a file is scanned in, which bounds the temporary arrays of a scan
+CHUNK_SIZE = 8 << 20
+
+_HEADER = ord('>')
+_NEWLINE = ord('\n')
+# space, tab, CR, LF and the other whitespace all sort below the printable characters
+_MAX_WHITESPACE = ord(' ')
+# lower case is upper case with bit 0x20 set
+_LOWER = 0x20
+
+
+def _segment_counts(mask, starts, ends):
+    ''' Returns the number of set values of mask in [starts[i], ends[i]) for each i. '''
+    positions = np.flatnonzero(mask)
+    return np.searchsorted(positions, ends) - np.searchsorted(positions, starts)
+
+
+def _scan_chunk(data, start, end):
+    '''
+    Scans the records of data[start:end], which starts with a header.
+    Returns the arrays of the sequence lengths, GC counts, N counts and N runs of the records.
+    '''
+    block = data[start:end]
+    line_starts = np.flatnonzero(block[:-1] == _NEWLINE) + 1
+    headers = line_starts[block[line_starts] == _HEADER]
+    headers = np.concatenate([[0], headers]).astype(np.int64)
+    # a header on the last line of the file ends at the end of the block
+    newlines = np.append(np.flatnonzero(block == _NEWLINE), len(block))
+    # each sequence starts after the end of its header line and ends at the next header
+    starts = np.minimum(newlines[np.searchsorted(newlines, headers)] + 1, len(block))
+    ends = np.append(headers[1:], len(block))
+    whitespace = block <= _MAX_WHITESPACE
+    lengths = ends - starts - _segment_counts(whitespace, starts, ends)
+    lower = block | _LOWER
+    gc = (lower == ord('g')) | (lower == ord('c')) | (lower == ord('s'))
+    n = lower == ord('n')
+    # an N run starts at an N after anything but an N, unless the N starts a line and the
+    # last sequence character before it, skipping line ends and blank lines, is an N of the
+    # same record
+    n_run = n.copy()
+    n_run[1:] &= ~n[:-1]
+    wrapped = line_starts[n_run[line_starts]]
+    characters = np.flatnonzero(~whitespace)
+    previous = characters[np.searchsorted(characters, wrapped) - 1]
+    record_start = starts[np.searchsorted(starts, wrapped, 'right') - 1]
+    n_run[wrapped[n[previous] & (previous >= record_start)]] = False
+    return (lengths,
+            _segment_counts(gc, starts, ends),
+            _segment_counts(n, starts, ends),
+            _segment_counts(n_run, starts, ends))
+
+
+def _chunk_bounds(mapped, first, chunk_size):
+    ''' Cuts mapped[first:] into chunks of about chunk_size bytes that start at headers. '''
+    bounds = [first]
+    while True:
+        split = mapped.find(b'\n>', bounds[-1] + chunk_size)
+        if split < 0:
+            break
+        bounds.append(split + 1)
+    bounds.append(len(mapped))
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def scan_fasta(path, workers=1, chunk_size=CHUNK_SIZE):
+    '''
+    Scans a FASTA file in one pass, with up to workers threads for files of several chunks.
+    Returns a dict of numpy int64 arrays with the lengths, gc counts, n counts and n_runs
+    (the number of runs of Ns) of the records, in file order. Whitespace does not count
+    towards the lengths.
+    Raises a ValueError if the file has no records.
+    '''
+    if os.path.getsize(path) == 0:
+        raise ValueError('There are no contigs in ' + path)
+    with open(path, 'rb') as fasta:
+        mapped = mmap.mmap(fasta.fileno(), 0, access=mmap.ACCESS_READ)
+    scan = functools.partial(_scan_chunk, np.frombuffer(mapped, dtype=np.uint8))
+    try:
+        first = 0 if mapped[:1] == b'>' else mapped.find(b'\n>') + 1
+        if first == 0 and mapped[:1] != b'>':
+            raise ValueError('There are no contigs in ' + path)
+        chunks = _chunk_bounds(mapped, first, chunk_size)
+        if workers > 1 and len(chunks) > 1:
+            with ThreadPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+                results = list(executor.map(scan, *zip(*chunks)))
+        else:
+            results = [scan(*c) for c in chunks]
+    finally:
+        # the array view of the map has to go before the map can be closed
+        scan = None
+        try:
+            mapped.close()
+        except BufferError:
+            # a traceback still holds a view of the map, which is unmapped when it goes
+            pass
+    lengths, gc, n, n_runs = (np.concatenate(column) for column in zip(*results))
+    return {'lengths': lengths, 'gc': gc, 'n': n, 'n_runs': n_runs}
@@ -0,0 +1,167 @@
+'''
+A self-contained HTML assembly report, rendered locally instead of by QUAST.
+
+The page holds the metrics table, the text report and SVG plots of the contig length
+distribution, the Nx curve and the length weighted k-mer coverage distribution. The plot data
+is computed with NumPy from the scan_fasta arrays and drawn inline, so the page needs neither
+scripts nor other files.
+'''
+import html
+
+import numpy as np
+
+# the size of the plots in pixels, and of their margins for the axis labels
+WIDTH = 640
+HEIGHT = 280
+MARGIN = 50
+# the number of bins of the coverage distribution
+COVERAGE_BINS = 50
+# the coverage percentile the coverage distribution is cut at, to keep repeats off the scale
+COVERAGE_PERCENTILE = 99
+
+_STYLE = '''
+body { font-family: sans-serif; margin: 2em; color: #222; }
+table { border-collapse: collapse; }
+td, th { padding: 2px 12px; border-bottom: 1px solid #ddd; text-align: right; }
+th { text-align: left; }
+pre { background: #f6f6f6; padding: 1em; overflow-x: auto; }
+svg text { font-size: 11px; }
+'''
+
+
+def nx_curve(lengths):
+    '''
+    Returns the Nx values of the lengths for x = 0 to 100 in steps of 1: the length of the
+    contig at which the contigs, sorted from long to short, cover x% of the total length.
+    '''
+    sorted_lengths = np.sort(np.asarray(lengths, dtype=np.int64))[::-1]
+    cumulative = np.cumsum(sorted_lengths)
+    if len(cumulative) == 0 or cumulative[-1] == 0:
+        return np.zeros(101, dtype=np.int64)
+    index = np.searchsorted(cumulative, np.arange(101) / 100.0 * cumulative[-1])
+    return sorted_lengths[np.minimum(index, len(sorted_lengths) - 1)]
+
+
+def coverage_histogram(lengths, coverage, bins=COVERAGE_BINS):
+    '''
+    Returns the bin edges and the number of bases of the contigs in each bin of k-mer
+    coverage, up to the COVERAGE_PERCENTILE of the coverage. Contigs of unknown (NaN)
+    coverage are left out; returns None if there are none of known coverage.
+    '''
+    lengths = np.asarray(lengths, dtype=np.float64)
+    coverage = np.asarray(coverage, dtype=np.float64)
+    known = ~np.isnan(coverage)
+    if not known.any():
+        return None
+    high = np.percentile(coverage[known], COVERAGE_PERCENTILE) or 1.0
+    counts, edges = np.histogram(coverage[known], bins=bins, range=(0, high),
+                                 weights=lengths[known])
+    return edges, counts
+
+
+def _axes(title, x_label, y_label, x_ticks, y_max):
+    ''' Returns the SVG elements of the frame, labels and ticks of a plot. '''
+    bottom = HEIGHT - MARGIN
+    right = WIDTH - MARGIN / 2
+    parts = ['<text x="{}" y="16" font-weight="bold">{}</text>'.format(MARGIN, html.escape(title)),
+             '<line x1="{0}" y1="{1}" x2="{2}" y2="{1}" stroke="#444"/>'.format(
+                 MARGIN, bottom, right),
+             '<line x1="{0}" y1="{1}" x2="{0}" y2="{2}" stroke="#444"/>'.format(
+                 MARGIN, bottom, MARGIN / 2),
+             '<text x="{}" y="{}" text-anchor="middle">{}</text>'.format(
+                 (MARGIN + right) / 2, HEIGHT - 8, html.escape(x_label)),
+             '<text x="12" y="{0}" transform="rotate(-90 12 {0})" text-anchor="middle">'
+             '{1}</text>'.format((bottom + MARGIN / 2) / 2, html.escape(y_label)),
+             '<text x="{}" y="{}" text-anchor="end">{}</text>'.format(
+                 MARGIN - 4, MARGIN / 2 + 4, _format_number(y_max)),
+             '<text x="{}" y="{}" text-anchor="end">0</text>'.format(MARGIN - 4, bottom)]
+    for x, label in x_ticks:
+        parts.append('<text x="{:.1f}" y="{}" text-anchor="middle">{}</text>'.format(
+            x, bottom + 14, html.escape(label)))
+    return parts
+
+
+def _format_number(value):
+    ''' Formats a plot label with a k, M or G suffix. '''
+    for suffix, scale in [('G', 1e9), ('M', 1e6), ('k', 1e3)]:
+        if abs(value) >= scale:
+            return '{:.3g}{}'.format(value / scale, suffix)
+    return '{:.3g}'.format(value)
+
+
+def _svg(parts):
+    return ('<svg xmlns="http://www.w3.org/2000/svg" width="{0}" height="{1}" '
+            'viewBox="0 0 {0} {1}">{2}</svg>'.format(WIDTH, HEIGHT, ''.join(parts)))
+
+
+def svg_bars(title, x_label, y_label, labels, values):
+    ''' Renders a bar chart of values, with one label per bar, as an SVG element. '''
+    values = np.asarray(values, dtype=np.float64)
+    y_max = float(values.max()) if len(values) and values.max() > 0 else 1.0
+    plot_width = WIDTH - 1.5 * MARGIN
+    plot_height = HEIGHT - 1.5 * MARGIN
+    width = plot_width / max(len(values), 1)
+    heights = values / y_max * plot_height
+    step = max(1, len(values) // 8)
+    ticks = [(MARGIN + (i + 0.5) * width, labels[i]) for i in range(0, len(values), step)]
+    parts = _axes(title, x_label, y_label, ticks, y_max)
+    for i, h in enumerate(heights):
+        parts.append('<rect x="{:.1f}" y="{:.1f}" width="{:.1f}" height="{:.1f}" '
+                     'fill="#4a7fb5"><title>{}: {}</title></rect>'.format(
+                         MARGIN + i * width + 1, HEIGHT - MARGIN - h, max(width - 2, 1), h,
+                         html.escape(labels[i]), _format_number(values[i])))
+    return _svg(parts)
+
+
+def svg_curve(title, x_label, y_label, xs, ys):
+    ''' Renders the line through the points xs, ys as an SVG element. '''
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    x_max = float(xs.max()) or 1.0
+    y_max = float(ys.max()) or 1.0
+    px = MARGIN + xs / x_max * (WIDTH - 1.5 * MARGIN)
+    py = HEIGHT - MARGIN - ys / y_max * (HEIGHT - 1.5 * MARGIN)
+    ticks = [(MARGIN + f * (WIDTH - 1.5 * MARGIN), _format_number(f * x_max))
+             for f in np.linspace(0, 1, 6)]
+    parts = _axes(title, x_label, y_label, ticks, y_max)
+    parts.append('<polyline fill="none" stroke="#4a7fb5" stroke-width="2" points="{}"/>'.format(
+        ' '.join('{:.1f},{:.1f}'.format(x, y) for x, y in zip(px, py))))
+    return _svg(parts)
+
+
+def render_report(title, metrics, text, lengths, coverage=None):
+    '''
+    Renders the HTML report page of an assembly from its assembly_metrics, the text report,
+    and the contig lengths and k-mer coverages (NaN where unknown) in file order.
+    '''
+    rows = []
+    for name, value in [('Contigs', metrics['contigs']),
+                        ('Total length (bp)', metrics['total_length']),
+                        ('Largest contig (bp)', metrics['largest_contig']),
+                        ('Mean length (bp)', '{:.1f}'.format(metrics['mean_length'])),
+                        ('N50 (bp)', metrics['n50']), ('L50', metrics['l50']),
+                        ('N90 (bp)', metrics['n90']), ('L90', metrics['l90']),
+                        ('NG50 (bp)', metrics['ng50']), ('NG90 (bp)', metrics['ng90']),
+                        ('auN (bp)', '{:.1f}'.format(metrics['aun'])),
+                        ('GC (%)', metrics['gc_content'] if metrics['gc_content'] is None
+                         else '{:.2f}'.format(metrics['gc_content'])),
+                        ('Gaps', metrics['gaps']), ('Gap length (bp)', metrics['gap_length'])]:
+        if value is not None:
+            rows.append('<tr><th>{}</th><td>{}</td></tr>'.format(name, value))
+
+    histogram = metrics['length_histogram']
+    plots = [svg_bars('Contig length distribution', 'contig length (bp)', 'contigs',
+                      [_format_number(e) for e in histogram['edges'][:-1]],
+                      histogram['counts']),
+             svg_curve('Nx', 'x (%)', 'Nx (bp)', np.arange(101), nx_curve(lengths))]
+    if coverage is not None:
+        distribution = coverage_histogram(lengths, coverage)
+        if distribution is not None:
+            edges, counts = distribution
+            plots.append(svg_bars('k-mer coverage distribution', 'k-mer coverage', 'bp',
+                                  [_format_number(e) for e in edges[:-1]], counts))
+    return ('<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>{0}</title>'
+            '<style>{1}</style></head><body>\n<h1>{0}</h1>\n<table>{2}</table>\n{3}\n'
+            '<h2>Details</h2>\n<pre>{4}</pre>\n</body></html>\n').format(
+                html.escape(title), _STYLE, ''.join(rows),
+                '\n'.join('<p>' + p + '</p>' for p in plots), html.escape(text))
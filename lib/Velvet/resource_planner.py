@@ -0,0 +1,195 @@
+'''
+Preflight resource planning for Velvet assemblies.
+
+Predicts the peak memory of velveth/velvetg and the size of the intermediate files
+(Sequences, Roadmaps, PreGraph, Graph/LastGraph) from the read count, read length, hash
+length, the number of read categories and the compiled MAXKMERLENGTH, so that jobs that
+cannot fit the container are rejected before any hashing starts.
+
+The estimates are deliberately conservative: they assume that a fixed fraction of all
+k-mers in the reads is distinct (sequencing errors dominate the distinct k-mer count of
+typical short read libraries) and add a safety margin on top.
+'''
+import gzip
+import math
+import os
+
+# share of all read k-mers that end up as distinct k-mers in the hash table
+DISTINCT_KMER_FRACTION = 0.3
+# distinct k-mers per graph node before tour bus / error correction
+KMERS_PER_NODE = 20.0
+# bookkeeping per read held in memory by velvetg (ids, offsets, categories)
+READ_OVERHEAD_BYTES = 48
+# splay tree / hash table overhead per distinct k-mer, on top of the k-mer words
+KMER_OVERHEAD_BYTES = 24
+# fixed overhead per graph node (arcs, pointers, lengths), on top of the coverages
+NODE_OVERHEAD_BYTES = 96
+# bytes of a Sequences fasta header line, e.g. ">SRR000001.1\t12345\t0\n"
+SEQUENCE_HEADER_BYTES = 40
+# read offsets and lengths per read in the binary CnyUnifiedSeq file, on top of 2 bits per base
+BINARY_BYTES_PER_READ = 16
+# bytes of the ROADMAP line and the average annotations of one read in Roadmaps
+ROADMAP_BYTES_PER_READ = 72
+SAFETY_FACTOR = 1.25
+
+# number of records read from each file when the read count has to be estimated
+SAMPLE_RECORDS = 20000
+
+
+def scan_reads_file(path):
+    '''
+    Estimates the number of reads and bases of a fasta or fastq file (optionally gzipped)
+    from its first SAMPLE_RECORDS records and its size on disk.
+    Returns a dict with reads and bases.
+    '''
+    size = os.path.getsize(path)
+    if size == 0:
+        return {'reads': 0, 'bases': 0}
+    opener = gzip.open if path.endswith('.gz') else open
+    reads = 0
+    bases = 0
+    consumed = 0
+    complete = True
+    with opener(path, 'rb') as f:
+        first = f.read(1)
+        f.seek(0)
+        fastq = first == b'@'
+        for line_no, line in enumerate(f):
+            if fastq:
+                if line_no % 4 == 1:
+                    reads += 1
+                    bases += len(line.rstrip())
+                elif line_no % 4 == 3 and reads >= SAMPLE_RECORDS:
+                    complete = False
+                    break
+            elif line.startswith(b'>'):
+                if reads >= SAMPLE_RECORDS:
+                    complete = False
+                    break
+                reads += 1
+            else:
+                bases += len(line.rstrip())
+        if not complete:
+            # position in the file on disk, i.e. compressed bytes for gzipped files
+            raw = f.fileobj if hasattr(f, 'fileobj') else f
+            consumed = raw.tell()
+    if complete or consumed <= 0:
+        return {'reads': reads, 'bases': bases}
+    scale = float(size) / consumed
+    return {'reads': int(reads * scale), 'bases': int(bases * scale)}
+
+
+def estimate_assembly_resources(reads, bases, hash_length, categories, max_kmer_length,
+                                read_tracking=False, binary=False):
+    '''
+    Predicts the peak memory and the intermediate disk usage of one velveth + velvetg run,
+    with the reads stored in the binary CnyUnifiedSeq file instead of Sequences if binary.
+    Returns a dict with memory and disk in bytes, and the per file disk estimates.
+    '''
+    reads = max(0, int(reads))
+    bases = max(0, int(bases))
+    read_length = float(bases) / reads if reads else 0.0
+    kmers = reads * max(0.0, read_length - hash_length + 1)
+    distinct_kmers = kmers * DISTINCT_KMER_FRACTION
+    nodes = distinct_kmers / KMERS_PER_NODE
+    # Velvet packs 32 nucleotides in each 64 bit word of a k-mer
+    kmer_bytes = 8 * int(math.ceil(max_kmer_length / 32.0))
+    # virtual and original coverage per category, for both strands of a node
+    node_bytes = NODE_OVERHEAD_BYTES + 16 * categories
+
+    reads_memory = reads * READ_OVERHEAD_BYTES + bases / 4.0
+    if read_tracking:
+        reads_memory += kmers / KMERS_PER_NODE * 16
+    velveth_memory = distinct_kmers * (kmer_bytes + KMER_OVERHEAD_BYTES)
+    velvetg_memory = (reads_memory + distinct_kmers * (kmer_bytes + KMER_OVERHEAD_BYTES) +
+                      nodes * node_bytes)
+    memory = max(velveth_memory, velvetg_memory) * SAFETY_FACTOR
+
+    files = {
+        'Roadmaps': reads * ROADMAP_BYTES_PER_READ,
+        'PreGraph': distinct_kmers + nodes * 40,
+    }
+    if binary:
+        files['CnyUnifiedSeq'] = reads * BINARY_BYTES_PER_READ + bases / 4.0
+        files['CnyUnifiedSeq.names'] = reads * SEQUENCE_HEADER_BYTES
+    else:
+        files['Sequences'] = reads * SEQUENCE_HEADER_BYTES + bases * 61 / 60.0
+    files['LastGraph'] = files['PreGraph'] * 2 + (reads * 24 if read_tracking else 0)
+    files['Graph'] = files['LastGraph']
+    disk = sum(files.values()) * SAFETY_FACTOR
+    return {'memory': int(memory), 'disk': int(disk),
+            'files': {name: int(size) for name, size in files.items()}}
+
+
+def _read_int(path):
+    try:
+        with open(path) as f:
+            value = f.read().strip()
+    except (IOError, OSError):
+        return None
+    if value == 'max':
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def _read_stat(path, name):
+    ''' Returns the value of name in a cgroup memory.stat file, or None. '''
+    try:
+        with open(path) as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) == 2 and fields[0] == name:
+                    return int(fields[1])
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+
+def get_memory_limit():
+    '''
+    Returns the memory available to this container in bytes: the cgroup (v2 or v1) memory
+    limit minus the working set already in use, or MemAvailable when there is no limit.
+    The working set leaves out the inactive page cache, which the kernel reclaims before
+    it runs out of memory.
+    '''
+    available = None
+    try:
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    available = int(line.split()[1]) * 1024
+                    break
+    except (IOError, OSError, ValueError):
+        pass
+    for limit_file, usage_file, stat_file, inactive_file in [
+            ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory.current',
+             '/sys/fs/cgroup/memory.stat', 'inactive_file'),
+            ('/sys/fs/cgroup/memory/memory.limit_in_bytes',
+             '/sys/fs/cgroup/memory/memory.usage_in_bytes',
+             '/sys/fs/cgroup/memory/memory.stat', 'total_inactive_file')]:
+        limit = _read_int(limit_file)
+        # cgroup v1 reports "no limit" as a huge page aligned number
+        if limit is None or limit >= 1 << 60:
+            continue
+        usage = _read_int(usage_file) or 0
+        inactive = _read_stat(stat_file, inactive_file) or 0
+        limit -= max(0, usage - inactive)
+        return limit if available is None else min(limit, available)
+    return available
+
+
+def get_free_disk(path):
+    ''' Returns the free space in bytes of the file system holding path. '''
+    stat = os.statvfs(path)
+    return stat.f_bavail * stat.f_frsize
+
+
+def format_bytes(size):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if abs(size) < 1024.0:
+            return '{:.1f} {}'.format(size, unit)
+        size /= 1024.0
+    return '{:.1f} TB'.format(size)
@@ -0,0 +1,58 @@
+'''
+Compression of the staged reads files.
+
+velveth reads gzipped fasta and fastq files natively, so keeping the downloaded reads
+compressed with a fast level 1 codec cuts their scratch usage to a fraction at little CPU
+cost. pigz is used when it is installed, with Python's zlib (which compresses without
+holding the GIL) on a pool of threads otherwise.
+'''
+import gzip
+import os
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+COMPRESSION_LEVEL = 1
+BLOCK_SIZE = 1 << 20
+
+
+def _gzip_file(path):
+    target = path + '.gz'
+    partial = target + '.partial'
+    with open(path, 'rb') as source, \
+            gzip.open(partial, 'wb', compresslevel=COMPRESSION_LEVEL) as compressed:
+        shutil.copyfileobj(source, compressed, BLOCK_SIZE)
+    os.rename(partial, target)
+    os.remove(path)
+    return target
+
+
+def _pigz_file(pigz, path, threads):
+    # pigz skips files with other hard links (e.g. restored from the reads cache) when it
+    # compresses in place, so compress to stdout and only unlink the original
+    target = path + '.gz'
+    partial = target + '.partial'
+    with open(partial, 'wb') as compressed:
+        subprocess.check_call([pigz, '-' + str(COMPRESSION_LEVEL), '-p', str(threads), '-c',
+                               path], stdout=compressed)
+    os.rename(partial, target)
+    os.remove(path)
+    return target
+
+
+def compress_files(paths, threads=1):
+    '''
+    Replaces each file in paths by a gzipped copy with the .gz extension, with pigz using
+    threads threads per file if it is installed, or compressing threads files at a time.
+    Files that are already gzipped are left alone.
+    Returns a dict of the original paths to the compressed paths.
+    '''
+    paths = [p for p in paths if not p.endswith('.gz')]
+    threads = max(1, threads)
+    pigz = shutil.which('pigz')
+    if pigz:
+        return {p: _pigz_file(pigz, p, threads) for p in paths}
+    if not paths:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(threads, len(paths))) as executor:
+        return dict(zip(paths, executor.map(_gzip_file, paths)))
@@ -0,0 +1,55 @@
+'''
+Subsampling of reads files, to lower the coverage of an assembly that does not fit in memory.
+
+The sampling is deterministic: of every run of records the same evenly spread ones are kept,
+so that the forward and reverse files of a paired library keep the same pairs, and repeating
+an assembly gives the same result.
+'''
+import gzip
+
+# the number of records of a sampling unit, so that interleaved pairs stay together
+PAIRED_UNIT = 2
+
+
+def _open(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', compresslevel=1)
+    return open(path, mode)
+
+
+def read_records(lines, fasta):
+    '''
+    Yields the records of a FASTQ (four lines per record) or FASTA (a header line and any
+    number of sequence lines) file as lists of lines.
+    '''
+    record = []
+    for line in lines:
+        if record and (fasta and line.startswith('>') or not fasta and len(record) == 4):
+            yield record
+            record = []
+        record.append(line)
+    if record:
+        yield record
+
+
+def keep_unit(index, fraction):
+    ''' Tells whether the unit at index is kept when keeping fraction of all units. '''
+    return int((index + 1) * fraction) > int(index * fraction)
+
+
+def subsample_file(source, target, fraction, fasta=False, unit=1):
+    '''
+    Writes fraction of the records of the reads file source to target, gzipped if target
+    ends with .gz, taking records in units of unit records.
+    Returns the number of records and of bases written.
+    '''
+    records = 0
+    bases = 0
+    with _open(source, 'r') as reads, _open(target, 'w') as sample:
+        for index, record in enumerate(read_records(reads, fasta)):
+            if keep_unit(index // unit, fraction):
+                sample.writelines(record)
+                records += 1
+                sequence = record[1:] if fasta else record[1:2]
+                bases += sum(len(line.strip()) for line in sequence)
+    return records, bases
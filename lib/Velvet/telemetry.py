@@ -0,0 +1,57 @@
+'''
+Resource telemetry for the Velvet binaries.
+
+Reads the CPU time and I/O counters of running processes and the out of memory kills of the
+container; the stage executor combines them with the rusage of the reaped process into the
+metrics of each stage.
+'''
+import os
+
+
+def read_proc_io(pid):
+    ''' Returns the read_bytes and write_bytes counters of /proc/<pid>/io, or None. '''
+    counters = {}
+    try:
+        with open('/proc/{}/io'.format(pid)) as io_file:
+            for line in io_file:
+                name, _, value = line.partition(':')
+                counters[name.strip()] = int(value)
+    except (IOError, OSError, ValueError):
+        return None
+    return {'read_bytes': counters.get('read_bytes', 0),
+            'write_bytes': counters.get('write_bytes', 0)}
+
+
+def read_proc_cpu_time(pid):
+    ''' Returns the user plus system CPU clock ticks of /proc/<pid>/stat, or None. '''
+    try:
+        with open('/proc/{}/stat'.format(pid)) as stat_file:
+            # the fields after the parenthesised command name, starting with the state
+            fields = stat_file.read().rsplit(')', 1)[1].split()
+        return int(fields[11]) + int(fields[12])
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+
+
+def read_oom_kills():
+    '''
+    Returns the number of processes the out of memory killer has killed in this container,
+    from the cgroup (v2 or v1) memory events, or None if the kernel does not report it.
+    '''
+    for path in ['/sys/fs/cgroup/memory.events', '/sys/fs/cgroup/memory/memory.oom_control']:
+        try:
+            with open(path) as events:
+                for line in events:
+                    name, _, value = line.partition(' ')
+                    if name == 'oom_kill':
+                        return int(value)
+        except (IOError, OSError, ValueError):
+            continue
+    return None
+
+
+def exit_code(status):
+    ''' Converts a wait status to a Popen style return code. '''
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
@@ -0,0 +1,66 @@
+'''
+Selection among Velvet builds compiled with different limits.
+
+Velvet fixes the largest hash length (MAXKMERLENGTH) and the number of short read categories
+(CATEGORIES) at compile time, and sizes its k-mer and node structures for them: every k-mer
+takes one 64 bit word per 32 nucleotides of MAXKMERLENGTH, and every node holds coverage
+counters for all categories. A build with limits just large enough for the job therefore
+needs considerably less memory than one compiled for the largest jobs.
+'''
+import os
+import re
+import subprocess
+
+
+def probe_build(velveth):
+    '''
+    Returns the compilation settings of a velveth binary as a dict with categories and
+    max_kmer_length, as printed by velveth when it is run without arguments, leaving out the
+    settings velveth does not print. Raises an OSError if velveth can't be run.
+    '''
+    p = subprocess.Popen([velveth], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                         universal_newlines=True)
+    usage, _ = p.communicate()
+    build = {}
+    categories = re.search(r'CATEGORIES\s*=\s*(\d+)', usage)
+    max_kmer_length = re.search(r'MAXKMERLENGTH\s*=\s*(\d+)', usage)
+    if categories:
+        build['categories'] = int(categories.group(1))
+    if max_kmer_length:
+        build['max_kmer_length'] = int(max_kmer_length.group(1))
+    return build
+
+
+def find_builds(root):
+    '''
+    Returns the Velvet builds installed in the subfolders of root, each holding a velveth
+    and a velvetg binary, as dicts with the name of the subfolder and the velveth and velvetg
+    paths. Returns an empty list if root does not exist.
+    '''
+    builds = []
+    if not root or not os.path.isdir(root):
+        return builds
+    for name in sorted(os.listdir(root)):
+        velveth = os.path.join(root, name, 'velveth')
+        velvetg = os.path.join(root, name, 'velvetg')
+        if os.access(velveth, os.X_OK) and os.access(velvetg, os.X_OK):
+            builds.append({'name': name, 'velveth': velveth, 'velvetg': velvetg})
+    return builds
+
+
+def build_cost(build):
+    ''' Orders builds by the memory their k-mers and nodes take. '''
+    return ((build['max_kmer_length'] + 31) // 32, build['categories'],
+            build['max_kmer_length'])
+
+
+def select_build(builds, hash_length, categories=1):
+    '''
+    Returns the cheapest of the probed builds that supports hash_length and the given number
+    of short read categories, or None if none does.
+    '''
+    fitting = [b for b in builds
+               if b['max_kmer_length'] >= hash_length and b['categories'] >= categories]
+    if not fitting:
+        return None
+    return min(fitting, key=build_cost)
@@ -0,0 +1,64 @@
+'''
+Per job work directories, so that several assemblies can share one container and scratch.
+
+Every job gets its own directory under a common root, named after the job id. The directory
+is locked (with flock on a lock file inside it) while the job runs, so that pruning old
+directories never removes the directory of a running job.
+'''
+import fcntl
+import os
+import re
+import shutil
+import time
+import uuid
+
+LOCK_FILE = '.lock'
+
+_UNSAFE_CHARS = re.compile('[^\\w.-]')
+
+
+class JobWorkDir(object):
+    ''' A work directory of one job, locked until it is released. '''
+
+    def __init__(self, root, job_id=None):
+        name = _UNSAFE_CHARS.sub('_', str(job_id or 'job'))[:64]
+        self.path = os.path.join(root, name + '_' + uuid.uuid4().hex[:8])
+        os.makedirs(self.path)
+        self._lock = open(os.path.join(self.path, LOCK_FILE), 'w')
+        fcntl.flock(self._lock, fcntl.LOCK_EX)
+
+    def release(self, keep=False):
+        ''' Unlocks the directory, after removing it unless keep is set. '''
+        if self._lock is None:
+            return
+        if not keep:
+            shutil.rmtree(self.path, ignore_errors=True)
+        self._lock.close()
+        self._lock = None
+
+
+def prune_work_dirs(root, max_age):
+    '''
+    Removes the work directories under root that were last modified more than max_age
+    seconds ago and that no running job holds. Returns the removed paths.
+    '''
+    removed = []
+    if not os.path.isdir(root):
+        return removed
+    now = time.time()
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        try:
+            if not os.path.isdir(path) or now - os.path.getmtime(path) <= max_age:
+                continue
+            with open(os.path.join(path, LOCK_FILE), 'a') as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except (IOError, OSError):
+                    # a running job holds it
+                    continue
+                shutil.rmtree(path, ignore_errors=True)
+                removed.append(path)
+        except (IOError, OSError):
+            continue
+    return removed
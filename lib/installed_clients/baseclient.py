@@ -11,7 +11,9 @@ import json as _json
 import requests as _requests
 import random as _random
 import os as _os
+import threading as _threading
 import traceback as _traceback
+from requests.adapters import HTTPAdapter as _HTTPAdapter
 from requests.exceptions import ConnectionError
 from urllib3.exceptions import ProtocolError
 
@@ -24,6 +26,21 @@ try:
     from urllib.parse import urlparse as _urlparse  # py3
 except ImportError:
     from urlparse import urlparse as _urlparse  # py2
+
+try:
+    import orjson as _orjson
+except ImportError:
+    _orjson = None
+
+try:
+    import ujson as _ujson
+except ImportError:
+    _ujson = None
+
+try:
+    from http.cookiejar import DefaultCookiePolicy as _DefaultCookiePolicy  # py3
+except ImportError:
+    from cookielib import DefaultCookiePolicy as _DefaultCookiePolicy  # py2
 import time
 
 _CT = 'content-type'
@@ -31,6 +48,53 @@ _AJ = 'application/json'
 _URL_SCHEME = frozenset(['http', 'https'])
 _CHECK_JOB_RETRYS = 3
 
+# the keep-alive connection pools shared by all clients of a process: the number of hosts
+# with a pool, the connections kept open per host, and whether requests wait for a free
+# connection instead of opening more than that
+_POOL_CONFIG = {
+    'pool_connections': int(_os.environ.get('KB_HTTP_POOL_CONNECTIONS') or 10),
+    'pool_maxsize': int(_os.environ.get('KB_HTTP_POOL_MAXSIZE') or 10),
+    'pool_block': _os.environ.get('KB_HTTP_POOL_BLOCK', '').lower() == 'true'}
+_session = None
+_session_pid = None
+_session_lock = _threading.Lock()
+
+
+def set_session_pool(pool_connections=None, pool_maxsize=None, pool_block=None):
+    '''
+    Sets the number of hosts with a connection pool, the connections kept open per host and
+    whether requests block when all connections to a host are in use, for the sessions
+    created from now on. The connections of the current session are closed.
+    '''
+    global _session
+    with _session_lock:
+        for key, value in [('pool_connections', pool_connections),
+                           ('pool_maxsize', pool_maxsize), ('pool_block', pool_block)]:
+            if value is not None:
+                _POOL_CONFIG[key] = value
+        if _session is not None:
+            _session.close()
+        _session = None
+
+
+def get_session():
+    '''
+    Returns the requests session shared by the clients of this process, which keeps its
+    connections alive between calls. A forked process gets a session of its own, and the
+    session keeps no cookies, as its clients may act for different users.
+    '''
+    global _session, _session_pid
+    with _session_lock:
+        if _session is None or _session_pid != _os.getpid():
+            session = _requests.Session()
+            adapter = _HTTPAdapter(**_POOL_CONFIG)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.cookies.set_policy(_DefaultCookiePolicy(allowed_domains=[]))
+            _session = session
+            _session_pid = _os.getpid()
+        return _session
+
 
 def _get_token(user_id, password, auth_svc):
     # This is bandaid helper function until we get a full
@@ -40,7 +104,7 @@ def _get_token(user_id, password, auth_svc):
     # unicode, so if this changes this client will need to change.
     body = ('user_id=' + _requests.utils.quote(user_id) + '&password=' +
             _requests.utils.quote(password) + '&fields=token')
-    ret = _requests.post(auth_svc, data=body, allow_redirects=True)
+    ret = get_session().post(auth_svc, data=body, allow_redirects=True)
     status = ret.status_code
     if status >= 200 and status <= 299:
         tok = _json.loads(ret.text)
@@ -87,14 +151,60 @@ class ServerError(Exception):
             '\n' + self.data
 
 
+# the JSON implementation of json_dumps and json_loads: orjson or ujson when installed, else
+# the json module; the KB_JSON_CODEC environment variable picks one
+JSON_CODEC = _os.environ.get('KB_JSON_CODEC') or (
+    'orjson' if _orjson else 'ujson' if _ujson else 'json')
+
+
+def _to_jsonable(obj):
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if hasattr(obj, 'toJSONable'):
+        return obj.toJSONable()
+    raise TypeError('Object of type {} is not JSON serializable'.format(
+        type(obj).__name__))
+
+
 class _JSONObjectEncoder(_json.JSONEncoder):
 
     def default(self, obj):
-        if isinstance(obj, set):
-            return list(obj)
-        if isinstance(obj, frozenset):
-            return list(obj)
-        return _json.JSONEncoder.default(self, obj)
+        return _to_jsonable(obj)
+
+
+def json_dumps(obj):
+    '''
+    Serializes obj to UTF-8 encoded JSON bytes with JSON_CODEC, ready to be sent as an HTTP
+    body, with sets and frozensets as lists and objects with a toJSONable method as its
+    result. Values the fast codecs can't represent (e.g. integers beyond 64 bits) are left to
+    the json module. NaN and infinities are not valid JSON: orjson writes them as null, the
+    other codecs as NaN, Infinity and -Infinity.
+    '''
+    try:
+        if JSON_CODEC == 'orjson':
+            return _orjson.dumps(obj, default=_to_jsonable, option=_orjson.OPT_NON_STR_KEYS)
+        if JSON_CODEC == 'ujson':
+            return _ujson.dumps(obj, default=_to_jsonable,
+                                escape_forward_slashes=False).encode('utf-8')
+    except (TypeError, ValueError, OverflowError):
+        pass
+    return _json.dumps(obj, cls=_JSONObjectEncoder).encode('utf-8')
+
+
+def json_loads(data):
+    '''
+    Deserializes a JSON str or bytes with JSON_CODEC. Documents the fast codecs reject (e.g.
+    with NaN or integers beyond 64 bits) are left to the json module, which raises a
+    ValueError for invalid JSON.
+    '''
+    try:
+        if JSON_CODEC == 'orjson':
+            return _orjson.loads(data)
+        if JSON_CODEC == 'ujson':
+            return _ujson.loads(data)
+    except (ValueError, OverflowError):
+        pass
+    return _json.loads(data)
 
 
 class BaseClient(object):
@@ -175,14 +285,14 @@ class BaseClient(object):
                 raise ValueError('context is not type dict as required.')
             arg_hash['context'] = context
 
-        body = _json.dumps(arg_hash, cls=_JSONObjectEncoder)
-        ret = _requests.post(url, data=body, headers=self._headers,
-                             timeout=self.timeout,
-                             verify=not self.trust_all_ssl_certificates)
+        body = json_dumps(arg_hash)
+        ret = get_session().post(url, data=body, headers=self._headers,
+                                 timeout=self.timeout,
+                                 verify=not self.trust_all_ssl_certificates)
         ret.encoding = 'utf-8'
         if ret.status_code == 500:
             if ret.headers.get(_CT) == _AJ:
-                err = ret.json()
+                err = json_loads(ret.content)
                 if 'error' in err:
                     raise ServerError(**err['error'])
                 else:
@@ -191,7 +301,7 @@ class BaseClient(object):
                 raise ServerError('Unknown', 0, ret.text)
         if not ret.ok:
             ret.raise_for_status()
-        resp = ret.json()
+        resp = json_loads(ret.content)
         if 'result' not in resp:
             raise ServerError('Unknown', 0, 'An unknown server error occurred')
         if not resp['result']:
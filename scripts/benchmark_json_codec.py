@@ -0,0 +1,61 @@
+import os.path
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+import installed_clients.baseclient as baseclient  # noqa: E402
+
+CODECS = ['json', 'orjson', 'ujson']
+
+
+def download_reads_response(libraries):
+    ''' Returns a JSON-RPC response shaped like a download_reads result. '''
+    files = {}
+    for i in range(libraries):
+        ref = '{}/{}/1'.format(random.randint(1, 99999), i)
+        files[ref] = {
+            'files': {'fwd': '/kb/module/work/tmp/{}.fwd.fq'.format(i),
+                      'rev': '/kb/module/work/tmp/{}.rev.fq'.format(i),
+                      'type': 'paired', 'otype': 'paired', 'fwd_name': 'reads.fwd.fq',
+                      'rev_name': 'reads.rev.fq', 'otype_name': None},
+            'ref': ref, 'single_genome': 'true', 'read_orientation_outward': 'false',
+            'insert_size_mean': 300.0, 'insert_size_std_dev': 50.5,
+            'sequencing_tech': 'Illumina', 'read_count': random.randint(1, 10 ** 9),
+            'read_size': None, 'gc_content': random.random(),
+            'total_bases': random.randint(1, 10 ** 11), 'read_length_mean': 150.0,
+            'read_length_stdev': 0.0, 'phred_type': '33', 'number_of_duplicates': 0,
+            'qual_min': 2.0, 'qual_max': 41.0, 'qual_mean': 35.2, 'qual_stdev': 4.1,
+            'base_percentages': {b: random.random() * 100 for b in 'ACGTN'},
+            'strain': {'genus': 'Escherichia', 'species': 'coli', 'strain': 'K-12',
+                       'lineage': ['Bacteria', 'Proteobacteria', 'Gammaproteobacteria']},
+            'source': {'source': 'sequencer', 'source_id': 'run{}'.format(i)},
+            'tags': set(['tag{}'.format(t) for t in range(5)])}
+    return {'version': '1.1', 'id': '1', 'result': [{'files': files}]}
+
+
+def bench(codec, document, number):
+    ''' Returns the seconds per json_dumps and per json_loads call of document with codec. '''
+    baseclient.JSON_CODEC = codec
+    text = baseclient.json_dumps(document)
+    dumps = timeit.timeit(lambda: baseclient.json_dumps(document), number=number) / number
+    loads = timeit.timeit(lambda: baseclient.json_loads(text), number=number) / number
+    return dumps, loads, len(text)
+
+
+if __name__ == "__main__":
+    libraries = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    number = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    random.seed(1)
+    document = download_reads_response(libraries)
+    available = [c for c in CODECS
+                 if c == 'json' or getattr(baseclient, '_' + c) is not None]
+    print('{} libraries, {} runs, codecs available: {}'.format(
+        libraries, number, ', '.join(available)))
+    baseline = None
+    for codec in available:
+        dumps, loads, size = bench(codec, document, number)
+        baseline = baseline or (dumps, loads)
+        print('{:7} dumps {:8.2f} ms ({:4.1f}x)  loads {:8.2f} ms ({:4.1f}x)  {} bytes'.format(
+            codec, dumps * 1000, baseline[0] / dumps, loads * 1000, baseline[1] / loads, size))
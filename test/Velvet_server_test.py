@@ -1,20 +1,40 @@
 # -*- coding: utf-8 -*-
+import gzip
+import io
+import json
 import os  # noqa: F401
 import os.path
 import shutil
+import threading
 import time
 import unittest
 from configparser import ConfigParser
 from os import environ
 from pprint import pformat
 from pprint import pprint  # noqa: F401
+from unittest import mock
+
+import numpy as np
+import requests
 
 from Velvet.VelvetImpl import Velvet
 from Velvet.VelvetServer import MethodContext
 from Velvet.authclient import KBaseAuth as _KBaseAuth
+from Velvet.assembly_metrics import assembly_metrics
+from Velvet.contig_filter import filter_contigs
+from Velvet.coverage import BIN_WIDTH, coverage_peak
+from Velvet.diskcache import DiskCache
+from Velvet.executor import cancel, is_cancelled, reset_cancel, run_process
+from Velvet.fasta_stats import scan_fasta
+from Velvet.html_report import nx_curve, render_report
+from Velvet.resource_planner import estimate_assembly_resources
+from Velvet.subsample import subsample_file
+from Velvet.velvet_builds import select_build
+from Velvet.workdirs import JobWorkDir, prune_work_dirs
 from installed_clients.ReadsUtilsClient import ReadsUtils
 from installed_clients.WorkspaceClient import Workspace as workspaceService
-from installed_clients.baseclient import ServerError
+from installed_clients.baseclient import (_POOL_CONFIG, JSON_CODEC, ServerError, get_session,
+                                         json_dumps, json_loads, set_session_pool)
 
 
 class VelvetTest(unittest.TestCase):
@@ -229,6 +249,510 @@ class VelvetTest(unittest.TestCase):
         pprint('Returned value by Velveth is: ' + str(result))
         return result
 
+    def test_get_hash_lengths(self):
+        impl = self.getImpl()
+        self.assertEqual(impl.get_hash_lengths({'hash_length': 21}), [21])
+        self.assertEqual(impl.get_hash_lengths({'hash_length': 21,
+                                                'hash_lengths': [31, 22, 21, 31]}),
+                         [21, 31])
+        self.assertEqual(impl.get_hash_lengths({'hash_length_range': {'min_hash_length': 21,
+                                                                      'max_hash_length': 31}}),
+                         [21, 23, 25, 27, 29])
+        self.assertEqual(impl.get_hash_lengths({'hash_length_range': {'min_hash_length': 21,
+                                                                      'max_hash_length': 41,
+                                                                      'step': 10}}),
+                         [21, 31])
+
+    def test_json_codec(self):
+        class JSONable(object):
+            def toJSONable(self):
+                return {'x': 1}
+        text = json_dumps({'set': {1}, 'frozenset': frozenset(['a']), 'obj': JSONable(),
+                           'big': 2 ** 70, 'text': u'\u00e9'})
+        self.assertEqual(json_loads(text), {'set': [1], 'frozenset': ['a'], 'obj': {'x': 1},
+                                            'big': 2 ** 70, 'text': u'\u00e9'})
+        nan = json_loads(b'[NaN]')[0]
+        self.assertNotEqual(nan, nan)
+        text = json_dumps({'x': [float('inf'), -float('inf'), None]})
+        self.assertIsInstance(text, bytes)
+        # orjson writes non-finite floats as null, the other codecs as Infinity and -Infinity
+        self.assertEqual(json_loads(text)['x'], [None, None, None] if JSON_CODEC == 'orjson'
+                         else [float('inf'), -float('inf'), None])
+        with self.assertRaises(ValueError):
+            json_loads('{')
+
+    def test_session_pool(self):
+        self.addCleanup(set_session_pool, **dict(_POOL_CONFIG))
+        previous = get_session()
+        with mock.patch.object(previous, 'close') as close:
+            set_session_pool(3, 7, True)
+        # the connections of the replaced session are not left open
+        close.assert_called_once_with()
+        self.assertIsNot(get_session(), previous)
+        sessions = []
+
+        def post(session, url, **kwargs):
+            sessions.append(session)
+            response = requests.Response()
+            response.status_code = 200
+            response._content = b'{"version": "1.1", "result": ["0.8.0"]}'
+            return response
+        with mock.patch.object(requests.Session, 'post', autospec=True, side_effect=post):
+            for url, token in [('http://ws1.example.org', 'a'), ('http://ws2.example.org', 'b')]:
+                self.assertEqual(workspaceService(url, token=token).ver(), '0.8.0')
+        self.assertEqual(len(sessions), 2)
+        self.assertIs(sessions[0], sessions[1])
+        self.assertIs(sessions[0], get_session())
+        adapter = get_session().get_adapter('https://ws.example.org')
+        self.assertEqual((adapter._pool_connections, adapter._pool_maxsize, adapter._pool_block),
+                         (3, 7, True))
+
+    def test_get_available_cpus(self):
+        impl = self.getImpl()
+
+        def cgroup(files):
+            def fake_open(path, *args, **kwargs):
+                if path not in files:
+                    raise IOError(path)
+                return io.StringIO(files[path])
+            return mock.patch('Velvet.VelvetImpl.open', fake_open, create=True)
+        v1 = '/sys/fs/cgroup/cpu/cpu.cfs_'
+        cpuacct = '/sys/fs/cgroup/cpu,cpuacct/cpu.cfs_'
+        with mock.patch.object(os, 'sched_getaffinity', return_value=set(range(8))):
+            for files, cpus in [({}, 8),
+                                ({'/sys/fs/cgroup/cpu.max': '250000 100000\n'}, 3),
+                                ({'/sys/fs/cgroup/cpu.max': '50000 100000\n'}, 1),
+                                ({'/sys/fs/cgroup/cpu.max': 'max 100000\n'}, 8),
+                                ({v1 + 'quota_us': '150000\n', v1 + 'period_us': '100000\n'}, 2),
+                                ({cpuacct + 'quota_us': '-1\n', cpuacct + 'period_us': '100000\n'},
+                                 8)]:
+                with cgroup(files):
+                    self.assertEqual(impl.get_available_cpus(), cpus, files)
+
+    def test_get_threads_per_job(self):
+        impl = self.getImpl()
+        with mock.patch.object(impl, 'get_available_cpus', return_value=16), \
+                mock.patch.dict(impl.cfg, {'max-threads-per-job': ''}):
+            self.assertEqual(impl.get_threads_per_job({}), 16)
+            self.assertEqual(impl.get_threads_per_job({}, 3), 5)
+            self.assertEqual(impl.get_threads_per_job({'num_threads': 4}, 8), 1)
+            self.assertEqual(impl.get_threads_per_job({'max_threads_per_job': 4}, 2), 4)
+            with mock.patch.dict(impl.cfg, {'max-threads-per-job': '6'}):
+                self.assertEqual(impl.get_threads_per_job({}), 6)
+                self.assertEqual(impl.get_threads_per_job({'max_threads_per_job': 10}), 10)
+
+    def test_get_reads_format(self):
+        impl = self.getImpl()
+        self.assertEqual(impl.get_reads_format('reads.fq'), 'fastq')
+        self.assertEqual(impl.get_reads_format('reads.fastq.gz'), 'fastq.gz')
+        self.assertEqual(impl.get_reads_format('reads.FNA.gz'), 'fasta.gz')
+        self.assertEqual(impl.get_reads_format('reads.bam'), 'bam')
+
+    def test_run_fingerprint(self):
+        impl = self.getImpl()
+        params = {'workspace_name': 'ws', 'read_libraries': ['ws/reads'], 'hash_length': 21,
+                  'output_contigset_name': 'contigs', 'cov_cutoff': 2}
+        # the Velvet binaries are only installed in the image
+        patcher = mock.patch.object(impl, 'get_velvet_build_id', return_value='build')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        fingerprint = impl.run_fingerprint(params, ['1/2/3'])
+        self.assertIsNotNone(fingerprint)
+        self.assertEqual(impl.run_fingerprint(dict(params, cov_cutoff=2.0, exp_cov=None),
+                                              ['1/2/3']), fingerprint)
+        self.assertNotEqual(impl.run_fingerprint(params, ['1/2/4']), fingerprint)
+        ladder = impl.oom_retry_ladder
+        impl.oom_retry_ladder = ['serial']
+        try:
+            self.assertNotEqual(impl.run_fingerprint(params, ['1/2/3']), fingerprint)
+        finally:
+            impl.oom_retry_ladder = ladder
+
+    def test_get_velvetg_grid(self):
+        impl = self.getImpl()
+        self.assertEqual(impl.get_velvetg_grid({'cov_cutoff': 5.0}), [{}])
+        self.assertEqual(impl.get_velvetg_grid({'velvetg_grid': {'cov_cutoff': [2, 5],
+                                                                 'ins_length': [300]}}),
+                         [{'cov_cutoff': 2.0, 'ins_length': 300},
+                          {'cov_cutoff': 5.0, 'ins_length': 300}])
+        # min_contig_length is applied to the selected assembly, it is not swept
+        self.assertEqual(impl.get_velvetg_grid({'velvetg_grid': {'min_contig_length': [200]}}),
+                         [{}])
+        with self.assertRaises(ValueError):
+            impl.process_params({'workspace_name': 'ws', 'read_libraries': ['1/2/3'],
+                                 'hash_length': 21, 'output_contigset_name': 'out',
+                                 'velvetg_grid': {'min_contig_length': [200]}})
+
+    def test_estimate_assembly_resources(self):
+        small = estimate_assembly_resources(1000000, 150000000, 31, 2, 31)
+        wide = estimate_assembly_resources(1000000, 150000000, 31, 57, 127)
+        long_k = estimate_assembly_resources(1000000, 150000000, 99, 2, 31)
+        self.assertLess(small['memory'], wide['memory'])
+        self.assertLess(long_k['memory'], small['memory'])
+        self.assertGreater(small['files']['Sequences'], 150000000)
+        self.assertEqual(estimate_assembly_resources(0, 0, 31, 2, 31)['memory'], 0)
+        binary = estimate_assembly_resources(1000000, 150000000, 31, 2, 31, binary=True)
+        self.assertLess(binary['disk'], small['disk'])
+        self.assertNotIn('Sequences', binary['files'])
+
+    def test_plan_resources_default_config(self):
+        # the caches of the deployment config in scratch don't reject a small job
+        impl = self.getImpl()
+        reads_data = [{'fwd_file': 'reads.fq', 'read_count': 100000, 'total_bases': 15000000}]
+        plan = impl.plan_resources({'hash_length': 31}, reads_data, [31], 1)
+        self.assertEqual(plan['parallel_jobs'], 1)
+        if 'free_disk' in plan:
+            self.assertGreater(plan['free_disk'], plan['disk'])
+
+    def test_coverage_peak(self):
+        # many short error nodes at coverage 1, long unique nodes around 25 and a repeat at 50
+        lengths = [30] * 1000 + [2000, 5000, 3000, 4000, 1000] + [500]
+        coverages = [1.2] * 1000 + [24.1, 25.3, 25.8, 26.4, 23.9] + [50.5]
+        self.assertEqual(coverage_peak(lengths, coverages), 25.5)
+        self.assertIsNone(coverage_peak([100], [0.0]))
+        # error nodes above coverage 1 leave the first bins empty
+        for errors in [[2.0] * 1000, [1.0 + i % 3 for i in range(1000)]]:
+            self.assertEqual(coverage_peak(lengths, errors + coverages[1000:]), 25.5)
+        # without an error peak the only peak is the genomic one
+        self.assertEqual(coverage_peak(lengths[1000:], coverages[1000:]), 25.5)
+        # at low coverage the error nodes outweigh the genomic ones next to them
+        random = np.random.RandomState(0)
+        for genome_coverage in [6, 8, 10, 12]:
+            lengths = np.concatenate([random.randint(2000, 10000, 500), [30] * 20000])
+            coverages = np.concatenate([random.normal(genome_coverage, 0.3, 500),
+                                        random.uniform(1, 5, 20000)])
+            self.assertAlmostEqual(coverage_peak(lengths, coverages), genome_coverage,
+                                   delta=BIN_WIDTH)
+        # with only short nodes the estimate still skips the error peak
+        self.assertEqual(coverage_peak([30] * 1000 + [400, 1000, 600, 800, 200],
+                                       [1.2] * 1000 + [24.1, 25.3, 25.8, 26.4, 23.9]), 25.5)
+
+    def test_run_process_limits(self):
+        result = run_process(['sleep', '30'], timeout=1)
+        self.assertEqual(result['status'], 'timeout')
+        self.assertLess(result['wall_time'], 10)
+        result = run_process(['sleep', '30'], stall_timeout=1, watch=[self.scratch])
+        self.assertEqual(result['status'], 'stalled')
+        self.assertEqual(run_process(['false'])['status'], 'failed')
+
+    def test_reset_cancel(self):
+        self.addCleanup(reset_cancel)
+        cancel()
+        self.assertTrue(is_cancelled())
+        self.assertEqual(run_process(['true'])['status'], 'cancelled')
+        # the next job starts without the cancellation of the previous one
+        reset_cancel()
+        self.assertFalse(is_cancelled())
+        self.assertEqual(run_process(['true'])['status'], 'ok')
+
+    def test_scan_fasta(self):
+        path = os.path.join(self.scratch, 'test_scan_fasta.fa')
+        with open(path, 'w') as f:
+            f.write('>NODE_1 x\nACGTN\r\nacg\n>NODE_2\n>NODE_3\nGGGG\nNN')
+        for chunk_size in [1 << 20, 4]:
+            stats = scan_fasta(path, workers=2, chunk_size=chunk_size)
+            self.assertEqual(stats['lengths'].tolist(), [8, 0, 6])
+            self.assertEqual(stats['gc'].tolist(), [4, 0, 4])
+            self.assertEqual(stats['n'].tolist(), [1, 0, 2])
+        # a gap wrapped across a blank line is one run, and the last header has no newline
+        with open(path, 'w') as f:
+            f.write('>gapN\nNNACN\n\r\nNNGT\nNN\n>empty')
+        for chunk_size in [1 << 20, 4]:
+            stats = scan_fasta(path, workers=2, chunk_size=chunk_size)
+            self.assertEqual(stats['lengths'].tolist(), [11, 0])
+            self.assertEqual(stats['n_runs'].tolist(), [3, 0])
+        with open(path, 'w') as f:
+            f.write('>a')
+        self.assertEqual(scan_fasta(path)['lengths'].tolist(), [0])
+
+    def test_assembly_metrics(self):
+        stats = {'lengths': [100, 400, 300, 200], 'gc': [50, 200, 150, 100],
+                 'n': [0, 10, 0, 0], 'n_runs': [0, 2, 0, 0]}
+        metrics = assembly_metrics(stats, expected_genome_size=2000)
+        self.assertEqual(metrics['total_length'], 1000)
+        self.assertEqual(metrics['largest_contig'], 400)
+        self.assertEqual((metrics['n50'], metrics['l50']), (300, 2))
+        self.assertEqual((metrics['n90'], metrics['l90']), (200, 3))
+        self.assertEqual((metrics['ng50'], metrics['lg50']), (100, 4))
+        self.assertIsNone(metrics['ng90'])
+        self.assertEqual(metrics['aun'], 300.0)
+        self.assertEqual((metrics['gaps'], metrics['gap_length']), (2, 10))
+        self.assertEqual(sum(metrics['length_histogram']['counts']), 4)
+
+    def test_filter_contigs(self):
+        folder = os.path.join(self.scratch, 'test_filter_contigs')
+        shutil.rmtree(folder, ignore_errors=True)
+        os.makedirs(folder)
+        source = os.path.join(folder, 'contigs.fa')
+        with open(source, 'w') as f:
+            f.write('>NODE_1_length_70_cov_12.5\n' + 'A' * 60 + '\n' + 'C' * 40 + '\n')
+            f.write('>NODE_2_length_170_cov_1.0\n' + 'G' * 200 + '\n')
+            f.write('>NODE_3_length_10_cov_30.0\n' + 'T' * 40 + '\n')
+        target = os.path.join(folder, 'filtered.fa')
+        counts = filter_contigs(source, target, min_length=50, min_coverage=2,
+                                hash_length=31)
+        self.assertEqual(counts, {'kept': 1, 'dropped': 2, 'kept_bases': 100,
+                                  'dropped_bases': 240})
+        with open(target) as f:
+            self.assertEqual(f.readline(), '>NODE_1_length_70_cov_12.5\n')
+
+    def test_render_report(self):
+        lengths = [100, 400, 300, 200]
+        self.assertEqual(list(nx_curve(lengths)[[0, 50, 90, 100]]), [400, 300, 200, 100])
+        stats = {'lengths': lengths, 'gc': [50, 200, 150, 100], 'n': [0, 0, 0, 0],
+                 'n_runs': [0, 0, 0, 0]}
+        page = render_report('test', assembly_metrics(stats), 'details', lengths,
+                             [2.0, 10.0, float('nan'), 5.0])
+        self.assertEqual(page.count('<svg'), 3)
+        self.assertIn('<pre>details</pre>', page)
+
+    def test_subsample_file(self):
+        folder = os.path.join(self.scratch, 'test_subsample_file')
+        shutil.rmtree(folder, ignore_errors=True)
+        os.makedirs(folder)
+        source = os.path.join(folder, 'reads.fq')
+        with open(source, 'w') as f:
+            for i in range(10):
+                f.write('@r{}\nACGT\n+\nIIII\n'.format(i))
+        target = os.path.join(folder, 'sample.fq')
+        self.assertEqual(subsample_file(source, target, 0.5, unit=2), (4, 16))
+        with open(target) as f:
+            self.assertEqual([line for line in f if line.startswith('@')],
+                             ['@r2\n', '@r3\n', '@r6\n', '@r7\n'])
+
+    def test_select_build(self):
+        builds = [{'name': n, 'max_kmer_length': k, 'categories': c}
+                  for n, k, c in [('k127_c57', 127, 57), ('k31_c2', 31, 2), ('k63_c2', 63, 2),
+                                  ('k31_c57', 31, 57)]]
+        self.assertEqual(select_build(builds, 31)['name'], 'k31_c2')
+        self.assertEqual(select_build(builds, 33)['name'], 'k63_c2')
+        self.assertEqual(select_build(builds, 31, 3)['name'], 'k31_c57')
+        self.assertEqual(select_build(builds, 65, 3)['name'], 'k127_c57')
+        self.assertIsNone(select_build(builds, 129))
+
+    def test_prune_work_dirs(self):
+        root = os.path.join(self.scratch, 'test_prune_work_dirs')
+        shutil.rmtree(root, ignore_errors=True)
+        running = JobWorkDir(root, 'running/job')
+        finished = JobWorkDir(root, 'finished')
+        finished.release(keep=True)
+        for path in [running.path, finished.path]:
+            os.utime(path, (0, 0))
+        self.assertEqual(prune_work_dirs(root, 3600), [finished.path])
+        self.assertTrue(os.path.isdir(running.path))
+        running.release()
+        self.assertFalse(os.path.exists(running.path))
+
+    def test_download_library_compressed(self):
+        impl = self.getImpl()
+        folder = os.path.join(self.scratch, 'test_download_library_compressed')
+        shutil.rmtree(folder, ignore_errors=True)
+        os.makedirs(folder)
+        self.addCleanup(setattr, impl, 'reads_cache', impl.reads_cache)
+        impl.reads_cache = DiskCache(os.path.join(folder, 'cache'), 1 << 20, verify=True)
+
+        def download_reads(params):
+            reads = os.path.join(folder, 'download.fq')
+            with open(reads, 'w') as f:
+                f.write('@r1\nACGT\n+\nIIII\n')
+            return {'files': {'1/2/3': {'files': {'type': 'single', 'fwd': reads}}}}
+        readcli = mock.Mock()
+        readcli.download_reads.side_effect = download_reads
+        for _ in range(2):
+            files = impl.download_library(readcli, '1/2/3', '1/2/3', folder, 1)['files']
+            # the cache holds the gzipped download, which hits link as they are
+            self.assertTrue(files['fwd'].endswith('.fq.gz'))
+            with gzip.open(files['fwd'], 'rb') as f:
+                self.assertEqual(f.read(), b'@r1\nACGT\n+\nIIII\n')
+        self.assertEqual(readcli.download_reads.call_count, 1)
+        self.assertFalse(os.path.exists(os.path.join(folder, 'download.fq')))
+        self.assertFalse(os.path.exists(os.path.join(folder, 'download.fq.gz')))
+
+    def test_quast_cache(self):
+        impl = self.getImpl()
+        folder = os.path.join(self.scratch, 'test_quast_cache')
+        shutil.rmtree(folder, ignore_errors=True)
+        os.makedirs(folder)
+        self.addCleanup(setattr, impl, 'quast_cache', impl.quast_cache)
+        impl.quast_cache = DiskCache(os.path.join(folder, 'cache'), 1 << 20)
+        contigs = os.path.join(folder, 'contigs.fa')
+        with open(contigs, 'w') as f:
+            f.write('>NODE_1_length_8_cov_10.0\nACGTACGT\n')
+        params = {'workspace_name': 'ws', 'output_contigset_name': 'contigs',
+                  'report_type': 'quast'}
+        shock_ids = iter('node{}'.format(i) for i in range(10))
+        reported = []
+
+        def create_extended_report(report_params):
+            reported.append(report_params['html_links'][0]['shock_id'])
+            if len(reported) == 1:
+                raise ServerError('ServerError', -32500, 'shock node not found')
+            return {'name': 'report', 'ref': '1/2/3'}
+        with mock.patch('Velvet.VelvetImpl.kb_quast') as quast, \
+                mock.patch('Velvet.VelvetImpl.KBaseReport') as report:
+            quast.return_value.run_QUAST.side_effect = \
+                lambda _: {'shock_id': next(shock_ids), 'quast_path': None}
+            report.return_value.create_extended_report.side_effect = create_extended_report
+            self.assertEqual(impl.run_quast(contigs, params, 'alice')['shock_id'], 'node0')
+            cached = impl.run_quast(contigs, params, 'alice')
+            self.assertEqual(cached['shock_id'], 'node0')
+            self.assertIsNotNone(cached['quast_cache_key'])
+            # the report of another user is not readable with the token of this one
+            self.assertEqual(impl.run_quast(contigs, params, 'bob')['shock_id'], 'node1')
+            self.assertEqual(quast.return_value.run_QUAST.call_count, 2)
+            # the cached report of alice is gone: the entry is dropped and QUAST runs again
+            self.assertEqual(impl.generate_report(contigs, params, 'out', 'ws', user='alice'),
+                             ('report', '1/2/3'))
+            self.assertEqual(reported, ['node0', 'node2'])
+            self.assertEqual(impl.run_quast(contigs, params, 'alice')['shock_id'], 'node2')
+            self.assertEqual(quast.return_value.run_QUAST.call_count, 3)
+
+    def test_upload_and_quast_overlap(self):
+        impl = self.getImpl()
+        folder = os.path.join(self.scratch, 'test_upload_and_quast_overlap')
+        shutil.rmtree(folder, ignore_errors=True)
+        os.makedirs(folder)
+        self.addCleanup(setattr, impl, 'quast_cache', impl.quast_cache)
+        impl.quast_cache = None
+        reads = os.path.join(folder, 'reads.fq')
+        with open(reads, 'w') as f:
+            f.write('@r1\nACGT\n+\nIIII\n')
+        contigs = os.path.join(folder, 'contigs.fa')
+        with open(contigs, 'w') as f:
+            f.write('>NODE_1_length_8_cov_10.0\nACGTACGT\n')
+        quast_started = threading.Event()
+        staged = {}
+
+        def save_assembly_from_fasta(params):
+            staged['upload'] = params['file']['path']
+            # QUAST starts while the upload is still running
+            staged['overlap'] = quast_started.wait(30)
+            # the upload moves its file away
+            os.remove(params['file']['path'])
+            return '1/5/1'
+
+        def run_QUAST(params):
+            quast_started.set()
+            staged['quast'] = params['files'][0]['path']
+            with open(staged['quast']) as f:
+                staged['quast_contigs'] = f.read()
+            return {'shock_id': 'node', 'quast_path': None}
+        with mock.patch('Velvet.VelvetImpl.ReadsUtils') as readsutils, \
+                mock.patch('Velvet.VelvetImpl.AssemblyUtil') as assemblyutil, \
+                mock.patch('Velvet.VelvetImpl.kb_quast') as quast, \
+                mock.patch('Velvet.VelvetImpl.KBaseReport') as report, \
+                mock.patch.object(impl, 'exec_velvet_with_retries',
+                                  return_value={'status': 'ok', 'out_folder': folder,
+                                                'hash_length': 21}):
+            readsutils.return_value.download_reads.return_value = {'files': {'1/2/3': {
+                'files': {'type': 'single', 'fwd': reads}, 'sequencing_tech': 'Illumina',
+                'read_count': 1, 'total_bases': 4}}}
+            assemblyutil.return_value.save_assembly_from_fasta.side_effect = \
+                save_assembly_from_fasta
+            quast.return_value.run_QUAST.side_effect = run_QUAST
+            report.return_value.create_extended_report.return_value = {'name': 'report',
+                                                                       'ref': '1/6/1'}
+            output = impl.assemble_reads(
+                {'token': 't', 'call_id': 'test_upload_and_quast_overlap', 'user_id': 'alice'},
+                {'workspace_name': 'ws', 'output_contigset_name': 'contigs',
+                 'report_type': 'quast'}, ['1/2/3'], {'1/2/3': 'reads'}, {'1/2/3': '1/2/3'})
+        self.assertEqual((output['assembly_ref'], output['report_ref']), ('1/5/1', '1/6/1'))
+        self.assertTrue(staged['overlap'])
+        # each consumer got a copy of its own, and the report still has the contigs
+        self.assertNotIn(contigs, [staged['upload'], staged['quast']])
+        self.assertNotEqual(staged['upload'], staged['quast'])
+        self.assertEqual(staged['quast_contigs'], '>NODE_1_length_8_cov_10.0\nACGTACGT\n')
+        self.assertTrue(os.path.isfile(contigs))
+        self.assertEqual(report.return_value.create_extended_report.call_args[0][0][
+            'html_links'][0]['shock_id'], 'node')
+
+    def test_parallel_downloads(self):
+        impl = self.getImpl()
+        self.addCleanup(setattr, impl, 'parallel_downloads', impl.parallel_downloads)
+        self.addCleanup(setattr, impl, 'reads_cache', impl.reads_cache)
+        impl.parallel_downloads = 2
+        impl.reads_cache = None
+        second_done = threading.Event()
+
+        def download_reads(params):
+            ref = params['read_libraries'][0]
+            if ref == '1/1/1':
+                # the first library only finishes after the second one
+                self.assertTrue(second_done.wait(30))
+            else:
+                second_done.set()
+            return {'files': {ref: {'files': {'type': 'single', 'fwd': ref + '.fq'}}}}
+        readcli = mock.Mock()
+        readcli.download_reads.side_effect = download_reads
+        downloaded = []
+        reads = impl.download_reads(
+            readcli, ['1/1/1', '1/2/1'], {'1/1/1': '1/1/1', '1/2/1': '1/2/1'},
+            lambda ref, info: downloaded.append((ref, threading.current_thread())))
+        self.assertEqual(sorted(reads), ['1/1/1', '1/2/1'])
+        # each library is handed on as it arrives, in the calling thread
+        self.assertEqual(downloaded, [('1/2/1', threading.current_thread()),
+                                      ('1/1/1', threading.current_thread())])
+        self.assertEqual(readcli.download_reads.call_count, 2)
+
+        # ReadsUtils rejecting the type of a library is reported as a ValueError
+        typeerr = ServerError('ServerError', -32500,
+                              'Invalid type for object 1/2/1. Supported types: '
+                              'KBaseFile.SingleEndLibrary KBaseFile.PairedEndLibrary '
+                              'KBaseAssembly.SingleEndLibrary KBaseAssembly.PairedEndLibrary')
+        ctx = {'token': 't', 'call_id': 'test_parallel_downloads', 'user_id': 'alice'}
+        params = {'workspace_name': 'ws', 'output_contigset_name': 'contigs'}
+        refs = {'1/1/1': '1/1/1', '1/2/1': '1/2/1'}
+        names = {'1/1/1': 'a', '1/2/1': 'b'}
+        for error, expected in [(typeerr, ValueError),
+                                (ServerError('ServerError', -32500, 'no access'), ServerError)]:
+            with mock.patch('Velvet.VelvetImpl.ReadsUtils') as readsutils:
+                readsutils.return_value.download_reads.side_effect = error
+                with self.assertRaises(expected) as raised:
+                    impl.assemble_reads(ctx, params, ['1/1/1', '1/2/1'], names, refs)
+            if expected is ValueError:
+                self.assertIn('Only the types', str(raised.exception))
+
+    def test_disk_cache_eviction(self):
+        cache_dir = os.path.join(self.scratch, 'test_disk_cache')
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        source = os.path.join(self.scratch, 'test_disk_cache_file')
+        with open(source, 'w') as f:
+            f.write('x' * 100)
+        cache = DiskCache(cache_dir, 250)
+        for key in ['a', 'b']:
+            cache.put(key, {'file': source})
+        os.utime(os.path.join(cache_dir, 'a'), (0, 0))
+        os.utime(os.path.join(cache_dir, 'b'), (1, 1))
+        cache.get('a')
+        cache.put('c', {'file': source})
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        target = os.path.join(self.scratch, 'test_disk_cache_restore')
+        os.makedirs(target, exist_ok=True)
+        self.assertTrue(cache.restore('c', target))
+        self.assertEqual(os.path.getsize(os.path.join(target, 'file')), 100)
+
+    def test_disk_cache_verify(self):
+        cache_dir = os.path.join(self.scratch, 'test_disk_cache_verify')
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        source = os.path.join(self.scratch, 'test_disk_cache_verify_file')
+        with open(source, 'w') as f:
+            f.write('x' * 100)
+        cache = DiskCache(cache_dir, 1000, verify=True)
+        with cache.lock('a'):
+            entry = cache.put('a', {'file': source})
+        self.assertEqual(cache.get('a'), entry)
+        with open(os.path.join(entry, 'file'), 'r+') as f:
+            f.write('y')
+        self.assertIsNone(cache.get('a'))
+        self.assertFalse(os.path.exists(entry))
+        entry = cache.put_json('b', 'info.json', {'x': 1}, {'file': source})
+        self.assertEqual(sorted(os.listdir(entry)), ['.manifest.json', 'file', 'info.json'])
+        with open(os.path.join(entry, 'info.json')) as f:
+            self.assertEqual(json.load(f), {'x': 1})
+        # the staged JSON file does not stay behind
+        self.assertEqual([n for n in os.listdir(cache_dir) if n.startswith('.tmp-')], [])
+
     # Uncomment to skip this test
     @unittest.skip("skipped test_run_velvetg")
     def test_velvetg(self):